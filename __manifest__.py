@@ -1,6 +1,6 @@
 {
     'name': 'Loopjet AI Estimate Integration',
-    'version': '19.0.1.0.3',
+    'version': '19.0.1.0.4',
     'category': 'Sales',
     'summary': 'AI-Powered Estimate Generation from CRM Deals - Transform opportunities into quotes instantly',
     'description': """
@@ -36,9 +36,14 @@
     },
     'data': [
         'security/ir.model.access.csv',
+        'data/ir_cron_data.xml',
         'views/res_config_settings_views.xml',
         'views/crm_lead_views.xml',
         'views/sale_order_views.xml',
+        'views/loopjet_sync_job_views.xml',
+        'views/loopjet_sync_failure_views.xml',
+        'views/loopjet_generation_timing_views.xml',
+        'views/loopjet_generation_request_views.xml',
         'wizard/loopjet_generate_estimate_wizard.xml',
     ],
     'images': [
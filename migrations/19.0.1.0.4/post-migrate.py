@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""
+Move the raw Loopjet responses out of the sale_order table into the
+compressed loopjet.estimate.payload side table, then drop the column.
+"""
+
+from odoo import api, SUPERUSER_ID
+import logging
+
+_logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+
+
+def migrate(cr, version):
+    cr.execute("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'sale_order' AND column_name = 'loopjet_estimate_data'
+    """)
+    if not cr.fetchone():
+        return
+
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    Payload = env['loopjet.estimate.payload']
+    cr.execute("SELECT id FROM sale_order WHERE loopjet_estimate_data IS NOT NULL AND loopjet_estimate_data != ''")
+    order_ids = [row[0] for row in cr.fetchall()]
+
+    for start in range(0, len(order_ids), BATCH_SIZE):
+        batch = order_ids[start:start + BATCH_SIZE]
+        cr.execute("SELECT id, loopjet_estimate_data FROM sale_order WHERE id IN %s", (tuple(batch),))
+        rows = []
+        for order_id, text in cr.fetchall():
+            data, raw_size = Payload._compress(text)
+            rows.append({'sale_order_id': order_id, 'data': data, 'raw_size': raw_size})
+        Payload.create(rows)
+        env.invalidate_all()
+
+    cr.execute("ALTER TABLE sale_order DROP COLUMN loopjet_estimate_data")
+    _logger.info(f"Moved {len(order_ids)} Loopjet estimate responses to compressed storage")
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+"""
+Create the needs-sync flag of the synced models before the ORM adds it.
+
+Only records of the sync domain never sent to Loopjet are flagged. Records
+already in sync, and records that are never synced (confirmed orders, vendor
+bills, internal contacts...), keep the flag NULL so the partial index on it
+stays small and the first "Sync Changes" does not push everything again.
+"""
+
+# table: condition of the records waiting for their first sync
+NEEDS_SYNC_CONDITIONS = {
+    'res_partner': "loopjet_contact_id IS NULL AND (customer_rank > 0 OR supplier_rank > 0)",
+    'product_template': "loopjet_product_id IS NULL AND sale_ok",
+    'sale_order': "loopjet_estimate_id IS NULL AND state IN ('draft', 'sent')",
+    'account_move': "loopjet_invoice_id IS NULL AND move_type IN ('out_invoice', 'out_refund') AND state != 'cancel'",
+}
+
+
+def migrate(cr, version):
+    for table, condition in NEEDS_SYNC_CONDITIONS.items():
+        cr.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS loopjet_needs_sync BOOLEAN")
+        # Only the records to flag are rewritten, the others are left NULL (false)
+        cr.execute(f"UPDATE {table} SET loopjet_needs_sync = TRUE WHERE {condition}")
@@ -1,7 +1,16 @@
 # -*- coding: utf-8 -*-
 
+from . import loopjet_sync_mixin
+from . import loopjet_sync_job
+from . import loopjet_sync_failure
+from . import loopjet_generation_timing
+from . import loopjet_generation_request
+from . import loopjet_estimate_payload
+from . import res_company
 from . import res_config_settings
 from . import crm_lead
+from . import mail_message
+from . import mail_activity
 from . import sale_order
 from . import product_template
 from . import res_partner
@@ -1,14 +1,21 @@
 # -*- coding: utf-8 -*-
 
 from odoo import models, fields, api
-import requests
 import logging
 
 _logger = logging.getLogger(__name__)
 
 
 class AccountMove(models.Model):
-    _inherit = 'account.move'
+    _name = 'account.move'
+    _inherit = ['account.move', 'loopjet.sync.mixin']
+
+    _loopjet_auto_sync_param = 'loopjet.auto_sync_invoices'
+    _loopjet_batch_endpoint = 'invoices'
+    _loopjet_id_field = 'loopjet_invoice_id'
+    _loopjet_payload_fields = {
+        'name', 'partner_id', 'invoice_date', 'invoice_date_due', 'state', 'move_type', 'invoice_line_ids',
+    }
 
     loopjet_invoice_id = fields.Char(
         string='Loopjet Invoice ID',
@@ -29,105 +36,170 @@ class AccountMove(models.Model):
         help='Last time this invoice was synced to Loopjet'
     )
 
+    def _loopjet_sync_domain(self):
+        """Only customer invoices are synced, not bills or other types."""
+        return [('move_type', 'in', ['out_invoice', 'out_refund']), ('state', '!=', 'cancel')]
+
+    def _prepare_loopjet_data(self):
+        """Prepare invoice data for the Loopjet API."""
+        self.ensure_one()
+        invoice_data = {
+            'invoice_number': self.name,
+            'customer_info': {
+                'name': self.partner_id.name,
+                'email': self.partner_id.email,
+                'phone': self.partner_id.phone,
+            },
+            'issue_date': self.invoice_date.isoformat() if self.invoice_date else None,
+            'due_date': self.invoice_date_due.isoformat() if self.invoice_date_due else None,
+            'status': 'sent' if self.state == 'posted' else 'draft',
+            'items': [],
+            'subtotal': float(self.amount_untaxed),
+            'total_tax': float(self.amount_tax),
+            'total': float(self.amount_total),
+            'external_id': str(self.id),
+            'external_system': 'odoo',
+        }
+        
+        # Add line items
+        for line in self.invoice_line_ids:
+            if line.product_id:
+                invoice_data['items'].append({
+                    'external_id': str(line.id),
+                    'name': line.product_id.name,
+                    'description': line.name,
+                    'quantity': line.quantity,
+                    'unit_price': float(line.price_unit),
+                    'unit': line.product_uom_id.name if line.product_uom_id else 'unit',
+                })
+        
+        return invoice_data
+
+    def _prepare_loopjet_batch_data(self):
+        """Prepare invoice data for the batch endpoint."""
+        invoice_data = self._prepare_loopjet_data()
+        invoice_data['customer_id'] = None  # Will be matched by name
+        return invoice_data
+
+    def _loopjet_lines_changed(self):
+        """
+        Flag customer invoices whose lines were created, updated or removed, and schedule their sync.
+
+        The sync is scheduled even when the invoice is already flagged; the
+        post-commit hook sends each invoice once per transaction.
+        """
+        customer_invoices = self.filtered(lambda i: i.move_type in ['out_invoice', 'out_refund'] and i.state != 'cancel')
+        unflagged = customer_invoices.filtered(lambda i: not i.loopjet_needs_sync)
+        if unflagged:
+            unflagged.write({'loopjet_needs_sync': True})
+        if customer_invoices._loopjet_auto_sync_enabled():
+            customer_invoices.filtered('loopjet_synced')._loopjet_schedule_sync()
+
     def sync_to_loopjet(self):
-        """Sync this invoice to Loopjet."""
-        for invoice in self:
-            # Only sync customer invoices, not bills or other types
-            if invoice.move_type not in ['out_invoice', 'out_refund'] or invoice.state == 'cancel':
-                continue
+        """Sync these invoices to Loopjet, logging one summary line for the run."""
+        with self._loopjet_sync_log() as log:
+            for invoice in self:
+                # Only sync customer invoices, not bills or other types
+                if invoice.move_type not in ['out_invoice', 'out_refund'] or invoice.state == 'cancel':
+                    continue
                 
-            try:
-                # Get API configuration
-                api_key = self.env['ir.config_parameter'].sudo().get_param('loopjet.api_key')
-                if not api_key:
-                    _logger.warning('Loopjet API key not configured, skipping invoice sync')
-                    return
+                try:
+                    # Get API configuration for the invoice's company
+                    company = invoice._loopjet_get_company()
+                    if not company._loopjet_get_api_key():
+                        log.skip('no_api_key')
+                        continue
                 
-                api_url = 'https://loopjet-api.fly.dev'
-                headers = {
-                    'Authorization': f'Bearer {api_key}',
-                    'Content-Type': 'application/json',
-                }
+                    api_url = company._loopjet_get_api_url()
+                    headers = company._loopjet_get_api_headers()
+                    session = company._loopjet_get_session()
                 
-                # Prepare invoice data
-                invoice_data = {
-                    'invoice_number': invoice.name,
-                    'customer_info': {
-                        'name': invoice.partner_id.name,
-                        'email': invoice.partner_id.email,
-                        'phone': invoice.partner_id.phone,
-                    },
-                    'issue_date': invoice.invoice_date.isoformat() if invoice.invoice_date else None,
-                    'due_date': invoice.invoice_date_due.isoformat() if invoice.invoice_date_due else None,
-                    'status': 'sent' if invoice.state == 'posted' else 'draft',
-                    'items': [],
-                    'subtotal': float(invoice.amount_untaxed),
-                    'total_tax': float(invoice.amount_tax),
-                    'total': float(invoice.amount_total),
-                    'external_id': str(invoice.id),
-                    'external_system': 'odoo',
-                }
-                
-                # Add line items
-                for line in invoice.invoice_line_ids:
-                    if line.product_id:
-                        invoice_data['items'].append({
-                            'name': line.product_id.name,
-                            'description': line.name,
-                            'quantity': line.quantity,
-                            'unit_price': float(line.price_unit),
-                            'unit': line.product_uom_id.name if line.product_uom_id else 'unit',
-                        })
+                    # Prepare invoice data
+                    invoice_data = invoice._prepare_loopjet_data()
+                    log.payload(invoice.id, invoice_data)
                 
-                # If already synced, update; otherwise create
-                if invoice.loopjet_invoice_id:
-                    url = f"{api_url}/api/v1/invoices/{invoice.loopjet_invoice_id}"
-                    response = requests.put(url, json=invoice_data, headers=headers, timeout=30)
-                else:
-                    url = f"{api_url}/api/v1/invoices/"
-                    response = requests.post(url, json=invoice_data, headers=headers, timeout=30)
+                    # If already synced, update; otherwise create
+                    if invoice.loopjet_invoice_id:
+                        url = f"{api_url}/api/v1/invoices/{invoice.loopjet_invoice_id}"
+                        response = invoice._loopjet_send_update(company, url, invoice_data)
+                    else:
+                        url = f"{api_url}/api/v1/invoices/"
+                        response = session.post(url, json=invoice_data, headers=headers, timeout=30)
                 
-                if response.status_code in [200, 201]:
-                    result = response.json()
-                    invoice.write({
-                        'loopjet_invoice_id': result.get('id'),
-                        'loopjet_synced': True,
-                        'loopjet_last_sync': fields.Datetime.now(),
-                    })
-                    _logger.info(f"Successfully synced invoice {invoice.name} to Loopjet")
-                else:
-                    _logger.error(f"Failed to sync invoice {invoice.name}: {response.text}")
+                    if response.status_code in [200, 201]:
+                        result = response.json()
+                        invoice.write({
+                            'loopjet_invoice_id': result.get('id') or invoice.loopjet_invoice_id,
+                            'loopjet_synced': True,
+                            **invoice._loopjet_sync_state_vals(invoice_data),
+                        })
+                        invoice._loopjet_clear_failure()
+                        log.ok()
+                    else:
+                        log.fail(invoice.id, f'HTTP{response.status_code}', response.text)
+                        invoice._loopjet_record_failure('HTTPError', response.text, response.status_code)
                     
-            except Exception as e:
-                _logger.error(f"Error syncing invoice {invoice.name} to Loopjet: {str(e)}")
+                except Exception as e:
+                    log.fail(invoice.id, type(e).__name__, str(e))
+                    invoice._loopjet_record_failure(type(e).__name__, str(e))
 
-    @api.model
+    @api.model_create_multi
     def create(self, vals_list):
-        """Auto-sync to Loopjet if enabled."""
+        """Schedule a post-commit sync to Loopjet if auto-sync is enabled."""
         invoices = super(AccountMove, self).create(vals_list)
+        invoices._loopjet_flag_new()
         
-        auto_sync = self.env['ir.config_parameter'].sudo().get_param('loopjet.auto_sync_invoices', False)
-        if auto_sync:
+        if invoices._loopjet_auto_sync_enabled():
             customer_invoices = invoices.filtered(lambda i: i.move_type in ['out_invoice', 'out_refund'] and i.state != 'cancel')
             if customer_invoices:
-                customer_invoices.sync_to_loopjet()
+                customer_invoices._loopjet_schedule_sync()
         
         return invoices
     
     def write(self, vals):
-        """Auto-sync to Loopjet if enabled and invoice is already synced."""
+        """Schedule a post-commit sync to Loopjet if auto-sync is enabled and invoice is already synced."""
         result = super(AccountMove, self).write(vals)
+        self._loopjet_flag_dirty(vals)
         
-        # Don't trigger sync if only Loopjet metadata fields are being updated
-        loopjet_fields = {'loopjet_invoice_id', 'loopjet_synced', 'loopjet_last_sync'}
-        if set(vals.keys()).issubset(loopjet_fields):
+        # Only changes of the fields feeding the payload are worth a sync (this also prevents
+        # the metadata written after a sync from triggering another one)
+        if not self._loopjet_payload_changed(vals):
             return result
         
-        auto_sync = self.env['ir.config_parameter'].sudo().get_param('loopjet.auto_sync_invoices', False)
-        if auto_sync:
+        if self._loopjet_auto_sync_enabled():
             synced_invoices = self.filtered(lambda i: i.loopjet_synced and i.move_type in ['out_invoice', 'out_refund'] and i.state != 'cancel')
             if synced_invoices:
-                synced_invoices.sync_to_loopjet()
+                synced_invoices._loopjet_schedule_sync()
         
         return result
 
+
+class AccountMoveLine(models.Model):
+    _inherit = 'account.move.line'
+
+    # Line fields whose values end up in the invoice payload (items and totals).
+    # Reconciliation and other accounting updates of the lines are ignored.
+    _loopjet_payload_fields = {
+        'product_id', 'name', 'quantity', 'product_uom_id', 'price_unit', 'discount', 'tax_ids',
+    }
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        """Flag the invoices of new lines as changed."""
+        lines = super(AccountMoveLine, self).create(vals_list)
+        lines.filtered(lambda l: l.display_type == 'product').move_id._loopjet_lines_changed()
+        return lines
+
+    def write(self, vals):
+        """Flag the invoices as changed when a field of the payload is updated."""
+        result = super(AccountMoveLine, self).write(vals)
+        if self._loopjet_payload_fields.intersection(vals):
+            self.filtered(lambda l: l.display_type == 'product').move_id._loopjet_lines_changed()
+        return result
+
+    def unlink(self):
+        """Flag the invoices of removed lines as changed."""
+        moves = self.filtered(lambda l: l.display_type == 'product').move_id
+        result = super(AccountMoveLine, self).unlink()
+        moves.exists()._loopjet_lines_changed()
+        return result
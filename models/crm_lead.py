@@ -2,20 +2,169 @@
 
 from odoo import models, fields, api, _
 from odoo.exceptions import UserError
+from collections import OrderedDict
+from html.parser import HTMLParser
 import logging
+import psycopg2
+import re
+import threading
 
 _logger = logging.getLogger(__name__)
 
+# Context sent to the AI: candidates fetched per deal, and rough size estimate
+_CONTEXT_ACTIVITY_LIMIT = 50
+_CONTEXT_MESSAGE_LIMIT = 100
+_CHARS_PER_TOKEN = 4
+_MIN_ITEM_CHARS = 200
+_DEDUP_FINGERPRINT_CHARS = 300
+_CONTEXT_HALF_LIFE_DAYS = 30
+_CONTEXT_SECTIONS = ['Description', 'Activities', 'Conversation History', 'Internal Notes']
+
+# Start of the quoted part of a reply or forward
+_QUOTE_HEADER_RE = re.compile(
+    r'^(on .{0,200} wrote:|le .{0,200} a écrit ?:|am .{0,200} schrieb .{0,100}:|-{2,} ?original message ?-{2,}'
+    r'|-{2,} ?forwarded message ?-{2,}|from: .+|de ?: .+|von: .+)$',
+    re.IGNORECASE,
+)
+# Start of a signature block
+_SIGNATURE_RE = re.compile(
+    r'^(--|__+|(best|kind|warm)( regards)?,?|regards,?|cheers,?|thanks,?|thank you,?|sent from my .+'
+    r'|cordialement,?|mit freundlichen grüßen,?|met vriendelijke groet(en)?,?)$',
+    re.IGNORECASE,
+)
+# Legal footers appended by mail servers
+_DISCLAIMER_RE = re.compile(
+    r'(this (e-?mail|message)( and any attachments?)? (is|are|may be) confidential|confidentiality notice|disclaimer:)',
+    re.IGNORECASE,
+)
+# Words and figures that make a text useful to build a quotation
+_RELEVANT_TERMS_RE = re.compile(
+    r'\b(?:quote|quotation|estimate|offer|price|pricing|cost|budget|quantity|qty|units?|pieces?|hours?|days?'
+    r'|deliver(?:y|ed)?|deadline|install(?:ation)?|need|needs|require[sd]?|want|scope|discount)\b',
+    re.IGNORECASE,
+)
+_FIGURE_RE = re.compile(r'\d+(?:[.,]\d+)?')
+
+# HTML to text: elements whose content is never shown or only quotes earlier mails
+_HTML_SKIPPED_TAGS = {'style', 'script', 'head', 'title', 'template', 'blockquote'}
+_HTML_QUOTE_CLASS_RE = re.compile(r'gmail_quote|yahoo_quoted|moz-cite-prefix|divRplyFwdMsg')
+_HTML_VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source', 'track', 'wbr'}
+_HTML_BLOCK_TAGS = {
+    'address', 'article', 'aside', 'br', 'dd', 'div', 'dl', 'dt', 'footer', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+    'header', 'hr', 'li', 'ol', 'p', 'pre', 'section', 'table', 'tr', 'ul',
+}
+_HTML_FEED_CHUNK = 8192
+_BASE64_RE = re.compile(r'[A-Za-z0-9+/=]{200,}')
+
+# Plain text of chatter messages per (database, message, write date, limit), shared by the worker threads
+_LOOPJET_TEXT_CACHE = OrderedDict()
+_LOOPJET_TEXT_CACHE_LOCK = threading.Lock()
+_LOOPJET_TEXT_CACHE_SIZE = 5000
+
+
+class _HtmlTextExtractor(HTMLParser):
+    """Collect the visible text of an HTML document, up to a number of characters."""
+
+    def __init__(self, limit):
+        super().__init__(convert_charrefs=True)
+        self.limit = limit
+        self.parts = []
+        self.length = 0
+        self.skip_tag = None
+        self.skip_depth = 0
+
+    @property
+    def full(self):
+        return self.length >= self.limit
+
+    def handle_starttag(self, tag, attrs):
+        if self.skip_tag:
+            if tag == self.skip_tag:
+                self.skip_depth += 1
+            return
+        if tag in _HTML_SKIPPED_TAGS or any(name == 'class' and value and _HTML_QUOTE_CLASS_RE.search(value) for name, value in attrs):
+            if tag not in _HTML_VOID_TAGS:
+                self.skip_tag, self.skip_depth = tag, 1
+            return
+        if tag in _HTML_BLOCK_TAGS:
+            self._append('\n')
+
+    def handle_endtag(self, tag):
+        if self.skip_tag:
+            if tag == self.skip_tag:
+                self.skip_depth -= 1
+                if not self.skip_depth:
+                    self.skip_tag = None
+            return
+        if tag in _HTML_BLOCK_TAGS:
+            self._append('\n')
+
+    def handle_data(self, data):
+        if not self.skip_tag:
+            # Source line breaks are not rendered, only block elements break lines
+            self._append(re.sub(r'\s+', ' ', _BASE64_RE.sub('', data)))
+
+    def _append(self, text):
+        if text and not self.full:
+            self.parts.append(text)
+            self.length += len(text)
+
+    def get_text(self):
+        text = ''.join(self.parts)[:self.limit]
+        return '\n'.join(line.strip() for line in text.splitlines() if line.strip())
+
+
+def _loopjet_html_to_text(html, limit):
+    """
+    Convert HTML to plain text, stopping once ``limit`` characters are collected.
+
+    The HTML is parsed incrementally, so the rest of a huge email (inline
+    images, big tables) is never parsed. Styles, scripts, quoted replies and
+    base64 blobs are skipped; block elements become line breaks.
+    """
+    if not html:
+        return ''
+    if '<' not in html:
+        return html[:limit].strip()
+
+    parser = _HtmlTextExtractor(limit)
+    for start in range(0, len(html), _HTML_FEED_CHUNK):
+        parser.feed(html[start:start + _HTML_FEED_CHUNK])
+        if parser.full:
+            break
+    else:
+        parser.close()
+    return parser.get_text()
+
 
 class CrmLead(models.Model):
     _inherit = 'crm.lead'
 
+    # Lead fields used in the deal digest sent to the AI
+    _loopjet_digest_fields = {'name', 'partner_id', 'expected_revenue', 'probability', 'stage_id', 'description', 'tag_ids'}
+
     loopjet_estimate_count = fields.Integer(
         string='Loopjet Estimates',
         compute='_compute_loopjet_estimate_count',
         help='Number of estimates generated via Loopjet for this opportunity'
     )
 
+    loopjet_deal_digest = fields.Text(
+        string='Loopjet Deal Digest',
+        readonly=True,
+        copy=False,
+        help='Deal information last extracted for Loopjet AI, rebuilt when the deal or its chatter changes'
+    )
+
+    loopjet_digest_stale = fields.Boolean(
+        string='Loopjet Digest Outdated',
+        default=True,
+        readonly=True,
+        copy=False,
+        index=True,
+        help='Set when the deal, its messages or its activities changed since the digest was built'
+    )
+
     def _compute_loopjet_estimate_count(self):
         """Count sale orders created via Loopjet for this lead."""
         for lead in self:
@@ -43,9 +192,9 @@ class CrmLead(models.Model):
         """Open wizard to generate estimate with Loopjet AI."""
         self.ensure_one()
         
-        # Check if API key is configured
-        api_key = self.env['ir.config_parameter'].sudo().get_param('loopjet.api_key')
-        if not api_key:
+        # Check if API key is configured for the opportunity's company
+        company = self.company_id or self.env.company
+        if not company._loopjet_get_api_key():
             raise UserError(_(
                 'Loopjet API key not configured.\n\n'
                 'Please configure your Loopjet API key in:\n'
@@ -86,16 +235,181 @@ class CrmLead(models.Model):
         action['domain'] = domain
         return action
     
+    def write(self, vals):
+        """Outdate the Loopjet deal digest when a field it contains changes."""
+        if self._loopjet_digest_fields.intersection(vals):
+            vals = dict(vals, loopjet_digest_stale=True)
+        return super(CrmLead, self).write(vals)
+
+    @api.model
+    def _loopjet_mark_digest_stale(self, lead_ids):
+        """
+        Outdate the deal digest of these leads after a chatter or activity change.
+
+        Updated in SQL, so posting a message does not rewrite the lead (write
+        date, tracking, recomputations).
+        """
+        lead_ids = list(set(filter(None, lead_ids)))
+        if not lead_ids:
+            return
+        self.env.cr.execute(
+            'UPDATE crm_lead SET loopjet_digest_stale = TRUE WHERE id IN %s AND NOT loopjet_digest_stale',
+            (tuple(lead_ids),),
+        )
+        self.browse(lead_ids).invalidate_recordset(['loopjet_digest_stale'])
+
+    def _loopjet_get_deal_digest(self):
+        """
+        Get the deal information for Loopjet AI, from the stored digest if it is up to date.
+        
+        An outdated digest is extracted again but not stored: opening the
+        estimate wizard must not lock the lead, the pre-build cron refreshes it.
+        
+        Returns:
+            str: formatted deal information
+        """
+        self.ensure_one()
+        if self.loopjet_digest_stale or not self.loopjet_deal_digest:
+            return self.extract_deal_information()
+        return self.loopjet_deal_digest
+
+    def _loopjet_refresh_digest(self):
+        """
+        Rebuild the stored deal digest of these leads.
+
+        Stored in SQL like ``_loopjet_mark_digest_stale``, so the refresh does
+        not rewrite the lead (write date and user, tracking). Leads locked or
+        changed by a concurrent transaction are skipped, they stay outdated
+        until the next refresh.
+        """
+        self.flush_recordset(['loopjet_deal_digest', 'loopjet_digest_stale'])
+        for lead in self:
+            digest = lead.extract_deal_information()
+            try:
+                with self.env.cr.savepoint():
+                    self.env.cr.execute("""
+                        UPDATE crm_lead SET loopjet_deal_digest = %s, loopjet_digest_stale = FALSE
+                         WHERE id = (SELECT id FROM crm_lead WHERE id = %s FOR UPDATE SKIP LOCKED)
+                    """, (digest, lead.id))
+            except psycopg2.errors.SerializationFailure:
+                _logger.debug(f"Lead {lead.id} changed while its Loopjet deal digest was built, kept outdated")
+        self.invalidate_recordset(['loopjet_deal_digest', 'loopjet_digest_stale'])
+
+    @api.model
+    def _cron_loopjet_prewarm_digests(self):
+        """Rebuild outdated deal digests of open opportunities, so the estimate wizard opens instantly."""
+        limit = int(self.env['ir.config_parameter'].sudo().get_param('loopjet.digest_prewarm_limit', 200))
+        leads = self.search([
+            ('type', '=', 'opportunity'),
+            ('stage_id.is_won', '=', False),
+            ('loopjet_digest_stale', '=', True),
+        ], order='write_date desc', limit=limit)
+        leads._loopjet_refresh_digest()
+        _logger.info(f"Pre-built the Loopjet deal digest of {len(leads)} opportunities")
+
+    def _loopjet_clean_text(self, text):
+        """
+        Reduce a chatter text to what the writer actually wrote.
+
+        Quoted replies (``>`` lines and everything after an "On ... wrote:" or
+        forwarded-message header), signatures and legal disclaimers are cut.
+        """
+        lines = []
+        for line in text.splitlines():
+            stripped = line.strip()
+            if _QUOTE_HEADER_RE.match(stripped) or _SIGNATURE_RE.match(stripped):
+                break
+            if stripped.startswith('>'):
+                continue
+            lines.append(stripped)
+        text = '\n'.join(line for line in lines if line)
+        disclaimer = _DISCLAIMER_RE.search(text)
+        if disclaimer:
+            text = text[:disclaimer.start()]
+        return text.strip()
+
+    def _loopjet_context_score(self, text, date, weight, now):
+        """
+        Rank a context item by recency and relevance for quotation.
+
+        Recency halves every ``_CONTEXT_HALF_LIFE_DAYS`` days; relevance grows
+        with quoting vocabulary and figures (quantities, prices, dates).
+        """
+        age_days = max((now - date).total_seconds() / 86400, 0) if date else 0
+        recency = 0.5 ** (age_days / _CONTEXT_HALF_LIFE_DAYS)
+        relevance = 1 + len(_RELEVANT_TERMS_RE.findall(text)) * 0.5 + min(len(_FIGURE_RE.findall(text)), 10) * 0.2
+        return weight * recency * relevance
+
+    @api.model
+    def _loopjet_message_text(self, message, limit):
+        """Plain text of a chatter message, cached per message as long as its body is unchanged."""
+        key = (self.env.cr.dbname, message.id, str(message.write_date), limit)
+        with _LOOPJET_TEXT_CACHE_LOCK:
+            text = _LOOPJET_TEXT_CACHE.get(key)
+            if text is not None:
+                _LOOPJET_TEXT_CACHE.move_to_end(key)
+                return text
+
+        text = _loopjet_html_to_text(message.body, limit)
+        with _LOOPJET_TEXT_CACHE_LOCK:
+            _LOOPJET_TEXT_CACHE[key] = text
+            if len(_LOOPJET_TEXT_CACHE) > _LOOPJET_TEXT_CACHE_SIZE:
+                _LOOPJET_TEXT_CACHE.popitem(last=False)
+        return text
+
+    def _loopjet_context_candidates(self, text_limit):
+        """
+        Collect the description, activities, messages and notes of the deal as context items.
+
+        Args:
+            text_limit: characters extracted from each HTML text, before cleaning
+
+        Returns:
+            list: (section, text, date, weight) tuples, cleaned and not yet ranked
+        """
+        self.ensure_one()
+        candidates = []
+        if self.description:
+            description = self._loopjet_clean_text(_loopjet_html_to_text(self.description, text_limit))
+            if description:
+                candidates.append(('Description', description, False, 3.0))
+
+        activities = self.env['mail.activity'].search([
+            ('res_id', '=', self.id),
+            ('res_model', '=', 'crm.lead'),
+        ], order='date_deadline desc', limit=_CONTEXT_ACTIVITY_LIMIT)
+        for activity in activities:
+            activity_text = f"[{activity.activity_type_id.name}] {activity.summary or ''}"
+            if activity.note:
+                activity_text += f": {self._loopjet_clean_text(_loopjet_html_to_text(activity.note, text_limit))}"
+            candidates.append(('Activities', activity_text.strip(), fields.Datetime.to_datetime(activity.date_deadline), 0.6))
+
+        messages = self.env['mail.message'].search([
+            ('model', '=', 'crm.lead'),
+            ('res_id', '=', self.id),
+            ('message_type', 'in', ['comment', 'email', 'notification']),
+            ('body', '!=', False),
+        ], order='date desc', limit=_CONTEXT_MESSAGE_LIMIT)
+        for message in messages:
+            text = self._loopjet_clean_text(self._loopjet_message_text(message, text_limit))
+            if not text:
+                continue
+            if message.message_type == 'notification' or message.subtype_id.internal:
+                candidates.append(('Internal Notes', text, message.date, 0.8))
+            else:
+                candidates.append(('Conversation History', f"[{message.date}] {text}", message.date, 1.0))
+        return candidates
+
     def extract_deal_information(self):
         """
-        Extract comprehensive information from the CRM deal.
-        
-        Returns a formatted text suitable for AI processing, including:
-        - Deal description and notes
-        - Activities and logs
-        - Messages and comments
-        - Customer information
-        - Expected revenue and probability
+        Extract the information of the CRM deal for AI processing, within a size budget.
+        
+        The deal summary (customer, revenue, stage, tags) always comes first.
+        The description, activities, messages and notes are then cleaned of
+        quoted replies and boilerplate, deduplicated, ranked by recency and
+        relevance, and added best first until ``loopjet.context_token_budget``
+        (1500 tokens by default, estimated at 4 characters per token) is used.
+        Selected items are presented by section, newest first.
         """
         self.ensure_one()
         
@@ -118,61 +432,48 @@ class CrmLead(models.Model):
         if self.stage_id:
             info_parts.append(f"Stage: {self.stage_id.name}")
         
-        # Description/notes
-        if self.description:
-            info_parts.append(f"\nDescription:\n{self.description}")
+        # Tags
+        if self.tag_ids:
+            info_parts.append(f"Tags: {', '.join(self.tag_ids.mapped('name'))}")
         
-        # Extract activities
-        activities = self.env['mail.activity'].search([
-            ('res_id', '=', self.id),
-            ('res_model', '=', 'crm.lead'),
-        ], order='date_deadline desc', limit=20)
+        ICP = self.env['ir.config_parameter'].sudo()
+        token_budget = int(ICP.get_param('loopjet.context_token_budget', 1500))
+        item_chars = int(ICP.get_param('loopjet.context_item_chars', 1200))
+        remaining = token_budget * _CHARS_PER_TOKEN - sum(len(part) + 1 for part in info_parts)
         
-        if activities:
-            info_parts.append("\nActivities:")
-            for activity in activities:
-                activity_text = f"- [{activity.activity_type_id.name}] {activity.summary or ''}"
-                if activity.note:
-                    activity_text += f": {activity.note}"
-                info_parts.append(activity_text)
+        # Rank all items, keeping the first occurrence of duplicated texts (forwarded or re-quoted)
+        now = fields.Datetime.now()
+        ranked = []
+        seen = set()
+        for index, (section, text, date, weight) in enumerate(self._loopjet_context_candidates(item_chars * 2)):
+            fingerprint = ' '.join(text.lower().split())[-_DEDUP_FINGERPRINT_CHARS:]
+            if fingerprint in seen:
+                continue
+            seen.add(fingerprint)
+            ranked.append((self._loopjet_context_score(text, date, weight, now), index, section, text[:item_chars]))
+        ranked.sort(key=lambda item: (-item[0], item[1]))
         
-        # Extract messages and comments
-        messages = self.env['mail.message'].search([
-            ('model', '=', 'crm.lead'),
-            ('res_id', '=', self.id),
-            ('message_type', 'in', ['comment', 'email']),
-        ], order='date desc', limit=20)
-        
-        if messages:
-            info_parts.append("\nConversation History:")
-            for message in messages:
-                if message.body:
-                    # Clean HTML tags from body
-                    from markupsafe import Markup
-                    clean_body = Markup(message.body).striptags()
-                    if clean_body.strip():
-                        info_parts.append(f"- [{message.date}] {clean_body[:500]}")
-        
-        # Extract logged notes
-        notes = self.env['mail.message'].search([
-            ('model', '=', 'crm.lead'),
-            ('res_id', '=', self.id),
-            ('message_type', '=', 'notification'),
-        ], order='date desc', limit=10)
-        
-        if notes:
-            info_parts.append("\nInternal Notes:")
-            for note in notes:
-                if note.body:
-                    from markupsafe import Markup
-                    clean_body = Markup(note.body).striptags()
-                    if clean_body.strip():
-                        info_parts.append(f"- {clean_body[:300]}")
+        selected = []
+        for score, index, section, text in ranked:
+            cost = len(text) + 3
+            if cost > remaining:
+                if remaining < _MIN_ITEM_CHARS:
+                    break
+                # Keep the beginning of an item that does not fit entirely
+                text = text[:remaining - 4] + '…'
+                cost = remaining
+            selected.append((index, section, text))
+            remaining -= cost
         
-        # Tags
-        if self.tag_ids:
-            tags_text = ", ".join(self.tag_ids.mapped('name'))
-            info_parts.append(f"\nTags: {tags_text}")
+        # Present the selected items by section, in their original (newest first) order
+        for section in _CONTEXT_SECTIONS:
+            section_items = sorted((index, text) for index, item_section, text in selected if item_section == section)
+            if not section_items:
+                continue
+            if section == 'Description':
+                info_parts.append(f"\nDescription:\n{section_items[0][1]}")
+            else:
+                info_parts.append(f"\n{section}:")
+                info_parts.extend(f"- {text}" for index, text in section_items)
         
         return "\n".join(info_parts)
-
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api
+from datetime import timedelta
+import base64
+import gzip
+import json
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+class LoopjetEstimatePayload(models.Model):
+    """
+    Raw Loopjet API response of an AI generated quotation.
+
+    Kept out of the sale_order table, gzip compressed, so loading quotations
+    does not depend on the size of the AI responses. The response is only
+    read when the Loopjet tab of a quotation shows it.
+    """
+    _name = 'loopjet.estimate.payload'
+    _description = 'Loopjet Estimate Payload'
+
+    sale_order_id = fields.Many2one(
+        'sale.order',
+        string='Quotation',
+        required=True,
+        index=True,
+        ondelete='cascade',
+    )
+
+    data = fields.Binary(
+        string='Compressed Response',
+        attachment=False,
+        help='Gzip compressed JSON response'
+    )
+
+    raw_size = fields.Integer(
+        string='Size (bytes)',
+        help='Size of the uncompressed response'
+    )
+
+    @api.model
+    def _compress(self, text):
+        """Compress a response, minifying it when it is valid JSON."""
+        try:
+            text = json.dumps(json.loads(text), separators=(',', ':'), ensure_ascii=False)
+        except ValueError:
+            pass
+        raw = text.encode()
+        return base64.b64encode(gzip.compress(raw)), len(raw)
+
+    @api.model
+    def _decompress(self, data):
+        """Decompress a response, indented for display when it is valid JSON."""
+        text = gzip.decompress(base64.b64decode(data)).decode()
+        try:
+            return json.dumps(json.loads(text), indent=2, ensure_ascii=False)
+        except ValueError:
+            return text
+
+    @api.model
+    def _load(self, orders):
+        """
+        Get the responses of these quotations in one query.
+
+        Returns:
+            dict: response text by sale order ID
+        """
+        payloads = self.sudo().search([('sale_order_id', 'in', orders.ids)])
+        return {payload.sale_order_id.id: self._decompress(payload.data)
+                for payload in payloads if payload.data}
+
+    @api.model
+    def _store(self, order, text):
+        """Store (or clear, when text is empty) the response of a quotation."""
+        payload = self.sudo().search([('sale_order_id', '=', order.id)], limit=1)
+        if not text:
+            payload.unlink()
+            return
+        data, raw_size = self._compress(text)
+        if payload:
+            payload.write({'data': data, 'raw_size': raw_size})
+        else:
+            self.sudo().create({'sale_order_id': order.id, 'data': data, 'raw_size': raw_size})
+
+    @api.autovacuum
+    def _gc_payloads(self):
+        """
+        Delete responses older than ``loopjet.estimate_payload_retention_days``
+        (365 by default, 0 keeps them forever). The AI reasoning and the
+        quotation lines are kept.
+        """
+        days = int(self.env['ir.config_parameter'].sudo().get_param('loopjet.estimate_payload_retention_days', 365))
+        if days <= 0:
+            return
+        old = self.sudo().search([('create_date', '<', fields.Datetime.now() - timedelta(days=days))])
+        if old:
+            _logger.info(f"Pruning {len(old)} Loopjet estimate responses older than {days} days")
+            old.unlink()
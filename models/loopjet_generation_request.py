@@ -0,0 +1,397 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+from datetime import timedelta
+import logging
+import time
+
+_logger = logging.getLogger(__name__)
+
+# PostgreSQL advisory lock key serializing admission decisions across workers
+_ADMISSION_LOCK_KEY = 1279918337
+
+# Default limits, see _get_limits()
+_DEFAULT_LIMITS = {
+    'max_concurrent_generations': 4,
+    'max_generations_per_user': 1,
+    'generation_queue_size': 10,
+    'generation_queue_timeout': 1800,
+    'generation_timeout': 600,
+}
+
+
+class LoopjetGenerationRequest(models.Model):
+    """
+    Admission ticket of an AI estimate generation.
+
+    The tickets form a database-backed semaphore shared by all workers: a
+    generation only calls Loopjet once its ticket is running, and at most
+    ``loopjet.max_concurrent_generations`` tickets (and
+    ``loopjet.max_generations_per_user`` per user) run at the same time.
+    Others are queued in FIFO order and run by the queue cron as their user,
+    so no request waits for a slot. A second request for an opportunity that
+    is already being quoted joins the running ticket instead of starting
+    another generation, and its user is notified when the quotation is ready.
+
+    Tickets are written on dedicated cursors committed right away, so other
+    workers see them while the generation runs.
+    """
+    _name = 'loopjet.generation.request'
+    _description = 'Loopjet Generation Request'
+    _order = 'id desc'
+
+    lead_id = fields.Many2one(
+        'crm.lead',
+        string='Opportunity',
+        required=True,
+        index=True,
+        ondelete='cascade',
+    )
+
+    user_id = fields.Many2one(
+        'res.users',
+        string='Requested By',
+        required=True,
+        index=True,
+    )
+
+    company_id = fields.Many2one(
+        'res.company',
+        string='Company',
+    )
+
+    state = fields.Selection([
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ], string='Status', default='queued', required=True, index=True)
+
+    started_at = fields.Datetime(
+        string='Started',
+        readonly=True,
+    )
+
+    finished_at = fields.Datetime(
+        string='Finished',
+        readonly=True,
+    )
+
+    heartbeat_at = fields.Datetime(
+        string='Last Sign of Life',
+        readonly=True,
+        help='Refreshed while the generation makes progress; a running ticket without sign of life for '
+             'loopjet.generation_timeout seconds is considered dead and its slot is freed'
+    )
+
+    sale_order_id = fields.Many2one(
+        'sale.order',
+        string='Quotation',
+        ondelete='set null',
+    )
+
+    error_message = fields.Text(
+        string='Error',
+    )
+
+    extracted_info = fields.Text(
+        string='Deal Information',
+        help='Deal information sent to the AI when the request runs from the queue'
+    )
+
+    additional_instructions = fields.Text(
+        string='Additional Instructions',
+    )
+
+    allow_new_items = fields.Boolean(
+        string='Allow New Items',
+    )
+
+    waiting_user_ids = fields.Many2many(
+        'res.users',
+        string='Joined By',
+        help='Users who requested the same opportunity while it was being quoted, notified when it is done'
+    )
+
+    @api.model
+    def _get_limits(self):
+        """Admission limits, from the ``loopjet.<name>`` system parameters."""
+        get_param = self.env['ir.config_parameter'].sudo().get_param
+        return {name: int(get_param(f'loopjet.{name}', default)) for name, default in _DEFAULT_LIMITS.items()}
+
+    @api.model
+    def _lock_admission(self):
+        """Serialize admission decisions until the end of the current transaction."""
+        self.env.cr.execute('SELECT pg_advisory_xact_lock(%s)', (_ADMISSION_LOCK_KEY,))
+
+    @api.model
+    def _expire_stale(self, limits):
+        """
+        Fail tickets of generations that died without releasing them (e.g. a
+        killed worker) and queued tickets that waited too long.
+
+        A running ticket is dead when its generation gave no sign of life for
+        ``loopjet.generation_timeout`` seconds, see _heartbeat().
+        """
+        now = fields.Datetime.now()
+        running = self.sudo().search([
+            ('state', '=', 'running'),
+            ('heartbeat_at', '<', now - timedelta(seconds=limits['generation_timeout'])),
+        ])
+        queued = self.sudo().search([
+            ('state', '=', 'queued'),
+            ('create_date', '<', now - timedelta(seconds=limits['generation_queue_timeout'])),
+        ])
+        if running or queued:
+            _logger.warning(f"Expiring {len(running)} running and {len(queued)} queued stale Loopjet generation requests")
+        running.write({'state': 'failed', 'finished_at': now, 'error_message': 'The generation did not finish in time.'})
+        queued.write({'state': 'failed', 'finished_at': now, 'error_message': 'The request waited too long in the queue.'})
+        for ticket in queued:
+            self.env['bus.bus']._sendone(ticket.user_id.partner_id, 'notification', {
+                'type': 'warning',
+                'title': 'AI Quotation Not Generated',
+                'message': f'The quotation of {ticket.lead_id.name} waited too long in the queue. Please try again.',
+                'sticky': True,
+            })
+
+    def _queue_position(self, per_user_limit):
+        """
+        Position of this queued ticket: 1 when it is next in line.
+
+        Earlier tickets of users already at their own limit cannot start, so
+        they do not count.
+        """
+        self.ensure_one()
+        self.env.cr.execute("""
+            SELECT COUNT(*) FROM loopjet_generation_request queued
+            WHERE queued.state = 'queued' AND queued.id < %s
+              AND (SELECT COUNT(*) FROM loopjet_generation_request running
+                   WHERE running.state = 'running' AND running.user_id = queued.user_id) < %s
+        """, (self.id, per_user_limit))
+        return self.env.cr.fetchone()[0] + 1
+
+    def _try_start(self, limits):
+        """Start this queued ticket if the limits allow it, or return its queue position."""
+        self.ensure_one()
+        self._lock_admission()
+        self.flush_model()
+        self.env.cr.execute("""
+            SELECT COUNT(*), COUNT(*) FILTER (WHERE user_id = %s)
+            FROM loopjet_generation_request WHERE state = 'running'
+        """, (self.user_id.id,))
+        running, running_for_user = self.env.cr.fetchone()
+        position = self._queue_position(limits['max_generations_per_user'])
+        if (position == 1 and running < limits['max_concurrent_generations']
+                and running_for_user < limits['max_generations_per_user']):
+            now = fields.Datetime.now()
+            self.write({'state': 'running', 'started_at': now, 'heartbeat_at': now})
+            return 0
+        return position
+
+    @api.model
+    def _admit(self, lead, company, vals=None):
+        """
+        Admit a generation for an opportunity, or queue it when no slot is free.
+
+        Never waits: queued requests are run later by the queue cron.
+
+        Args:
+            lead: crm.lead to generate the quotation for
+            company: res.company whose Loopjet account is used
+            vals: request parameters kept on the ticket for a queued run
+                (extracted_info, additional_instructions, allow_new_items)
+
+        Returns:
+            tuple: (ticket ID, status, queue position) where status is
+            'running' when the caller can generate right away, 'queued' when
+            the queue cron will, and 'joined' when another generation of this
+            opportunity is already in progress and the caller was added to the
+            users notified when it finishes
+
+        Raises:
+            UserError: when the queue is full
+        """
+        limits = self._get_limits()
+        with self.env.registry.cursor() as cr:
+            Request = self.with_env(self.env(cr=cr)).sudo()
+            Request._lock_admission()
+            Request._expire_stale(limits)
+
+            in_flight = Request.search([('lead_id', '=', lead.id), ('state', 'in', ['queued', 'running'])], limit=1)
+            if in_flight:
+                if in_flight.user_id.id != self.env.uid:
+                    in_flight.waiting_user_ids = [(4, self.env.uid)]
+                _logger.info(f"Loopjet generation for lead {lead.id} already in progress, user {self.env.uid} joins request {in_flight.id}")
+                return in_flight.id, 'joined', 0
+
+            if Request.search_count([('state', '=', 'queued')]) >= limits['generation_queue_size']:
+                raise UserError(_(
+                    'Too Many AI Quotations in Progress\n\n'
+                    'The Loopjet generation queue is full. Please try again in a few minutes.'
+                ))
+
+            ticket = Request.create(dict(vals or {}, lead_id=lead.id, user_id=self.env.uid, company_id=company.id))
+            position = ticket._try_start(limits)
+            if position:
+                _logger.info(f"Queued Loopjet generation request {ticket.id} for lead {lead.id} at position {position}")
+                Request._trigger_queue()
+                return ticket.id, 'queued', position
+
+            _logger.info(f"Admitted Loopjet generation request {ticket.id} for lead {lead.id}")
+            return ticket.id, 'running', 0
+
+    @api.model
+    def _trigger_queue(self):
+        """Ask the queue cron to start the queued generations as soon as possible."""
+        cron = self.env.ref(f'{self._module}.ir_cron_loopjet_process_generation_queue', raise_if_not_found=False)
+        if cron:
+            cron.sudo()._trigger()
+
+    @api.model
+    def _cron_process_queue(self):
+        """
+        Run the queued generations that fit within the limits, oldest first.
+
+        Each generation runs as the user who requested it and is committed on
+        its own. The cron stops after ``loopjet.generation_timeout`` seconds and
+        triggers itself again if work is left.
+        """
+        limits = self._get_limits()
+        deadline = time.monotonic() + limits['generation_timeout']
+        self._lock_admission()
+        self._expire_stale(limits)
+        self.env.cr.commit()
+
+        while time.monotonic() < deadline:
+            ticket = self._start_next(limits)
+            self.env.cr.commit()
+            if not ticket:
+                return
+            ticket._run()
+        self._trigger_queue()
+
+    @api.model
+    def _start_next(self, limits):
+        """Start the oldest queued ticket the limits allow, if any."""
+        for ticket in self.sudo().search([('state', '=', 'queued')], order='id'):
+            if not ticket._try_start(limits):
+                return ticket
+        return self.browse()
+
+    def _run(self):
+        """Run the generation of this started ticket as its user, from the queue cron."""
+        self.ensure_one()
+        try:
+            wizard = self.env['loopjet.generate.estimate.wizard'].with_user(self.user_id).with_company(self.company_id).create({
+                'lead_id': self.lead_id.id,
+                'extracted_info': self.extracted_info,
+                'additional_instructions': self.additional_instructions,
+                'allow_new_items': self.allow_new_items,
+            })
+        except Exception as e:
+            self.env.cr.rollback()
+            self._release(self.id, error=str(e) or type(e).__name__)
+            self._notify_failure(e)
+            return
+
+        try:
+            # The generation releases the ticket itself, whatever its outcome
+            wizard._run_queued_generation(self.id)
+            self.env.cr.commit()
+        except Exception as e:
+            self.env.cr.rollback()
+            self._notify_failure(e)
+
+    def _notify_failure(self, error):
+        """Tell the owner of this ticket that its queued generation failed."""
+        _logger.warning(f"Queued Loopjet generation request {self.id} failed: {str(error)}")
+        self.env['bus.bus']._sendone(self.user_id.partner_id, 'notification', {
+            'type': 'warning',
+            'title': 'AI Quotation Failed',
+            'message': f'The quotation of {self.lead_id.name} could not be generated: {str(error)}',
+            'sticky': True,
+        })
+        self.env.cr.commit()
+
+    @api.model
+    def _heartbeat(self, ticket_id):
+        """
+        Record that the generation of a running ticket is still making progress.
+
+        Written in SQL on a dedicated cursor, so it is visible to the other
+        workers at once and never conflicts with the generation's transaction.
+        """
+        try:
+            with self.env.registry.cursor() as cr:
+                cr.execute(
+                    "UPDATE loopjet_generation_request SET heartbeat_at = NOW() AT TIME ZONE 'UTC' "
+                    "WHERE id = %s AND state = 'running'",
+                    (ticket_id,),
+                )
+        except Exception as e:
+            _logger.warning(f"Could not refresh Loopjet generation request {ticket_id}: {str(e)}")
+
+    @api.model
+    def _release(self, ticket_id, sale_order_id=False, error=False):
+        """
+        Finish a ticket, freeing its slot, and notify the users who joined it.
+
+        Tickets are only visible to transactions started after their admission,
+        so they are finished on a dedicated cursor. A failed ticket is finished
+        right away; a successful one once the quotation is committed, or as
+        failed if the transaction is rolled back after all.
+        """
+        if error:
+            self._finish_on_new_cursor(ticket_id, sale_order_id, error)
+            return
+
+        cr = self.env.cr
+        cr.postcommit.add(lambda: self._finish_on_new_cursor(ticket_id, sale_order_id, False))
+        cr.postrollback.add(lambda: self._finish_on_new_cursor(ticket_id, False, 'The generation was rolled back.'))
+
+    @api.model
+    def _finish_on_new_cursor(self, ticket_id, sale_order_id, error):
+        registry = self.env.registry
+        uid = self.env.uid
+        with registry.cursor() as cr:
+            api.Environment(cr, uid, {})['loopjet.generation.request']._finish(ticket_id, sale_order_id, error)
+
+    @api.model
+    def _finish(self, ticket_id, sale_order_id, error):
+        ticket = self.sudo().browse(ticket_id).exists()
+        if not ticket:
+            return
+        sale_order = self.env['sale.order'].sudo().browse(sale_order_id)
+        ticket.write({
+            'state': 'failed' if error else 'done',
+            'finished_at': fields.Datetime.now(),
+            'sale_order_id': sale_order.id,
+            'error_message': error or False,
+        })
+        for user in ticket.waiting_user_ids:
+            if error:
+                message = {
+                    'type': 'warning',
+                    'title': 'AI Quotation Failed',
+                    'message': f'The quotation of {ticket.lead_id.name} you requested could not be generated: {error}',
+                    'sticky': True,
+                }
+            else:
+                message = {
+                    'type': 'success',
+                    'title': '✅ Quotation Created!',
+                    'message': f'Quotation {sale_order.name} of {ticket.lead_id.name} you requested is ready.',
+                    'sticky': True,
+                }
+            self.env['bus.bus']._sendone(user.partner_id, 'notification', message)
+        # A slot is free, start the next queued generation
+        self._trigger_queue()
+
+    @api.autovacuum
+    def _gc_requests(self):
+        """Delete finished tickets after a week."""
+        self.sudo().search([
+            ('state', 'in', ['done', 'failed']),
+            ('write_date', '<', fields.Datetime.now() - timedelta(days=7)),
+        ]).unlink()
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api, tools
+from contextlib import contextmanager, nullcontext
+from datetime import timedelta
+import logging
+import time
+
+_logger = logging.getLogger(__name__)
+
+try:
+    from opentelemetry import trace
+    _tracer = trace.get_tracer('odoo.loopjet')
+except ImportError:
+    _tracer = None
+
+
+class LoopjetTimer:
+    """
+    Collect the duration of the stages of one AI estimate generation.
+
+    Stages entered several times (e.g. the tax lookup of every line) are
+    summed. When OpenTelemetry is installed, every stage is also exported as
+    a span to the configured tracer provider.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+
+    @contextmanager
+    def span(self, stage):
+        """Time a stage of the generation."""
+        otel_span = _tracer.start_as_current_span(f'loopjet.estimate.{stage}') if _tracer else nullcontext()
+        start = time.perf_counter()
+        try:
+            with otel_span:
+                yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def add(self, stage, seconds):
+        """Record a stage timed elsewhere, e.g. in another request."""
+        total = self.stages.setdefault(stage, [0.0, 0])
+        total[0] += seconds
+        total[1] += 1
+
+    def total(self):
+        return time.perf_counter() - self.started
+
+    def summary(self):
+        """Human readable duration of each stage."""
+        lines = [f"{stage}: {seconds * 1000:.0f} ms" + (f" ({count}x)" if count > 1 else '')
+                 for stage, (seconds, count) in self.stages.items()]
+        lines.append(f"total: {self.total() * 1000:.0f} ms")
+        return '\n'.join(lines)
+
+    def log_fields(self):
+        """Stage durations as key=value pairs for a structured log line."""
+        pairs = [f"{stage}_ms={seconds * 1000:.0f}" for stage, (seconds, _count) in self.stages.items()]
+        return ' '.join(pairs + [f"total_ms={self.total() * 1000:.0f}"])
+
+
+class LoopjetGenerationTiming(models.Model):
+    _name = 'loopjet.generation.timing'
+    _description = 'Loopjet Generation Timing'
+    _order = 'id desc'
+
+    stage = fields.Char(
+        string='Stage',
+        required=True,
+        index=True,
+    )
+
+    duration_ms = fields.Float(
+        string='Duration (ms)',
+        digits=(16, 1),
+    )
+
+    call_count = fields.Integer(
+        string='Calls',
+        default=1,
+        help='Number of times the stage ran during the generation (e.g. once per line)'
+    )
+
+    success = fields.Boolean(
+        string='Successful',
+        default=True,
+    )
+
+    lead_id = fields.Many2one(
+        'crm.lead',
+        string='Opportunity',
+        ondelete='set null',
+    )
+
+    sale_order_id = fields.Many2one(
+        'sale.order',
+        string='Quotation',
+        ondelete='set null',
+    )
+
+    user_id = fields.Many2one(
+        'res.users',
+        string='User',
+    )
+
+    company_id = fields.Many2one(
+        'res.company',
+        string='Company',
+    )
+
+    @api.model
+    def _store(self, timer, vals):
+        """Store the stages of a generation, one row per stage plus the total."""
+        rows = [dict(vals, stage=stage, duration_ms=seconds * 1000, call_count=count)
+                for stage, (seconds, count) in timer.stages.items()]
+        rows.append(dict(vals, stage='total', duration_ms=timer.total() * 1000))
+        self.sudo().create(rows)
+
+    @api.autovacuum
+    def _gc_timings(self):
+        """Delete timings older than ``loopjet.timing_retention_days`` (90 by default)."""
+        days = int(self.env['ir.config_parameter'].sudo().get_param('loopjet.timing_retention_days', 90))
+        self.sudo().search([('create_date', '<', fields.Datetime.now() - timedelta(days=days))]).unlink()
+
+
+class LoopjetGenerationTimingReport(models.Model):
+    _name = 'loopjet.generation.timing.report'
+    _description = 'Loopjet Generation Timing Statistics'
+    _auto = False
+    _order = 'p95_ms desc'
+
+    stage = fields.Char(string='Stage', readonly=True)
+    sample_count = fields.Integer(string='Generations', readonly=True)
+    avg_ms = fields.Float(string='Average (ms)', readonly=True, digits=(16, 0))
+    p50_ms = fields.Float(string='Median (ms)', readonly=True, digits=(16, 0))
+    p95_ms = fields.Float(string='95th Percentile (ms)', readonly=True, digits=(16, 0))
+    max_ms = fields.Float(string='Maximum (ms)', readonly=True, digits=(16, 0))
+
+    def init(self):
+        tools.drop_view_if_exists(self.env.cr, self._table)
+        self.env.cr.execute(f"""
+            CREATE OR REPLACE VIEW {self._table} AS (
+                SELECT
+                    MIN(id) AS id,
+                    stage,
+                    COUNT(*) AS sample_count,
+                    AVG(duration_ms) AS avg_ms,
+                    percentile_cont(0.5) WITHIN GROUP (ORDER BY duration_ms) AS p50_ms,
+                    percentile_cont(0.95) WITHIN GROUP (ORDER BY duration_ms) AS p95_ms,
+                    MAX(duration_ms) AS max_ms
+                FROM loopjet_generation_timing
+                WHERE success
+                GROUP BY stage
+            )
+        """)
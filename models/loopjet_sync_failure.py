@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api
+from datetime import timedelta
+from .loopjet_sync_log import redact
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+class LoopjetSyncFailure(models.Model):
+    _name = 'loopjet.sync.failure'
+    _description = 'Loopjet Sync Failure'
+    _order = 'next_retry, id'
+
+    res_model = fields.Char(
+        string='Model',
+        required=True,
+        index=True,
+    )
+
+    res_id = fields.Integer(
+        string='Record ID',
+        required=True,
+        index=True,
+    )
+
+    res_name = fields.Char(
+        string='Record',
+    )
+
+    company_id = fields.Many2one(
+        'res.company',
+        string='Company',
+    )
+
+    error_class = fields.Char(
+        string='Error Type',
+        help='Python exception class, or HTTPError when Loopjet answered with an error status'
+    )
+
+    http_status = fields.Integer(
+        string='HTTP Status',
+    )
+
+    error_message = fields.Text(
+        string='Error Message',
+    )
+
+    attempt_count = fields.Integer(
+        string='Attempts',
+        default=1,
+    )
+
+    next_retry = fields.Datetime(
+        string='Next Retry',
+        index=True,
+    )
+
+    state = fields.Selection([
+        ('pending', 'Pending Retry'),
+        ('abandoned', 'Abandoned'),
+    ], string='Status', default='pending', required=True, index=True)
+
+    @api.model
+    def _get_retry_delay(self, attempt_count):
+        """Exponential backoff: 5 minutes after the first failure, doubling up to one day."""
+        base = int(self.env['ir.config_parameter'].sudo().get_param('loopjet.retry_base_delay', 300))
+        return timedelta(seconds=min(base * 2 ** (attempt_count - 1), 86400))
+
+    @api.model
+    def _record(self, records, error_class, error_message, http_status=False):
+        """
+        Store or update the failure of these records and schedule their next retry.
+
+        Records that keep failing after ``loopjet.max_sync_attempts`` attempts
+        (10 by default) are abandoned and only retried manually.
+        """
+        max_attempts = int(self.env['ir.config_parameter'].sudo().get_param('loopjet.max_sync_attempts', 10))
+        failures = self.sudo().search([('res_model', '=', records._name), ('res_id', 'in', records.ids)])
+        failures_by_id = {failure.res_id: failure for failure in failures}
+        now = fields.Datetime.now()
+
+        for record in records:
+            failure = failures_by_id.get(record.id)
+            attempt_count = failure.attempt_count + 1 if failure else 1
+            vals = {
+                'res_name': record.display_name,
+                'company_id': record._loopjet_get_company().id,
+                'error_class': error_class,
+                'http_status': http_status or False,
+                'error_message': redact(error_message),
+                'attempt_count': attempt_count,
+                'next_retry': now + self._get_retry_delay(attempt_count),
+                'state': 'abandoned' if attempt_count >= max_attempts else 'pending',
+            }
+            if failure:
+                failure.write(vals)
+            else:
+                self.sudo().create(dict(vals, res_model=record._name, res_id=record.id))
+
+    @api.model
+    def _resolve(self, records):
+        """Forget the failures of records that were synced successfully."""
+        self.sudo().search([('res_model', '=', records._name), ('res_id', 'in', records.ids)]).unlink()
+
+    @api.model
+    def _count_recorded(self, records):
+        """Number of these records whose failure was recorded in the current transaction."""
+        return self.sudo().search_count([
+            ('res_model', '=', records._name),
+            ('res_id', 'in', records.ids),
+            ('write_date', '>=', self.env.cr.now()),
+        ])
+
+    def _retry(self):
+        """
+        Sync the records of these failures again, one model at a time.
+
+        One 'auto' slot is taken for the whole retry, so either all models are
+        retried or the retry is postponed as a whole.
+        """
+        if not self.env['loopjet.sync.job']._acquire_slot('auto'):
+            _logger.info(f"No free Loopjet sync slot, postponing retry of {len(self)} failed syncs")
+            return
+        for res_model in set(self.mapped('res_model')):
+            failures = self.filtered(lambda f: f.res_model == res_model)
+            Model = self.env[res_model]
+
+            # Records deleted or no longer eligible (e.g. confirmed orders) have nothing left to retry
+            records = Model.with_context(active_test=False).search(
+                Model._loopjet_sync_domain() + [('id', 'in', failures.mapped('res_id'))])
+            failures.filtered(lambda f: f.res_id not in records.ids).unlink()
+
+            for company, company_records in records._loopjet_group_by_company().items():
+                company_records.sync_to_loopjet()
+
+    def action_retry(self):
+        """Retry the selected failures now, including abandoned ones."""
+        self._retry()
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': 'Retry Complete',
+                'message': f'Retried {len(self)} records. Records that failed again are still listed.',
+                'type': 'info',
+                'sticky': False,
+            }
+        }
+
+    @api.model
+    def _cron_retry_failures(self):
+        """Retry the failed records whose backoff delay has elapsed."""
+        failures = self.search([
+            ('state', '=', 'pending'),
+            ('next_retry', '<=', fields.Datetime.now()),
+        ], limit=500)
+        if failures:
+            _logger.info(f"Retrying {len(failures)} failed Loopjet syncs")
+            failures._retry()
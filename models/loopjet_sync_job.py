@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api
+import json
+import time
+import logging
+
+_logger = logging.getLogger(__name__)
+
+LOOPJET_JOB_PRIORITIES = [
+    ('interactive', 'Interactive'),
+    ('auto', 'Auto-sync'),
+    ('bulk', 'Bulk'),
+]
+
+_PRIORITY_SEQUENCE = {'interactive': 0, 'auto': 1, 'bulk': 2}
+
+# Default number of concurrent syncs per priority class, across all workers
+_DEFAULT_CONCURRENCY = {'interactive': 4, 'auto': 2, 'bulk': 1}
+
+# PostgreSQL advisory lock keys: (class key, slot number)
+_SLOT_LOCK_KEYS = {'interactive': 1279918081, 'auto': 1279918082, 'bulk': 1279918083}
+
+# Held in shared mode by every running interactive sync, probed by bulk jobs
+_INTERACTIVE_MARKER_LOCK = (1279918335, 0)
+
+
+class LoopjetSyncJob(models.Model):
+    _name = 'loopjet.sync.job'
+    _description = 'Loopjet Sync Job'
+    _order = 'sequence, id'
+
+    name = fields.Char(
+        string='Description',
+        required=True,
+    )
+
+    res_model = fields.Char(
+        string='Model',
+        required=True,
+    )
+
+    res_ids = fields.Text(
+        string='Record IDs',
+        help='JSON list of the records to sync. Empty when the job selects its records with a domain.'
+    )
+
+    domain = fields.Text(
+        string='Domain',
+        help='JSON domain selecting the records to sync, processed in chunks by increasing ID.'
+    )
+
+    use_batch = fields.Boolean(
+        string='Use Batch Endpoint',
+        default=False,
+        help='Send records through the Loopjet batch endpoint instead of one request per record.'
+    )
+
+    priority = fields.Selection(
+        LOOPJET_JOB_PRIORITIES,
+        string='Priority',
+        required=True,
+        default='auto',
+    )
+
+    sequence = fields.Integer(
+        string='Sequence',
+        compute='_compute_sequence',
+        store=True,
+    )
+
+    state = fields.Selection([
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ], string='Status', default='pending', required=True, index=True)
+
+    company_id = fields.Many2one(
+        'res.company',
+        string='Company',
+        default=lambda self: self.env.company,
+    )
+
+    last_id = fields.Integer(
+        string='Last Processed ID',
+        default=0,
+        help='Resume cursor: records up to this ID have been processed.'
+    )
+
+    processed_count = fields.Integer(string='Processed', default=0)
+
+    failed_count = fields.Integer(string='Failed', default=0)
+
+    error_message = fields.Text(string='Error Message', readonly=True)
+
+    @api.depends('priority')
+    def _compute_sequence(self):
+        for job in self:
+            job.sequence = _PRIORITY_SEQUENCE.get(job.priority, 1)
+
+    @api.model
+    def _get_concurrency_cap(self, priority):
+        """Maximum number of concurrent syncs of a priority class (loopjet.max_concurrent_<priority>)."""
+        return int(self.env['ir.config_parameter'].sudo().get_param(
+            f'loopjet.max_concurrent_{priority}', _DEFAULT_CONCURRENCY[priority]))
+
+    @api.model
+    def _acquire_slot(self, priority, timeout=0.0):
+        """
+        Take a concurrency slot of a priority class for the current transaction.
+
+        Slots are transaction-level advisory locks, so they are shared by all
+        workers and released automatically on commit or rollback. Interactive
+        syncs also hold a shared marker lock that bulk jobs probe to yield.
+
+        Args:
+            priority: 'interactive', 'auto' or 'bulk'
+            timeout: seconds to keep trying when all slots are taken
+
+        Returns:
+            bool: whether a slot was acquired
+        """
+        deadline = time.monotonic() + timeout
+        cap = self._get_concurrency_cap(priority)
+        while True:
+            for slot in range(cap):
+                self.env.cr.execute('SELECT pg_try_advisory_xact_lock(%s, %s)', (_SLOT_LOCK_KEYS[priority], slot))
+                if self.env.cr.fetchone()[0]:
+                    if priority == 'interactive':
+                        self.env.cr.execute('SELECT pg_try_advisory_xact_lock_shared(%s, %s)', _INTERACTIVE_MARKER_LOCK)
+                    return True
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.2)
+
+    @api.model
+    def _interactive_sync_running(self):
+        """Check whether any worker is currently running an interactive sync."""
+        self.env.cr.execute('SELECT pg_try_advisory_lock(%s, %s)', _INTERACTIVE_MARKER_LOCK)
+        if not self.env.cr.fetchone()[0]:
+            return True
+        self.env.cr.execute('SELECT pg_advisory_unlock(%s, %s)', _INTERACTIVE_MARKER_LOCK)
+        return False
+
+    @api.model
+    def _enqueue(self, records, priority, domain=None, use_batch=False, name=None):
+        """
+        Queue a sync job and wake up the job processor.
+
+        Args:
+            records: recordset to sync, or an empty recordset of the model when a domain is given
+            priority: 'interactive', 'auto' or 'bulk'
+            domain: optional domain selecting the records instead of their IDs
+            use_batch: send records through the batch endpoint
+            name: optional description
+
+        Returns:
+            loopjet.sync.job: created job
+        """
+        job = self.sudo().create({
+            'name': name or f'Sync {len(records) if domain is None else "all"} {records._description} records',
+            'res_model': records._name,
+            'res_ids': json.dumps(records.ids) if domain is None else False,
+            'domain': json.dumps(domain) if domain is not None else False,
+            'use_batch': use_batch,
+            'priority': priority,
+        })
+        self._trigger_processing()
+        return job
+
+    @api.model
+    def _trigger_processing(self):
+        """Ask the job processor cron to run as soon as possible."""
+        cron = self.env.ref(f'{self._module}.ir_cron_loopjet_process_sync_jobs', raise_if_not_found=False)
+        if cron:
+            cron.sudo()._trigger()
+
+    @api.model
+    def _trigger_reconcile(self):
+        """Ask the reconcile cron to check Odoo and Loopjet for drift as soon as possible."""
+        cron = self.env.ref(f'{self._module}.ir_cron_loopjet_reconcile', raise_if_not_found=False)
+        if cron:
+            cron.sudo()._trigger()
+
+    def _get_job_domain(self):
+        """Domain of the records handled by this job."""
+        self.ensure_one()
+        if self.domain:
+            return json.loads(self.domain)
+        return [('id', 'in', json.loads(self.res_ids or '[]'))]
+
+    def _yield_to_interactive(self, attempts=5):
+        """
+        Throttle bulk work while interactive syncs are running.
+
+        Returns:
+            bool: True if interactive work is still running and the job should stop for now
+        """
+        for _attempt in range(attempts):
+            if not self._interactive_sync_running():
+                return False
+            time.sleep(1)
+        return True
+
+    def _process(self, deadline):
+        """
+        Process this job chunk by chunk, committing after each chunk.
+
+        Bulk jobs stop early when interactive syncs keep running; the job stays
+        pending and resumes from its cursor on the next run.
+
+        Returns:
+            bool: whether the job was completed
+        """
+        self.ensure_one()
+        Model = self.env[self.res_model].with_company(self.company_id)
+        chunk_size = Model._loopjet_batch_size if self.use_batch else 20
+
+        for records in Model._loopjet_iter_chunks(self._get_job_domain(), chunk_size, start_id=self.last_id):
+            if self.priority == 'bulk' and self._yield_to_interactive():
+                _logger.info(f"Loopjet sync job {self.id} paused for interactive syncs")
+                self.state = 'pending'
+                self.env.cr.commit()
+                return False
+
+            if not self._acquire_slot(self.priority):
+                return False
+
+            self.state = 'running'
+            if self.use_batch:
+                success_count, error_count = records._loopjet_batch_sync()
+            else:
+                records.sync_to_loopjet()
+                error_count = self.env['loopjet.sync.failure']._count_recorded(records)
+            self.write({
+                'last_id': records[-1].id,
+                'processed_count': self.processed_count + len(records),
+                'failed_count': self.failed_count + error_count,
+            })
+            # Releases the slot, so waiting interactive syncs can take over
+            self.env.cr.commit()
+
+            if time.monotonic() > deadline:
+                return False
+
+        self.state = 'done'
+        self.env.cr.commit()
+        return True
+
+    @api.model
+    def _cron_process_jobs(self):
+        """Process queued sync jobs by priority within a time budget."""
+        budget = int(self.env['ir.config_parameter'].sudo().get_param('loopjet.job_time_budget', 240))
+        deadline = time.monotonic() + budget
+
+        for job in self.search([('state', 'in', ['pending', 'running'])]):
+            try:
+                if not job._process(deadline) and time.monotonic() > deadline:
+                    self._trigger_processing()
+                    break
+            except Exception as e:
+                self.env.cr.rollback()
+                _logger.error(f"Loopjet sync job {job.id} failed: {str(e)}")
+                job.write({
+                    'state': 'failed',
+                    'error_message': str(e),
+                })
+                self.env.cr.commit()
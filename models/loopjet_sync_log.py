@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Structured logging of Loopjet syncs.
+
+A sync run logs one summary line (counts by outcome, duration) instead of
+one line per record. The first failures are logged individually, the others
+are only counted. Payloads are dumped at DEBUG level only, for a sample of
+the records, and secrets are redacted from everything that is logged.
+"""
+
+import json
+import logging
+import random
+import re
+import time
+
+# Keys whose values are never logged
+_SECRET_KEY_RE = re.compile(r'authorization|api[_-]?key|token|secret|password|cookie', re.IGNORECASE)
+
+# Secrets inside free text, e.g. an echoed header in an error response
+_SECRET_TEXT_RE = re.compile(
+    r'(bearer\s+|(?:api[_-]?key|token|secret|password)["\']?\s*[:=]\s*["\']?)[\w.~+/=-]+', re.IGNORECASE)
+
+# Failures of a run logged individually, the others are only counted
+MAX_FAILURE_LINES = 5
+
+# Characters of a response body or payload dump kept in a log line
+MAX_TEXT_LENGTH = 300
+
+
+def redact(value):
+    """Copy of a value (dict, list, headers or text) with its secrets masked."""
+    if isinstance(value, dict):
+        return {key: '***' if _SECRET_KEY_RE.search(str(key)) else redact(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(item) for item in value]
+    if isinstance(value, str):
+        return _SECRET_TEXT_RE.sub(r'\1***', value)
+    return value
+
+
+def shorten(text, length=MAX_TEXT_LENGTH):
+    """Redacted text cut to a length fit for a log line."""
+    text = redact(str(text or ''))
+    return text if len(text) <= length else f'{text[:length]}... ({len(text)} chars)'
+
+
+class SyncLog:
+    """
+    Outcome of one sync run, logged as a single summary line on exit.
+
+    Usage:
+        with SyncLog(_logger, 'product.template', 'sync', sample_rate) as log:
+            log.payload(product.id, product_data)
+            log.ok()  /  log.fail(product.id, 'HTTPError', response.text)  /  log.skip('no_api_key')
+    """
+
+    def __init__(self, logger, model, operation, sample_rate=0.0):
+        self.logger = logger
+        self.model = model
+        self.operation = operation
+        self.sample_rate = sample_rate
+        self.synced = 0
+        self.failed = 0
+        self.skipped = {}
+        self.errors = {}
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.log_summary()
+        return False
+
+    def ok(self, count=1):
+        self.synced += count
+
+    def skip(self, reason, count=1):
+        self.skipped[reason] = self.skipped.get(reason, 0) + count
+
+    def fail(self, record_id, error_class, detail='', count=1):
+        """Count a failure, logging its detail only for the first ones of the run."""
+        self.failed += count
+        self.errors[error_class] = self.errors.get(error_class, 0) + count
+        if self.failed - count < MAX_FAILURE_LINES:
+            self.logger.warning(
+                f"Loopjet {self.operation} failed model={self.model} id={record_id} error={error_class} "
+                f"detail={shorten(detail)!r}")
+
+    def payload(self, record_id, data):
+        """Dump a payload at DEBUG level, for a sample of the records."""
+        if self.sample_rate and self.logger.isEnabledFor(logging.DEBUG) and random.random() < self.sample_rate:
+            self.logger.debug(
+                f"Loopjet {self.operation} payload model={self.model} id={record_id} "
+                f"data={shorten(json.dumps(redact(data), default=str))}")
+
+    def log_summary(self):
+        if not (self.synced or self.failed or self.skipped):
+            return
+        fields = [f"model={self.model}", f"synced={self.synced}", f"failed={self.failed}"]
+        fields += [f"skipped_{reason}={count}" for reason, count in self.skipped.items()]
+        fields += [f"error_{error_class}={count}" for error_class, count in self.errors.items()]
+        if self.failed > MAX_FAILURE_LINES:
+            fields.append(f"failures_not_logged={self.failed - MAX_FAILURE_LINES}")
+        fields.append(f"duration_ms={(time.perf_counter() - self.started) * 1000:.0f}")
+        level = logging.WARNING if self.failed else logging.INFO
+        self.logger.log(level, f"Loopjet {self.operation} {' '.join(fields)}")
@@ -0,0 +1,687 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api
+from itertools import chain, zip_longest
+from .loopjet_sync_log import SyncLog
+import requests
+import hashlib
+import json
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# (API URL, model) pairs whose Loopjet endpoint rejected a merge patch; this
+# worker sends full updates to them from then on
+_LOOPJET_PATCH_UNSUPPORTED = set()
+
+# HTTP statuses meaning the endpoint does not accept a merge patch
+_PATCH_UNSUPPORTED_STATUSES = (405, 415, 501)
+
+# What every model inheriting the mixin must define, see LoopjetSyncMixin
+_LOOPJET_REQUIRED_METHODS = ('_prepare_loopjet_data', 'sync_to_loopjet')
+_LOOPJET_REQUIRED_ATTRIBUTES = ('_loopjet_id_field', '_loopjet_batch_endpoint')
+
+
+class LoopjetSyncMixin(models.AbstractModel):
+    """
+    Synchronization of a model to Loopjet.
+
+    Every model inheriting the mixin implements, checked when the registry is
+    loaded:
+
+    - ``_prepare_loopjet_data()``: the Loopjet API payload of one record, a
+      JSON serializable dict. It is sent as is to create the record and is the
+      base of the merge patches sent to update it, so it must only depend on
+      the fields listed in ``_loopjet_payload_fields`` (or on related records
+      that flag the record when they change). Line items carry a stable
+      ``external_id``.
+    - ``sync_to_loopjet()``: send the records one by one.
+
+    and sets ``_loopjet_id_field`` and ``_loopjet_batch_endpoint``.
+    """
+    _name = 'loopjet.sync.mixin'
+    _description = 'Loopjet Sync Mixin'
+
+    # ir.config_parameter key that enables auto-sync for the inheriting model
+    _loopjet_auto_sync_param = None
+
+    # Name of the Loopjet batch resource, e.g. 'products' for /api/v1/batch/products/batch
+    _loopjet_batch_endpoint = None
+
+    # Whether the batch endpoint should update matching records instead of creating duplicates
+    _loopjet_batch_upsert = False
+
+    # Maximum number of records sent in one batch request
+    _loopjet_batch_size = 200
+
+    # Field holding the UUID of the record in Loopjet
+    _loopjet_id_field = None
+
+    # Fields of the model whose values end up in the Loopjet payload. Only
+    # writes to these fields flag the record and trigger an auto-sync, so
+    # chatter, activity and tracking updates never reach the API.
+    _loopjet_payload_fields = set()
+
+    loopjet_sync_hash = fields.Char(
+        string='Loopjet Payload Hash',
+        readonly=True,
+        copy=False,
+        help='Hash of the payload last accepted by Loopjet, used to detect drift'
+    )
+
+    loopjet_sync_snapshot = fields.Text(
+        string='Loopjet Payload Snapshot',
+        readonly=True,
+        copy=False,
+        help='Per-key hashes of the payload last accepted by Loopjet, used to send only what changed'
+    )
+
+    loopjet_needs_sync = fields.Boolean(
+        string='Needs Loopjet Sync',
+        readonly=True,
+        copy=False,
+        help='Set when data sent to Loopjet changed, cleared by a successful sync'
+    )
+
+    def _register_hook(self):
+        """Refuse to load a synced model that does not implement the contract of the mixin."""
+        super(LoopjetSyncMixin, self)._register_hook()
+        if self._abstract:
+            return
+        missing = [name for name in _LOOPJET_REQUIRED_METHODS if not callable(getattr(type(self), name, None))]
+        missing += [name for name in _LOOPJET_REQUIRED_ATTRIBUTES if not getattr(self, name)]
+        if missing:
+            raise TypeError(f"{self._name} inherits loopjet.sync.mixin but does not define {', '.join(missing)}")
+
+    def init(self):
+        """Partial index on the (few) records waiting for a sync."""
+        super(LoopjetSyncMixin, self).init()
+        if self._abstract:
+            return
+        self.env.cr.execute(f"""
+            CREATE INDEX IF NOT EXISTS {self._table}_loopjet_needs_sync_index
+                ON {self._table} (id)
+             WHERE loopjet_needs_sync
+        """)
+
+    def _loopjet_sync_domain(self):
+        """Domain of the records of this model that are synchronized to Loopjet."""
+        return []
+
+    def _loopjet_dirty_domain(self):
+        """Domain of the records whose Loopjet data is out of date."""
+        return self._loopjet_sync_domain() + [('loopjet_needs_sync', '=', True)]
+
+    @api.model
+    def _loopjet_backlog_count(self):
+        """Number of records waiting to be synced, one query on the partial index."""
+        return self.search_count(self._loopjet_dirty_domain())
+
+    def _loopjet_flag_new(self):
+        """
+        Flag newly created records of the sync domain as needing a sync.
+
+        Written in SQL so the write overrides do not see it as a payload change.
+        Records outside the sync domain (confirmed orders, vendor bills,
+        internal contacts...) are never flagged, which keeps the partial index
+        on the flag small.
+        """
+        in_domain = self.filtered_domain(self._loopjet_sync_domain())
+        if in_domain:
+            self.env.cr.execute(f"UPDATE {self._table} SET loopjet_needs_sync = TRUE WHERE id IN %s",
+                                (tuple(in_domain.ids),))
+            in_domain.invalidate_recordset(['loopjet_needs_sync'])
+
+    def _loopjet_flag_dirty(self, vals):
+        """
+        Flag the written records of the sync domain as needing a sync, after a write of payload fields.
+
+        Written in SQL like ``_loopjet_flag_new``, once the write is done so the
+        domain sees the new values. Records the write took out of the sync
+        domain (a confirmed order, a cancelled invoice...) are unflagged, so
+        the partial index on the flag only holds records that will be synced.
+        """
+        if not self._loopjet_payload_fields.intersection(vals):
+            return
+        self.flush_recordset(['loopjet_needs_sync'])
+        in_domain = self.filtered_domain(self._loopjet_sync_domain())
+        for records, flag in ((in_domain, True), (self - in_domain, False)):
+            if records:
+                self.env.cr.execute(
+                    f"UPDATE {self._table} SET loopjet_needs_sync = %s WHERE id IN %s AND loopjet_needs_sync IS DISTINCT FROM %s",
+                    (flag, tuple(records.ids), flag),
+                )
+        self.invalidate_recordset(['loopjet_needs_sync'])
+
+    def _loopjet_payload_changed(self, vals):
+        """
+        Check whether a write changes the Loopjet payload of the records.
+
+        True for writes of payload fields and for explicit
+        ``loopjet_needs_sync=True`` writes, used by related records (order and
+        invoice lines, partner ranks) to report a change of the payload.
+        """
+        return bool(self._loopjet_payload_fields.intersection(vals)) or vals.get('loopjet_needs_sync') is True
+
+    def _loopjet_record_failure(self, error_class, error_message, http_status=False):
+        """Store the failed sync of these records for a targeted retry with backoff."""
+        self.env['loopjet.sync.failure']._record(self, error_class, error_message, http_status)
+
+    def _loopjet_clear_failure(self):
+        """Drop the stored failures of these records after a successful sync."""
+        self.env['loopjet.sync.failure']._resolve(self)
+
+    def _loopjet_sync_log(self, operation='sync'):
+        """
+        Get the summary logger of a sync run over these records.
+
+        Payloads are dumped at DEBUG level for a sample of the records, set by
+        ``loopjet.log_payload_sample_rate`` (0.05 by default).
+        """
+        sample_rate = float(self.env['ir.config_parameter'].sudo().get_param('loopjet.log_payload_sample_rate', 0.05))
+        return SyncLog(_logger, self._name, operation, sample_rate)
+
+    def _loopjet_sync_now(self, priority='interactive', timeout=2.0):
+        """
+        Sync these records right away if a slot of their priority class is free.
+
+        Several records not yet known to Loopjet (e.g. created in one batch) are
+        sent through the batch endpoint, a few requests instead of one per
+        record. When the class is at its concurrency cap after ``timeout``
+        seconds, the records are queued as an auto-sync job instead.
+
+        Post-commit auto-syncs run in the 'auto' class without waiting; the
+        'interactive' class is kept for syncs a user waits for.
+        """
+        Job = self.env['loopjet.sync.job']
+        new_records = self.filtered(lambda r: not r[self._loopjet_id_field]) if len(self) > 1 else self.browse()
+        existing_records = self - new_records
+        if Job._acquire_slot(priority, timeout=timeout):
+            if new_records:
+                new_records._loopjet_batch_sync()
+            if existing_records:
+                existing_records.sync_to_loopjet()
+        else:
+            _logger.info(f"No free {priority} Loopjet sync slot, queueing {len(self)} {self._name} records")
+            self._loopjet_enqueue_sync('auto')
+
+    def _loopjet_enqueue_sync(self, priority, name=None):
+        """
+        Queue these records as background sync jobs.
+
+        Records not yet known to Loopjet go through the batch endpoint; the
+        others are updated one by one, since the batch endpoints of orders and
+        invoices only create.
+        """
+        Job = self.env['loopjet.sync.job']
+        new_records = self.filtered(lambda r: not r[self._loopjet_id_field])
+        existing_records = self - new_records
+        if new_records:
+            Job._enqueue(new_records, priority, use_batch=True, name=name)
+        if existing_records:
+            Job._enqueue(existing_records, priority, name=name)
+
+    @api.model
+    def _loopjet_enqueue_domain_sync(self, domain, priority, name=None):
+        """
+        Queue background sync jobs over the records matching a domain.
+
+        Like ``_loopjet_enqueue_sync``, records not yet known to Loopjet go
+        through the batch endpoint and the others through the per-record update
+        path, unless the batch endpoint of the model upserts.
+        """
+        Job = self.env['loopjet.sync.job']
+        if self._loopjet_batch_upsert:
+            Job._enqueue(self.browse(), priority, domain=domain, use_batch=True, name=name)
+            return
+        Job._enqueue(self.browse(), priority, domain=domain + [(self._loopjet_id_field, '=', False)],
+                     use_batch=True, name=name)
+        Job._enqueue(self.browse(), priority, domain=domain + [(self._loopjet_id_field, '!=', False)], name=name)
+
+    def _loopjet_defer_sync(self):
+        """
+        Check whether auto-sync should be left to a background bulk job.
+
+        True for imports (base_import sets ``import_file``) and for explicit
+        ``loopjet_defer_sync`` contexts, so bulk loads commit as fast as with
+        auto-sync off.
+        """
+        return bool(self.env.context.get('import_file') or self.env.context.get('loopjet_defer_sync'))
+
+    def _prepare_loopjet_batch_data(self):
+        """Build the payload for this record as sent to the batch endpoint."""
+        return self._prepare_loopjet_data()
+
+    @api.model
+    def _loopjet_iter_chunks(self, domain, chunk_size=None, start_id=0):
+        """
+        Iterate over the records matching a domain in chunks of increasing ID.
+
+        Every chunk is a new search starting after the last ID of the previous
+        one (keyset pagination, no OFFSET), and the environment cache is
+        invalidated between chunks. The prefetch of a chunk is limited to its own
+        records, so partners, lines and their related records (states,
+        countries, products...) never pile up in memory however large the table.
+
+        Args:
+            domain: search domain
+            chunk_size: records per chunk, defaults to the batch size of the model
+            start_id: only return records with a greater ID (resume cursor)
+        """
+        chunk_size = chunk_size or self._loopjet_batch_size
+        last_id = start_id
+        while True:
+            records = self.search(domain + [('id', '>', last_id)], order='id', limit=chunk_size)
+            if not records:
+                return
+            last_id = records[-1].id
+            yield records
+            # Pending writes are flushed before the cache is dropped
+            self.env.invalidate_all()
+
+    @api.model
+    def _loopjet_hash_payload(self, payload):
+        """Stable hash of a Loopjet payload, independent of key order."""
+        data = json.dumps(payload, sort_keys=True, separators=(',', ':'), default=str)
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    def _loopjet_payload_snapshot(self, payload):
+        """
+        Per-key hashes of a payload, stored after a successful sync.
+
+        Line items are hashed one by one under their stable ``external_id``, so
+        a later update can tell which lines were added, changed or removed.
+        """
+        snapshot = {}
+        for key, value in payload.items():
+            if key == 'items':
+                snapshot[key] = {str(item.get('external_id')): self._loopjet_hash_payload(item) for item in value}
+            else:
+                snapshot[key] = self._loopjet_hash_payload(value)
+        return snapshot
+
+    def _loopjet_payload_patch(self, payload):
+        """
+        JSON merge patch (RFC 7396) from the payload last accepted by Loopjet to this one.
+
+        Unchanged keys are left out and removed keys are set to null. A merge
+        patch replaces arrays as a whole, so when any line item was added,
+        changed or removed the full ``items`` array is sent. Objects would be
+        merged member by member, a null member deleting it, so a change of a
+        nested object (e.g. the customer info) falls back to a full update.
+
+        Returns:
+            dict: the patch, or None when a full update must be sent instead
+        """
+        self.ensure_one()
+        if not self.loopjet_sync_snapshot:
+            return None
+        previous = json.loads(self.loopjet_sync_snapshot)
+
+        patch = {}
+        for key, value in payload.items():
+            if key == 'items':
+                previous_items = previous.get(key) or {}
+                current_items = {str(item.get('external_id')): self._loopjet_hash_payload(item) for item in value}
+                if current_items != previous_items:
+                    patch[key] = value
+            elif previous.get(key) != self._loopjet_hash_payload(value):
+                if isinstance(value, dict):
+                    return None
+                patch[key] = value
+        patch.update({key: None for key in previous if key not in payload})
+        return patch
+
+    def _loopjet_send_update(self, company, url, payload):
+        """
+        Update this record in Loopjet, sending only the keys changed since its last sync.
+
+        A full PUT is sent instead when there is no snapshot yet, when a nested
+        object changed, when nothing seems to have changed (the record is
+        re-sent to repair drift), under a ``loopjet_full_sync`` context, or when
+        the endpoint does not accept merge patches.
+
+        Returns:
+            requests.Response: Loopjet response
+        """
+        self.ensure_one()
+        session = company._loopjet_get_session()
+        headers = company._loopjet_get_api_headers()
+        patch_key = (company._loopjet_get_api_url(), self._name)
+
+        patch = None
+        if not self.env.context.get('loopjet_full_sync') and patch_key not in _LOOPJET_PATCH_UNSUPPORTED:
+            patch = self._loopjet_payload_patch(payload)
+
+        if patch:
+            patch_headers = dict(headers, **{'Content-Type': 'application/merge-patch+json'})
+            response = session.patch(url, data=json.dumps(patch, default=str), headers=patch_headers, timeout=30)
+            if response.status_code not in _PATCH_UNSUPPORTED_STATUSES:
+                return response
+            _logger.info(f"Loopjet does not accept merge patches for {self._name} at {patch_key[0]}, sending full updates")
+            _LOOPJET_PATCH_UNSUPPORTED.add(patch_key)
+
+        return session.put(url, json=payload, headers=headers, timeout=30)
+
+    def _loopjet_sync_state_vals(self, payload):
+        """Values recording that Loopjet accepted this payload."""
+        return {
+            'loopjet_last_sync': fields.Datetime.now(),
+            'loopjet_sync_hash': self._loopjet_hash_payload(payload),
+            'loopjet_sync_snapshot': json.dumps(self._loopjet_payload_snapshot(payload)),
+            'loopjet_needs_sync': False,
+        }
+
+    @api.model
+    def _loopjet_bucket_digest(self, entries):
+        """Digest of one ID-range bucket from its (record id, payload hash) pairs."""
+        digest = hashlib.sha256()
+        for record_id, payload_hash in sorted(entries):
+            digest.update(f'{record_id}:{payload_hash}\n'.encode())
+        return digest.hexdigest()
+
+    def _loopjet_get_company(self):
+        """Get the company whose Loopjet credentials are used for this record."""
+        self.ensure_one()
+        company = self.company_id if 'company_id' in self._fields else False
+        return company or self.env.company
+
+    def _loopjet_group_by_company(self):
+        """Split these records by the company they are synced for.
+
+        Returns:
+            dict: res.company record -> recordset of this model
+        """
+        ids_by_company = {}
+        for record in self:
+            ids_by_company.setdefault(record._loopjet_get_company(), []).append(record.id)
+        return {company: self.browse(ids) for company, ids in ids_by_company.items()}
+
+    def _loopjet_batch_rejections(self, record_list, result):
+        """
+        Map the records rejected by a batch request to their position in it.
+
+        Rejections are read from ``errors`` (entries addressing the record by
+        ``index``, ``external_id`` or ``name``) and from ``results`` entries
+        carrying an ``error``.
+
+        Returns:
+            dict: error message by position in record_list
+        """
+        rejections = {}
+        for index, entry in enumerate(result.get('results') or []):
+            if isinstance(entry, dict) and entry.get('error') and index < len(record_list):
+                rejections[index] = str(entry['error'])
+
+        for entry in result.get('errors') or []:
+            if not isinstance(entry, dict):
+                continue
+            message = str(entry.get('error') or entry.get('message') or entry.get('detail') or entry)
+            position = entry.get('index')
+            if not isinstance(position, int):
+                for key in ('external_id', 'name'):
+                    if entry.get(key) is not None:
+                        position = next((i for i, data in enumerate(record_list)
+                                         if data.get(key) is not None and str(data[key]) == str(entry[key])), None)
+                        if position is not None:
+                            break
+            if isinstance(position, int) and 0 <= position < len(record_list):
+                rejections[position] = message
+        return rejections
+
+    def _loopjet_mark_batch_synced(self, record_list, result):
+        """
+        Record a successful batch sync on these records.
+
+        The Loopjet IDs are only stored when the batch endpoint returns them, in
+        request order, under ``results``. Records without a known Loopjet ID are
+        not flagged as synced, so a later auto-sync still creates them instead
+        of updating a record it cannot address.
+
+        The hash and snapshot are taken from the regular payload, without the
+        batch-only keys, so later updates and reconciliations compare like with
+        like.
+        """
+        results = result.get('results') or []
+        for index, record in enumerate(self[:len(record_list)]):
+            vals = record._loopjet_sync_state_vals(record._prepare_loopjet_data())
+            loopjet_id = results[index].get('id') if index < len(results) and isinstance(results[index], dict) else None
+            if loopjet_id:
+                vals[self._loopjet_id_field] = loopjet_id
+            if loopjet_id or record[self._loopjet_id_field]:
+                vals['loopjet_synced'] = True
+            record.write(vals)
+        self._loopjet_clear_failure()
+
+    def _loopjet_batch_sync(self):
+        """
+        Send these records to the Loopjet batch endpoint.
+
+        Records are split by company so every batch is sent with that company's
+        API key, endpoint and connection pool. Batches of different companies are
+        interleaved, so one company's large backlog cannot hold up the others.
+
+        Returns:
+            tuple: (success_count, error_count)
+        """
+        endpoint = self._loopjet_batch_endpoint
+        size = self._loopjet_batch_size
+
+        batches_by_company = []
+        for company, records in self._loopjet_group_by_company().items():
+            batches_by_company.append([(company, records[i:i + size]) for i in range(0, len(records), size)])
+
+        success_count = 0
+        error_count = 0
+        with self._loopjet_sync_log('batch sync') as log:
+            for company, records in filter(None, chain.from_iterable(zip_longest(*batches_by_company))):
+                record_list = [record._prepare_loopjet_batch_data() for record in records]
+                request_data = {endpoint: record_list}
+                if self._loopjet_batch_upsert:
+                    request_data['upsert'] = True
+                log.payload(records[:1].id, record_list[0])
+
+                try:
+                    url = f"{company._loopjet_get_api_url()}/api/v1/batch/{endpoint}/batch"
+                    response = company._loopjet_get_session().post(
+                        url, json=request_data, headers=company._loopjet_get_api_headers(), timeout=60)
+
+                    if response.status_code in [200, 201]:
+                        result = response.json()
+                        success_count += result.get('created', 0) + result.get('updated', 0)
+                        error_count += result.get('failed', 0)
+                        log.ok(result.get('created', 0) + result.get('updated', 0))
+                        if not result.get('failed'):
+                            records._loopjet_mark_batch_synced(record_list, result)
+                            continue
+                        
+                        rejections = records._loopjet_batch_rejections(record_list, result)
+                        if len(rejections) < result['failed']:
+                            # Rejected records cannot all be told apart, retry the whole batch with backoff
+                            log.fail(f'company:{company.id}', 'RecordRejected', result.get('errors', ''), count=result['failed'])
+                            records._loopjet_record_failure('RecordRejected', str(result.get('errors') or result))
+                            continue
+                        
+                        for position, message in rejections.items():
+                            log.fail(records[position].id, 'RecordRejected', message)
+                            records[position]._loopjet_record_failure('RecordRejected', message)
+                        
+                        # The others were accepted, results stay aligned with their request position
+                        results = result.get('results') or []
+                        accepted = [position for position in range(len(records)) if position not in rejections]
+                        records.browse([records[position].id for position in accepted])._loopjet_mark_batch_synced(
+                            [record_list[position] for position in accepted],
+                            dict(result, results=[results[position] if position < len(results) else {} for position in accepted]))
+                    else:
+                        error_count += len(record_list)
+                        log.fail(f'company:{company.id}', f'HTTP{response.status_code}', response.text, count=len(record_list))
+                        records._loopjet_record_failure('HTTPError', response.text, response.status_code)
+                except Exception as e:
+                    error_count += len(record_list)
+                    log.fail(f'company:{company.id}', type(e).__name__, str(e), count=len(record_list))
+                    records._loopjet_record_failure(type(e).__name__, str(e))
+
+        return success_count, error_count
+
+    def _loopjet_auto_sync_enabled(self):
+        """Check whether auto-sync is enabled for this model."""
+        if not self._loopjet_auto_sync_param:
+            return False
+        return bool(self.env['ir.config_parameter'].sudo().get_param(self._loopjet_auto_sync_param, False))
+
+    def _loopjet_schedule_sync(self):
+        """
+        Queue these records for a single sync after the current transaction commits.
+
+        A form save usually produces several write() calls on the same record
+        (onchanges, line edits, recomputed fields). Record IDs are collected per
+        transaction and sent once, deduplicated, from a post-commit hook. If the
+        transaction is rolled back, the hook is discarded and nothing is sent.
+        The hook syncs in the 'auto' class if a slot is free right away, and
+        queues an auto-sync job otherwise.
+
+        Imports and mass updates touching more than ``loopjet.deferred_sync_threshold``
+        records (500 by default) are handed to a chunked bulk job instead of
+        being synced at the end of the request. Nothing is scheduled under a
+        ``loopjet_skip_sync`` context, used while a record is still being built;
+        the records stay flagged as needing a sync.
+        """
+        if not self or self.env.context.get('loopjet_skip_sync'):
+            return
+
+        cr = self.env.cr
+        deferred = self._loopjet_defer_sync()
+        key = f'loopjet.{"deferred" if deferred else "sync"}.{self._name}'
+        pending = cr.postcommit.data.get(key)
+        if pending is None:
+            pending = cr.postcommit.data[key] = set()
+
+            registry = self.env.registry
+            uid = self.env.uid
+            context = dict(self.env.context)
+            model_name = self._name
+
+            @cr.postcommit.add
+            def _loopjet_flush_scheduled_sync():
+                record_ids = cr.postcommit.data.pop(key, set())
+                if not record_ids:
+                    return
+                with registry.cursor() as new_cr:
+                    env = api.Environment(new_cr, uid, context)
+                    records = env[model_name].browse(sorted(record_ids)).exists()
+                    threshold = int(env['ir.config_parameter'].sudo().get_param('loopjet.deferred_sync_threshold', 500))
+                    if deferred or len(records) > threshold:
+                        _logger.info(f"Deferring Loopjet sync of {len(records)} {model_name} records to a bulk job")
+                        records._loopjet_enqueue_sync('bulk', name=f'Sync {len(records)} imported or updated {records._description} records')
+                        return
+                    # Auto-syncs use their own class, and never make the request wait for a slot
+                    for company, company_records in records._loopjet_group_by_company().items():
+                        try:
+                            company_records._loopjet_sync_now('auto', timeout=0.0)
+                        except Exception as e:
+                            _logger.error(f"Error in post-commit Loopjet sync of {len(company_records)} {model_name} records for company {company.name}: {str(e)}")
+
+        pending.update(self.ids)
+
+    @api.model
+    def _loopjet_fetch_remote_digests(self, company, bucket_size):
+        """
+        Ask Loopjet for the bucket digests of the records it holds for this company.
+
+        Loopjet hashes each record the same way as _loopjet_bucket_digest(), keyed by
+        the Odoo record ID (external_id) and grouped into buckets of ``bucket_size``
+        consecutive IDs.
+
+        Returns:
+            dict: bucket number -> digest, or None if Loopjet cannot provide digests
+        """
+        endpoint = self._loopjet_batch_endpoint
+        try:
+            url = f"{company._loopjet_get_api_url()}/api/v1/batch/{endpoint}/digests"
+            response = company._loopjet_get_session().post(
+                url,
+                json={'bucket_size': bucket_size, 'external_system': 'odoo'},
+                headers=company._loopjet_get_api_headers(),
+                timeout=60,
+            )
+        except requests.exceptions.RequestException as e:
+            _logger.warning(f"Could not fetch Loopjet {endpoint} digests for company {company.name}: {str(e)}")
+            return None
+
+        if response.status_code not in [200, 201]:
+            if response.status_code not in [404, 405, 501]:
+                _logger.warning(f"Fetching Loopjet {endpoint} digests failed for company {company.name}: HTTP {response.status_code}")
+            return None
+
+        return {int(bucket): digest for bucket, digest in response.json().get('buckets', {}).items()}
+
+    @api.model
+    def _loopjet_reconcile(self, bucket_size=None):
+        """
+        Detect drift between Odoo and Loopjet and re-sync only what differs.
+
+        Every synced record is hashed from its current payload and the hashes are
+        grouped into buckets of consecutive IDs, one digest per bucket. Bucket
+        digests are compared with the ones returned by Loopjet or, when Loopjet
+        cannot provide them, with a local stand-in built from the hash of the
+        payload Loopjet last accepted (loopjet_sync_hash). Only records of
+        mismatched buckets are sent again.
+
+        Returns:
+            int: number of records re-synced
+        """
+        if not bucket_size:
+            bucket_size = int(self.env['ir.config_parameter'].sudo().get_param('loopjet.reconcile_bucket_size', 1000))
+
+        domain = self._loopjet_sync_domain() + [(self._loopjet_id_field, '!=', False)]
+
+        # company id -> bucket -> [(record id, payload hash)], for current and last accepted payloads
+        current = {}
+        stored = {}
+        for chunk in self._loopjet_iter_chunks(domain):
+            for company, company_records in chunk._loopjet_group_by_company().items():
+                company_current = current.setdefault(company.id, {})
+                company_stored = stored.setdefault(company.id, {})
+                for record in company_records:
+                    bucket = record.id // bucket_size
+                    company_current.setdefault(bucket, []).append((record.id, self._loopjet_hash_payload(record._prepare_loopjet_data())))
+                    company_stored.setdefault(bucket, []).append((record.id, record.loopjet_sync_hash or ''))
+
+        resync_count = 0
+        for company_id, company_current in current.items():
+            company = self.env['res.company'].browse(company_id)
+            company_stored = stored[company_id]
+
+            reference = self._loopjet_fetch_remote_digests(company, bucket_size)
+            use_remote = reference is not None
+            if not use_remote:
+                reference = {bucket: self._loopjet_bucket_digest(entries) for bucket, entries in company_stored.items()}
+
+            mismatched = [bucket for bucket, entries in company_current.items() if self._loopjet_bucket_digest(entries) != reference.get(bucket)]
+
+            resync_ids = []
+            for bucket in mismatched:
+                if use_remote:
+                    # Loopjet only tells us the bucket differs, send all its records
+                    resync_ids += [record_id for record_id, _payload_hash in company_current[bucket]]
+                else:
+                    stored_hashes = dict(company_stored[bucket])
+                    resync_ids += [record_id for record_id, payload_hash in company_current[bucket] if stored_hashes.get(record_id) != payload_hash]
+
+            extra_buckets = set(reference) - set(company_current)
+            _logger.info(
+                f"Loopjet reconciliation of {self._name} for company {company.name}: "
+                f"{len(mismatched)}/{len(company_current)} buckets differ ({'remote' if use_remote else 'local'} digests), "
+                f"re-syncing {len(resync_ids)} records"
+                + (f", {len(extra_buckets)} buckets only exist in Loopjet" if extra_buckets else "")
+            )
+
+            for records in self.with_company(company)._loopjet_iter_chunks([('id', 'in', resync_ids)]):
+                try:
+                    # Loopjet's copy may differ in any key, send the complete records
+                    records.with_context(loopjet_full_sync=True).sync_to_loopjet()
+                except Exception as e:
+                    _logger.error(f"Error re-syncing {self._name} records for company {company.name}: {str(e)}")
+            resync_count += len(resync_ids)
+
+        return resync_count
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+In-memory hashing vector index for local similarity search.
+
+Texts are turned into fixed-size vectors with the hashing trick: features
+(words or character trigrams) are hashed into buckets, weighted by sublinear
+term frequency and inverse document frequency, and L2-normalized, so cosine
+similarity is a dot product. Rows only keep their non-zero buckets, so the
+memory used grows with the text indexed, not with the number of dimensions.
+With NumPy installed, rows are scored with vectorized operations over CSR
+arrays; otherwise a pure Python fallback gives the same results.
+
+Indexes are kept per worker in a registry and shared by its threads.
+"""
+
+import heapq
+import math
+import re
+import threading
+import time
+import zlib
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+_STOPWORDS = frozenset([
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'but', 'by', 'for', 'from', 'has', 'have', 'he', 'her', 'his', 'i',
+    'if', 'in', 'into', 'is', 'it', 'its', 'me', 'my', 'no', 'not', 'of', 'on', 'or', 'our', 'she', 'so', 'that',
+    'the', 'their', 'them', 'then', 'there', 'these', 'they', 'this', 'to', 'us', 'was', 'we', 'were', 'will',
+    'with', 'you', 'your',
+])
+
+
+def word_features(text):
+    """Words and word pairs of a text, without stopwords."""
+    words = [word for word in _WORD_RE.findall(text.lower()) if len(word) > 1 and word not in _STOPWORDS]
+    return words + [f'{first} {second}' for first, second in zip(words, words[1:])]
+
+
+def trigram_features(text):
+    """Character trigrams of the words of a text, padded so word starts and ends weigh more."""
+    trigrams = []
+    for word in _WORD_RE.findall(text.lower()):
+        padded = f' {word} '
+        trigrams.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+    return trigrams
+
+
+class HashingIndex:
+    """
+    Cosine similarity index over hashed text features.
+
+    The IDF weights are computed by build() and kept by update(), so rows
+    added incrementally are weighted like the others until the next build.
+
+    Rows are stored sparse, only their non-zero buckets: with NumPy as CSR
+    arrays (row offsets, buckets, weights), otherwise as dictionaries. Rows
+    replaced by update() or dropped by remove() are only unlinked from their
+    key; their space is reclaimed by the next build().
+    """
+
+    def __init__(self, features, dimensions=1024):
+        self.features = features
+        self.dimensions = dimensions
+        # Key of each row, None for the rows replaced or removed since the last build
+        self.keys = []
+        self.positions = {}
+        self.idf = [1.0] * dimensions
+        self.rows = self._pack([]) if numpy else []
+        # Set by the first successful build(), so a failed build is retried by the next caller
+        self.built_at = None
+        self.built_size = 0
+        # Free for the caller to store its refresh cursor (e.g. highest indexed ID)
+        self.watermark = None
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.positions)
+
+    def needs_build(self, ttl):
+        """Whether the index was never built, or was built more than ttl seconds ago. Call under the lock."""
+        return self.built_at is None or time.monotonic() - self.built_at > ttl
+
+    def _counts(self, text):
+        counts = {}
+        for feature in self.features(text or ''):
+            bucket = zlib.crc32(feature.encode()) % self.dimensions
+            counts[bucket] = counts.get(bucket, 0) + 1
+        return counts
+
+    def _vector(self, counts):
+        weights = {bucket: (1 + math.log(count)) * self.idf[bucket] for bucket, count in counts.items()}
+        norm = math.sqrt(sum(weight * weight for weight in weights.values()))
+        return {bucket: weight / norm for bucket, weight in weights.items()} if norm else {}
+
+    def _pack(self, vectors):
+        """CSR arrays (row offsets, buckets, weights) of these sparse vectors."""
+        offsets = numpy.zeros(len(vectors) + 1, dtype=numpy.int64)
+        offsets[1:] = numpy.cumsum([len(vector) for vector in vectors], dtype=numpy.int64)
+        size = int(offsets[-1])
+        buckets = numpy.fromiter((bucket for vector in vectors for bucket in vector), dtype=numpy.int32, count=size)
+        weights = numpy.fromiter((weight for vector in vectors for weight in vector.values()),
+                                 dtype=numpy.float32, count=size)
+        return offsets, buckets, weights
+
+    def _unlink(self, keys):
+        for key in keys:
+            position = self.positions.pop(key, None)
+            if position is not None:
+                self.keys[position] = None
+                if not numpy:
+                    self.rows[position] = {}
+
+    def build(self, items):
+        """
+        Index these (key, text) pairs, replacing the current content.
+        """
+        items = list(dict(items).items())
+        counts = [self._counts(text) for _key, text in items]
+        document_frequency = [0] * self.dimensions
+        for text_counts in counts:
+            for bucket in text_counts:
+                document_frequency[bucket] += 1
+        size = len(items)
+
+        with self.lock:
+            self.idf = [math.log((1 + size) / (1 + frequency)) + 1 for frequency in document_frequency]
+            vectors = [self._vector(text_counts) for text_counts in counts]
+            self.rows = self._pack(vectors) if numpy else vectors
+            self.keys = [key for key, _text in items]
+            self.positions = {key: position for position, key in enumerate(self.keys)}
+            self.built_at = time.monotonic()
+            self.built_size = size
+
+    def update(self, items):
+        """Add or replace the rows of these (key, text) pairs."""
+        items = list(dict(items).items())
+        if not items:
+            return
+        with self.lock:
+            vectors = [self._vector(self._counts(text)) for _key, text in items]
+            self._unlink(key for key, _text in items)
+            self.positions.update({key: len(self.keys) + offset for offset, (key, _text) in enumerate(items)})
+            self.keys += [key for key, _text in items]
+            if numpy:
+                offsets, buckets, weights = self.rows
+                new_offsets, new_buckets, new_weights = self._pack(vectors)
+                self.rows = (
+                    numpy.concatenate([offsets, new_offsets[1:] + offsets[-1]]),
+                    numpy.concatenate([buckets, new_buckets]),
+                    numpy.concatenate([weights, new_weights]),
+                )
+            else:
+                self.rows += vectors
+
+    def remove(self, keys):
+        """Drop the rows of these keys."""
+        with self.lock:
+            self._unlink(keys)
+
+    def search(self, texts, limit=5, min_score=0.0):
+        """
+        Find the rows most similar to each of these texts.
+
+        Returns:
+            list: for each text, a list of (key, score) pairs, best first
+        """
+        vectors = [self._vector(self._counts(text)) for text in texts]
+        with self.lock:
+            if not self.positions or not vectors:
+                return [[] for _text in texts]
+
+            if numpy:
+                offsets, buckets, weights = self.rows
+                size = len(self.keys)
+                unlinked = numpy.fromiter((key is None for key in self.keys), dtype=bool, count=size)
+                top = min(limit, size)
+                query = numpy.zeros(self.dimensions, dtype=numpy.float32)
+                results = []
+                for vector in vectors:
+                    query[:] = 0.0
+                    if vector:
+                        query[list(vector)] = list(vector.values())
+                    # Row sums of the products of the non-zero buckets, from their running total
+                    running = numpy.concatenate([[0.0], numpy.cumsum(weights * query[buckets], dtype=numpy.float64)])
+                    scores = running[offsets[1:]] - running[offsets[:-1]]
+                    scores[unlinked] = -1.0
+                    best = numpy.argpartition(-scores, top - 1)[:top]
+                    best = best[numpy.argsort(-scores[best])]
+                    results.append([(self.keys[position], float(scores[position])) for position in best
+                                    if scores[position] > min_score])
+                return results
+
+            results = []
+            for vector in vectors:
+                scored = (
+                    (sum(weight * row.get(bucket, 0.0) for bucket, weight in vector.items()), position)
+                    for position, row in enumerate(self.rows)
+                )
+                results.append([(self.keys[position], score) for score, position in heapq.nlargest(limit, scored)
+                                if score > min_score and self.keys[position] is not None])
+            return results
+
+
+# Indexes of this worker per (database, index name)
+_INDEXES = {}
+_INDEXES_LOCK = threading.Lock()
+
+
+def get_index(dbname, name, features, dimensions=1024):
+    """
+    Get the index of a database, creating an empty one on first use.
+
+    The caller builds it when index.needs_build() says so, under its lock.
+    """
+    key = (dbname, name)
+    with _INDEXES_LOCK:
+        index = _INDEXES.get(key)
+        if index is None:
+            index = _INDEXES[key] = HashingIndex(features, dimensions)
+        return index
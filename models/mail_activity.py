@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, api
+
+
+class MailActivity(models.Model):
+    _inherit = 'mail.activity'
+
+    def _loopjet_outdate_lead_digests(self):
+        """Outdate the Loopjet deal digest of the leads these activities are scheduled on."""
+        lead_ids = [activity.res_id for activity in self if activity.res_model == 'crm.lead']
+        if lead_ids:
+            self.env['crm.lead']._loopjet_mark_digest_stale(lead_ids)
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        """Outdate the deal digest of the leads receiving new activities."""
+        activities = super(MailActivity, self).create(vals_list)
+        activities._loopjet_outdate_lead_digests()
+        return activities
+
+    def write(self, vals):
+        """Outdate the deal digest of the leads whose activities changed, before and after a move."""
+        changed = {'activity_type_id', 'summary', 'note', 'date_deadline', 'res_model', 'res_id'}.intersection(vals)
+        if changed:
+            self._loopjet_outdate_lead_digests()
+        result = super(MailActivity, self).write(vals)
+        if {'res_model', 'res_id'}.intersection(changed):
+            self._loopjet_outdate_lead_digests()
+        return result
+
+    def unlink(self):
+        """Outdate the deal digest of the leads losing activities."""
+        self._loopjet_outdate_lead_digests()
+        return super(MailActivity, self).unlink()
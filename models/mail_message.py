@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, api
+
+
+class MailMessage(models.Model):
+    _inherit = 'mail.message'
+
+    def _loopjet_outdate_lead_digests(self):
+        """Outdate the Loopjet deal digest of the leads these messages are posted on."""
+        lead_ids = [message.res_id for message in self if message.model == 'crm.lead']
+        if lead_ids:
+            self.env['crm.lead']._loopjet_mark_digest_stale(lead_ids)
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        """Outdate the deal digest of the leads receiving new messages."""
+        messages = super(MailMessage, self).create(vals_list)
+        messages._loopjet_outdate_lead_digests()
+        return messages
+
+    def write(self, vals):
+        """Outdate the deal digest of the leads whose messages changed, before and after a move."""
+        changed = {'body', 'message_type', 'model', 'res_id'}.intersection(vals)
+        if changed:
+            self._loopjet_outdate_lead_digests()
+        result = super(MailMessage, self).write(vals)
+        if {'model', 'res_id'}.intersection(changed):
+            self._loopjet_outdate_lead_digests()
+        return result
+
+    def unlink(self):
+        """Outdate the deal digest of the leads losing messages."""
+        self._loopjet_outdate_lead_digests()
+        return super(MailMessage, self).unlink()
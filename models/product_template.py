@@ -1,15 +1,26 @@
 # -*- coding: utf-8 -*-
 
 from odoo import models, fields, api
-import requests
-import json
+from .loopjet_vector_index import get_index, trigram_features, word_features
 import logging
 
 _logger = logging.getLogger(__name__)
 
 
+def _escape_like(value):
+    """Escape the LIKE wildcards of a value, for an exact case-insensitive `=ilike` comparison."""
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
 class ProductTemplate(models.Model):
-    _inherit = 'product.template'
+    _name = 'product.template'
+    _inherit = ['product.template', 'loopjet.sync.mixin']
+
+    _loopjet_auto_sync_param = 'loopjet.auto_sync_products'
+    _loopjet_batch_endpoint = 'products'
+    _loopjet_batch_upsert = True
+    _loopjet_id_field = 'loopjet_product_id'
+    _loopjet_payload_fields = {'name', 'description_sale', 'description', 'type', 'list_price', 'currency_id', 'uom_id', 'sale_ok'}
 
     loopjet_product_id = fields.Char(
         string='Loopjet Product ID',
@@ -30,96 +41,289 @@ class ProductTemplate(models.Model):
         help='Last time this product was synced to Loopjet'
     )
 
+    @api.model
+    def _loopjet_search_stale(self, company=None):
+        """
+        Find saleable, already synced products changed since their last Loopjet sync.
+
+        Served by the partial index on the needs-sync flag, so the cost depends
+        on the number of changed products, not on the size of the catalog.
+        """
+        domain = self._loopjet_dirty_domain() + [('loopjet_product_id', '!=', False)]
+        if company:
+            domain.append(('company_id', 'in', [False, company.id]))
+        return self.search(domain)
+
+    def _loopjet_sync_domain(self):
+        """Only products that can be sold are synced."""
+        return [('sale_ok', '=', True)]
+
+    @api.model
+    def _loopjet_get_catalog_index(self):
+        """
+        Get this worker's word index over the products known to Loopjet.
+
+        Built once, then refreshed incrementally from the products written since
+        the last refresh; the whole index is rebuilt every
+        ``loopjet.similarity_index_ttl`` seconds (one hour by default). The
+        index is shared by all users of the worker, so it is built as superuser
+        over the products of all companies; the shortlist is filtered with the
+        access rights of the caller.
+        """
+        ProductTemplate = self.sudo()
+        index = get_index(self.env.cr.dbname, 'loopjet.catalog', word_features, dimensions=2048)
+        ttl = int(self.env['ir.config_parameter'].sudo().get_param('loopjet.similarity_index_ttl', 3600))
+        domain = self._loopjet_sync_domain() + [('loopjet_product_id', '!=', False)]
+
+        with index.lock:
+            refresh_start = fields.Datetime.now()
+            if index.needs_build(ttl):
+                items = []
+                for products in ProductTemplate._loopjet_iter_chunks(domain, chunk_size=1000):
+                    items += [(product.id, product._loopjet_catalog_text()) for product in products]
+                index.build(items)
+                _logger.info(f"Built the Loopjet catalog index with {len(items)} products")
+            else:
+                changed = ProductTemplate.with_context(active_test=False).search([('write_date', '>=', index.watermark)])
+                listed = changed.filtered_domain(domain + [('active', '=', True)])
+                index.remove((changed - listed).ids)
+                index.update((product.id, product._loopjet_catalog_text()) for product in listed)
+            index.watermark = refresh_start
+        return index
+
+    def _loopjet_catalog_text(self):
+        """Text of a product for catalog shortlisting."""
+        self.ensure_one()
+        return f"{self.name} {self.description_sale or ''}"
+
+    @api.model
+    def _loopjet_shortlist_catalog(self, text, company, limit):
+        """
+        Rank the products known to Loopjet against a deal and keep the best ones.
+
+        Returns:
+            list: Loopjet IDs of the best matching products of the company, best first
+        """
+        matches = self._loopjet_get_catalog_index().search([text], limit=limit * 2)[0]
+        ranked_ids = [product_id for product_id, _score in matches]
+        # Searched rather than browsed, so record rules and the company keep other companies' products out
+        products = self.search([
+            ('id', 'in', ranked_ids),
+            ('company_id', 'in', [False, company.id]),
+            ('loopjet_product_id', '!=', False),
+        ])
+        loopjet_ids = {product.id: product.loopjet_product_id for product in products}
+        return [loopjet_ids[product_id] for product_id in ranked_ids if product_id in loopjet_ids][:limit]
+
+    def _prepare_loopjet_data(self):
+        """Prepare product data for the Loopjet API."""
+        self.ensure_one()
+        # API expects is_service and handles transformation to database type field
+        return {
+            'name': self.name,
+            'description': self.description_sale or self.description or '',
+            'is_service': self.type == 'service',
+            'price': float(self.list_price),
+            'currency': self.currency_id.name if self.currency_id else 'EUR',
+            'unit': self.uom_id.name if self.uom_id else 'piece',
+        }
+
     def sync_to_loopjet(self):
-        """Sync this product to Loopjet."""
-        for product in self:
-            try:
-                # Get API configuration
-                api_key = self.env['ir.config_parameter'].sudo().get_param('loopjet.api_key')
-                _logger.info(f"Retrieved API key: {api_key[:10] if api_key else 'NONE'}...")
-                
-                if not api_key:
-                    raise ValueError('Loopjet API key not configured')
-                
-                api_url = 'https://loopjet-api.fly.dev'
-                headers = {
-                    'Authorization': f'Bearer {api_key}',
-                    'Content-Type': 'application/json',
-                }
-                
-                _logger.info(f"Headers: {headers}")
-                _logger.info(f"Syncing product {product.name} to Loopjet at {api_url}")
-                
-                # Prepare product data for Loopjet API
-                # API expects is_service and handles transformation to database type field
-                product_data = {
-                    'name': product.name,
-                    'description': product.description_sale or product.description or '',
-                    'is_service': product.type == 'service',
-                    'price': float(product.list_price),
-                    'currency': product.currency_id.name if product.currency_id else 'EUR',
-                    'unit': product.uom_id.name if product.uom_id else 'piece',
-                }
-                
-                _logger.info(f"Product data: {product_data}")
-                
-                # If already synced, update; otherwise create
-                if product.loopjet_product_id:
-                    # Update existing product
-                    url = f"{api_url}/api/v1/products/{product.loopjet_product_id}"
-                    _logger.info(f"Updating product at {url}")
-                    response = requests.put(url, json=product_data, headers=headers, timeout=30, allow_redirects=True)
-                else:
-                    # Create new product
-                    url = f"{api_url}/api/v1/products/"  # Trailing slash important!
-                    _logger.info(f"Creating product at {url}")
-                    response = requests.post(url, json=product_data, headers=headers, timeout=30, allow_redirects=True)
-                
-                _logger.info(f"API Response: Status={response.status_code}, Body={response.text[:200]}")
-                
-                if response.status_code in [200, 201]:
-                    result = response.json()
-                    product.write({
-                        'loopjet_product_id': result.get('id'),
-                        'loopjet_synced': True,
-                        'loopjet_last_sync': fields.Datetime.now(),
-                    })
-                    _logger.info(f"Successfully synced product {product.name} to Loopjet (ID: {result.get('id')})")
-                else:
-                    error_msg = f"Failed to sync product {product.name}: HTTP {response.status_code} - {response.text}"
-                    _logger.error(error_msg)
-                    raise Exception(error_msg)
+        """Sync these products to Loopjet, logging one summary line for the run."""
+        with self._loopjet_sync_log() as log:
+            for product in self:
+                try:
+                    # Get API configuration for the product's company
+                    company = product._loopjet_get_company()
+                    if not company._loopjet_get_api_key():
+                        log.skip('no_api_key')
+                        continue
                     
-            except Exception as e:
-                error_msg = f"Error syncing product {product.name} to Loopjet: {str(e)}"
-                _logger.error(error_msg)
-                raise  # Re-raise to be caught by batch sync
+                    api_url = company._loopjet_get_api_url()
+                    headers = company._loopjet_get_api_headers()
+                    session = company._loopjet_get_session()
+                    
+                    # Prepare product data for Loopjet API
+                    product_data = product._prepare_loopjet_data()
+                    log.payload(product.id, product_data)
+                    
+                    # If already synced, update; otherwise create
+                    if product.loopjet_product_id:
+                        # Update existing product
+                        url = f"{api_url}/api/v1/products/{product.loopjet_product_id}"
+                        response = product._loopjet_send_update(company, url, product_data)
+                    else:
+                        # Create new product
+                        url = f"{api_url}/api/v1/products/"  # Trailing slash important!
+                        response = session.post(url, json=product_data, headers=headers, timeout=30, allow_redirects=True)
+                    
+                    if response.status_code in [200, 201]:
+                        result = response.json()
+                        product.write({
+                            'loopjet_product_id': result.get('id') or product.loopjet_product_id,
+                            'loopjet_synced': True,
+                            **product._loopjet_sync_state_vals(product_data),
+                        })
+                        product._loopjet_clear_failure()
+                        log.ok()
+                    else:
+                        log.fail(product.id, f'HTTP{response.status_code}', response.text)
+                        product._loopjet_record_failure('HTTPError', response.text, response.status_code)
+                        
+                except Exception as e:
+                    # Keep going with the other products, the failure is retried later
+                    log.fail(product.id, type(e).__name__, str(e))
+                    product._loopjet_record_failure(type(e).__name__, str(e))
 
-    @api.model
-    def create(self, vals):
-        """Auto-sync to Loopjet if enabled."""
-        product = super(ProductTemplate, self).create(vals)
+    @api.model_create_multi
+    def create(self, vals_list):
+        """Schedule a post-commit sync to Loopjet if auto-sync is enabled."""
+        products = super(ProductTemplate, self).create(vals_list)
+        products._loopjet_flag_new()
         
-        auto_sync = self.env['ir.config_parameter'].sudo().get_param('loopjet.auto_sync_products', False)
-        if auto_sync:
-            product.sync_to_loopjet()
+        if products._loopjet_auto_sync_enabled():
+            products._loopjet_schedule_sync()
         
-        return product
+        return products
     
     def write(self, vals):
-        """Auto-sync to Loopjet if enabled and product is already synced."""
+        """Schedule a post-commit sync to Loopjet if auto-sync is enabled and product is already synced."""
         result = super(ProductTemplate, self).write(vals)
+        self._loopjet_flag_dirty(vals)
         
-        # Don't trigger sync if only Loopjet metadata fields are being updated (prevents infinite loop)
-        loopjet_fields = {'loopjet_product_id', 'loopjet_synced', 'loopjet_last_sync'}
-        if set(vals.keys()).issubset(loopjet_fields):
+        # Only changes of the fields feeding the payload are worth a sync (this also prevents
+        # the metadata written after a sync from triggering another one)
+        if not self._loopjet_payload_changed(vals):
             return result
         
-        auto_sync = self.env['ir.config_parameter'].sudo().get_param('loopjet.auto_sync_products', False)
-        if auto_sync:
+        if self._loopjet_auto_sync_enabled():
             synced_products = self.filtered(lambda p: p.loopjet_synced)
             if synced_products:
-                synced_products.sync_to_loopjet()
+                synced_products._loopjet_schedule_sync()
         
         return result
 
+
+class ProductProduct(models.Model):
+    _inherit = 'product.product'
+
+    def _loopjet_match_text(self):
+        """Text of a product for fuzzy matching, the name counted twice to outweigh long descriptions."""
+        self.ensure_one()
+        return f"{self.name} {self.name} {self.default_code or ''} {self.description_sale or ''}"
+
+    @api.model
+    def _loopjet_get_match_index(self):
+        """
+        Get this worker's trigram index over saleable product names and descriptions.
+
+        Built once, then refreshed incrementally from the products (or their
+        templates) written since the last refresh; products archived or no
+        longer saleable are dropped. The whole index is rebuilt every
+        ``loopjet.similarity_index_ttl`` seconds (one hour by default). The
+        index is shared by all users of the worker, so it is built as superuser
+        over the products of all companies; matches are filtered with the
+        access rights of the caller.
+        """
+        index = get_index(self.env.cr.dbname, 'loopjet.products', trigram_features, dimensions=2048)
+        ttl = int(self.env['ir.config_parameter'].sudo().get_param('loopjet.similarity_index_ttl', 3600))
+        Product = self.sudo().with_context(active_test=False)
+
+        with index.lock:
+            refresh_start = fields.Datetime.now()
+            if index.needs_build(ttl):
+                items = []
+                # Chunked over the saleable templates with the mixin helper, indexing their active variants
+                for templates in self.env['product.template'].sudo()._loopjet_iter_chunks([('sale_ok', '=', True)], chunk_size=1000):
+                    items += [(product.id, product._loopjet_match_text()) for product in templates.product_variant_ids]
+                index.build(items)
+                _logger.info(f"Built the Loopjet product match index with {len(items)} products")
+            else:
+                changed = Product.search(['|', ('write_date', '>=', index.watermark), ('product_tmpl_id.write_date', '>=', index.watermark)])
+                matchable = changed.filtered(lambda p: p.active and p.sale_ok)
+                index.remove((changed - matchable).ids)
+                index.update((product.id, product._loopjet_match_text()) for product in matchable)
+            index.watermark = refresh_start
+        return index
+
+    @api.model
+    def _loopjet_match_items(self, items, company, limit=3):
+        """
+        Match the items of an AI estimate to existing products, all items in one pass.
+
+        Products with the same name or internal reference win; the others are
+        matched by trigram similarity of their name and description.
+
+        Args:
+            items: item dictionaries with a name and optionally a description
+            company: company the quotation is made for
+            limit: candidates considered per item
+
+        Returns:
+            list: matching product.product or None for each item, in order
+        """
+        exact_matches = self._loopjet_match_exact(items, company)
+        fuzzy_items = [item for item, exact in zip(items, exact_matches) if not exact]
+        fuzzy_matches = iter(self._loopjet_match_fuzzy(fuzzy_items, company, limit) if fuzzy_items else [])
+        return [exact or next(fuzzy_matches) for exact in exact_matches]
+
+    @api.model
+    def _loopjet_match_exact(self, items, company):
+        """
+        Match items to products with the same name or internal reference, ignoring case.
+
+        Returns:
+            list: matching product.product or None for each item, in order
+        """
+        names = {(item.get('name') or '').strip() for item in items} - {''}
+        if not names:
+            return [None] * len(items)
+
+        # `=ilike` without wildcards, so `%` and `_` in a name are matched literally
+        leaves = [('name', '=ilike', _escape_like(name)) for name in names] + [('default_code', 'in', list(names))]
+        domain = ['|'] * (len(leaves) - 1) + leaves
+        products = self.search(domain + [('company_id', 'in', [False, company.id])], order='id')
+
+        by_key = {}
+        for product in products:
+            by_key.setdefault(product.name.lower(), product)
+            if product.default_code:
+                by_key.setdefault(product.default_code, product)
+
+        matches = []
+        for item in items:
+            name = (item.get('name') or '').strip()
+            match = by_key.get(name) or by_key.get(name.lower())
+            if match:
+                _logger.info(f"Matched item '{name}' to product {match.display_name} by name")
+            matches.append(match)
+        return matches
+
+    @api.model
+    def _loopjet_match_fuzzy(self, items, company, limit):
+        """
+        Match items to the closest products by name and description, above the match threshold.
+
+        Returns:
+            list: matching product.product or None for each item, in order
+        """
+        threshold = float(self.env['ir.config_parameter'].sudo().get_param('loopjet.product_match_threshold', 0.55))
+        texts = [f"{item.get('name', '')} {item.get('name', '')} {item.get('description') or ''}" for item in items]
+        results = self._loopjet_get_match_index().search(texts, limit=limit, min_score=threshold)
+
+        # Searched rather than browsed, so record rules hide products the user cannot read
+        candidate_ids = {product_id for candidates in results for product_id, _score in candidates}
+        allowed = self.search([('id', 'in', list(candidate_ids)), ('company_id', 'in', [False, company.id])])
+        allowed_by_id = {product.id: product for product in allowed}
+
+        matches = []
+        for item, candidates in zip(items, results):
+            match = None
+            for product_id, score in candidates:
+                product = allowed_by_id.get(product_id)
+                if product:
+                    _logger.info(f"Matched item '{item.get('name')}' to product {product.display_name} ({score:.0%})")
+                    match = product
+                    break
+            matches.append(match)
+        return matches
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+from requests.adapters import HTTPAdapter
+import requests
+import threading
+import time
+import logging
+
+_logger = logging.getLogger(__name__)
+
+LOOPJET_DEFAULT_API_URL = 'https://loopjet-api.fly.dev'
+
+# One pooled HTTP session per (database, company, endpoint, key), shared by all
+# threads of the worker. Keeping tenants apart means a company pushing a large
+# backlog only ever exhausts its own connection pool.
+_LOOPJET_SESSIONS = {}
+_LOOPJET_SESSIONS_LOCK = threading.Lock()
+_LOOPJET_POOL_SIZE = 4
+
+# Last known credit balance per (database, company): (fetched at, balance)
+_LOOPJET_CREDIT_CACHE = {}
+
+# Credits required by a generation per (database, company), as last reported by a 402 response
+_LOOPJET_REQUIRED_CREDITS = {}
+
+# Models kept in sync with Loopjet, in the order they are processed by crons
+LOOPJET_SYNCED_MODELS = ['product.template', 'res.partner', 'sale.order', 'account.move']
+
+
+class ResCompany(models.Model):
+    _inherit = 'res.company'
+
+    loopjet_api_key = fields.Char(
+        string='Loopjet API Key',
+        groups='base.group_system',
+        help='Loopjet API key used for records of this company. '
+             'Leave empty to use the database-wide key.'
+    )
+
+    loopjet_api_url = fields.Char(
+        string='Loopjet API URL',
+        groups='base.group_system',
+        help='Loopjet API endpoint used for records of this company. '
+             'Leave empty to use the default Loopjet server.'
+    )
+
+    def _loopjet_get_api_key(self):
+        """Get the Loopjet API key of this company, falling back to the global key."""
+        self.ensure_one()
+        return self.sudo().loopjet_api_key or self.env['ir.config_parameter'].sudo().get_param('loopjet.api_key')
+
+    def _loopjet_get_api_url(self):
+        """Get the Loopjet API base URL of this company."""
+        self.ensure_one()
+        return (self.sudo().loopjet_api_url or LOOPJET_DEFAULT_API_URL).rstrip('/')
+
+    def _loopjet_get_api_headers(self):
+        """Get headers for Loopjet API requests made on behalf of this company."""
+        self.ensure_one()
+        api_key = self._loopjet_get_api_key()
+        if not api_key:
+            raise ValueError(f'Loopjet API key not configured for company {self.name}. Please configure it in Settings > General Settings > Loopjet Integration.')
+
+        return {
+            'Authorization': f'Bearer {api_key}',
+            'Content-Type': 'application/json',
+        }
+
+    def _loopjet_get_session(self):
+        """
+        Get the pooled HTTP session used to talk to Loopjet for this company.
+
+        Sessions are cached per database, company, endpoint and key, so a key or
+        URL change transparently starts a new pool.
+        """
+        self.ensure_one()
+        key = (self.env.cr.dbname, self.id, self._loopjet_get_api_url(), self._loopjet_get_api_key())
+        session = _LOOPJET_SESSIONS.get(key)
+        if session is None:
+            with _LOOPJET_SESSIONS_LOCK:
+                session = _LOOPJET_SESSIONS.get(key)
+                if session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=_LOOPJET_POOL_SIZE)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    _LOOPJET_SESSIONS[key] = session
+                    _logger.debug(f"Opened Loopjet connection pool for company {self.name}")
+        return session
+
+    def _loopjet_get_credit_balance(self, force=False):
+        """
+        Get the Loopjet credit balance of this company.
+
+        The balance is cached per worker for ``loopjet.credit_cache_ttl`` seconds
+        (60 by default), so the wizard and settings can show it without an API
+        round trip on every opening.
+
+        Returns:
+            float: credit balance, or None if it is unknown (no key, API error)
+        """
+        self.ensure_one()
+        key = (self.env.cr.dbname, self.id)
+        ttl = int(self.env['ir.config_parameter'].sudo().get_param('loopjet.credit_cache_ttl', 60))
+        cached = _LOOPJET_CREDIT_CACHE.get(key)
+        if cached and not force and time.monotonic() - cached[0] < ttl:
+            return cached[1]
+
+        if not self._loopjet_get_api_key():
+            return None
+
+        try:
+            url = f"{self._loopjet_get_api_url()}/api/v1/credits/balance"
+            response = self._loopjet_get_session().get(url, headers=self._loopjet_get_api_headers(), timeout=10)
+        except requests.exceptions.RequestException as e:
+            _logger.warning(f"Could not fetch Loopjet credit balance for company {self.name}: {str(e)}")
+            return cached[1] if cached else None
+
+        if response.status_code != 200:
+            _logger.warning(f"Fetching Loopjet credit balance failed for company {self.name}: HTTP {response.status_code}")
+            return cached[1] if cached else None
+
+        balance = response.json().get('balance')
+        self._loopjet_set_credit_balance(balance)
+        return balance
+
+    def _loopjet_set_credit_balance(self, balance):
+        """Remember a credit balance reported by Loopjet, or forget it if None."""
+        self.ensure_one()
+        key = (self.env.cr.dbname, self.id)
+        if balance is None:
+            _LOOPJET_CREDIT_CACHE.pop(key, None)
+        else:
+            _LOOPJET_CREDIT_CACHE[key] = (time.monotonic(), float(balance))
+
+    def _loopjet_set_required_credits(self, required):
+        """Remember the credits a generation requires, as reported by a 402 response."""
+        self.ensure_one()
+        if required:
+            _LOOPJET_REQUIRED_CREDITS[(self.env.cr.dbname, self.id)] = float(required)
+
+    def _loopjet_check_credits(self, required=None):
+        """
+        Refuse an AI generation locally when the balance is known to be too low.
+
+        Raises before any request is sent, so batch runs stop at the first deal
+        that cannot be paid for. The required credits come from
+        ``loopjet.estimate_required_credits`` when configured, or from the last
+        402 response of Loopjet; when neither is known, only an empty balance
+        blocks. An unknown balance never blocks generation, the API remains the
+        source of truth.
+
+        Args:
+            required: credits needed, defaults to the configured or learned value
+        """
+        self.ensure_one()
+        if required is None:
+            configured = self.env['ir.config_parameter'].sudo().get_param('loopjet.estimate_required_credits')
+            required = float(configured) if configured else _LOOPJET_REQUIRED_CREDITS.get((self.env.cr.dbname, self.id))
+
+        balance = self._loopjet_get_credit_balance()
+        if balance is None:
+            return
+        if required is None:
+            if balance <= 0:
+                raise UserError(_(
+                    'Insufficient Loopjet Credits\n\n'
+                    f'Current balance: {balance:g} credits\n\n'
+                    'Please purchase more credits in your Loopjet account.'
+                ))
+            return
+        if balance < required:
+            raise UserError(_(
+                'Insufficient Loopjet Credits\n\n'
+                f'Current balance: {balance:g} credits\n'
+                f'Required: {required:g} credits\n'
+                f'Shortfall: {required - balance:g} credits\n\n'
+                'Please purchase more credits in your Loopjet account.'
+            ))
+
+    @api.model
+    def _cron_loopjet_reconcile(self):
+        """Nightly consistency check between Odoo and Loopjet for all synced models."""
+        resync_count = 0
+        for model_name in LOOPJET_SYNCED_MODELS:
+            resync_count += self.env[model_name]._loopjet_reconcile()
+        return resync_count
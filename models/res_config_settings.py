@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 from odoo import models, fields, api
+from .res_company import LOOPJET_SYNCED_MODELS
 import logging
 
 _logger = logging.getLogger(__name__)
@@ -15,6 +16,26 @@ class ResConfigSettings(models.TransientModel):
         help='Your Loopjet API authentication key. Get it from your Loopjet account settings.'
     )
     
+    loopjet_company_api_key = fields.Char(
+        string='Company API Key',
+        related='company_id.loopjet_api_key',
+        readonly=False,
+        help='Loopjet API key used for records of the current company. Leave empty to use the key above.'
+    )
+    
+    loopjet_company_api_url = fields.Char(
+        string='Company API URL',
+        related='company_id.loopjet_api_url',
+        readonly=False,
+        help='Loopjet API endpoint used for records of the current company. Leave empty to use the default Loopjet server.'
+    )
+    
+    loopjet_credit_balance = fields.Float(
+        string='Credit Balance',
+        compute='_compute_loopjet_credit_balance',
+        help='Loopjet credits available to the current company (refreshed every minute).'
+    )
+    
     loopjet_auto_sync_products = fields.Boolean(
         string='Auto-sync Products',
         config_parameter='loopjet.auto_sync_products',
@@ -56,409 +77,180 @@ class ResConfigSettings(models.TransientModel):
         help='Default language for AI-generated estimates.'
     )
 
-    @api.model
-    def get_loopjet_api_headers(self):
-        """Get headers for Loopjet API requests."""
-        api_key = self.env['ir.config_parameter'].sudo().get_param('loopjet.api_key')
-        if not api_key:
-            raise ValueError('Loopjet API key not configured. Please configure it in Settings > General Settings > Loopjet Integration.')
-        
+    loopjet_backlog_count = fields.Integer(
+        string='Records Waiting for Sync',
+        compute='_compute_loopjet_backlog_count',
+        help='Products, contacts, quotations and invoices changed since their last successful Loopjet sync.'
+    )
+    
+    loopjet_stream_estimates = fields.Boolean(
+        string='Stream AI Results',
+        config_parameter='loopjet.stream_estimates',
+        default=False,
+        help='Add estimate lines to a draft quotation as soon as the AI returns them, instead of waiting for the complete estimate.'
+    )
+    
+    loopjet_max_concurrent_generations = fields.Integer(
+        string='Concurrent AI Quotations',
+        config_parameter='loopjet.max_concurrent_generations',
+        default=4,
+        help='Maximum number of AI quotations generated at the same time across all users. Further requests wait in a queue.'
+    )
+    
+    loopjet_max_generations_per_user = fields.Integer(
+        string='Concurrent AI Quotations per User',
+        config_parameter='loopjet.max_generations_per_user',
+        default=1,
+        help='Maximum number of AI quotations a single user can generate at the same time.'
+    )
+
+    @api.depends('company_id')
+    def _compute_loopjet_credit_balance(self):
+        for settings in self:
+            settings.loopjet_credit_balance = settings.company_id._loopjet_get_credit_balance() or 0.0
+    
+    def _compute_loopjet_backlog_count(self):
+        backlog_count = sum(self.env[model_name]._loopjet_backlog_count() for model_name in LOOPJET_SYNCED_MODELS)
+        for settings in self:
+            settings.loopjet_backlog_count = backlog_count
+    
+    def action_loopjet_refresh_credit_balance(self):
+        """Fetch the credit balance again, bypassing the cache."""
+        self.ensure_one()
+        self.company_id._loopjet_get_credit_balance(force=True)
         return {
-            'Authorization': f'Bearer {api_key}',
-            'Content-Type': 'application/json',
+            'type': 'ir.actions.client',
+            'tag': 'reload',
         }
     
+    @api.model
+    def get_loopjet_api_headers(self):
+        """Get headers for Loopjet API requests of the current company."""
+        return self.env.company._loopjet_get_api_headers()
+    
     @api.model
     def get_loopjet_api_url(self):
-        """Get Loopjet API base URL - hardcoded to production server."""
-        return 'https://loopjet-api.fly.dev'
+        """Get Loopjet API base URL of the current company."""
+        return self.env.company._loopjet_get_api_url()
     
-    def action_sync_all_products(self):
-        """Batch sync all products to Loopjet."""
-        self.ensure_one()
-        
-        # Check if API key is configured
-        api_key = self.env['ir.config_parameter'].sudo().get_param('loopjet.api_key')
-        if not api_key:
-            raise ValueError('Please configure your Loopjet API key before syncing products.')
-        
-        # Get all products (both product.product and product.template)
-        products = self.env['product.template'].search([
-            ('sale_ok', '=', True),  # Only products that can be sold
-        ])
-        
-        if not products:
-            return {
-                'type': 'ir.actions.client',
-                'tag': 'display_notification',
-                'params': {
-                    'title': 'No Products Found',
-                    'message': 'No products available to sync.',
-                    'type': 'warning',
-                    'sticky': False,
-                }
-            }
-        
-        # Prepare products for batch sync
-        import requests
-        
-        api_url = 'https://loopjet-api.fly.dev'
-        headers = {
-            'Authorization': f'Bearer {api_key}',
-            'Content-Type': 'application/json',
-        }
-        
-        product_list = []
-        for product in products:
-            product_list.append({
-                'name': product.name,
-                'description': product.description_sale or product.description or '',
-                'is_service': product.type == 'service',
-                'price': float(product.list_price),
-                'currency': product.currency_id.name if product.currency_id else 'EUR',
-                'unit': product.uom_id.name if product.uom_id else 'piece',
-            })
-        
-        # Use batch import endpoint with upsert to prevent duplicates
-        try:
-            url = f"{api_url}/api/v1/batch/products/batch"
-            response = requests.post(url, json={'products': product_list, 'upsert': True}, headers=headers, timeout=60)
-            
-            if response.status_code in [200, 201]:
-                result = response.json()
-                success_count = result.get('created', 0) + result.get('updated', 0)
-                error_count = result.get('failed', 0)
-            else:
-                success_count = 0
-                error_count = len(product_list)
-                _logger.error(f"Batch product sync failed: {response.text}")
-        except Exception as e:
-            success_count = 0
-            error_count = len(product_list)
-            _logger.error(f"Error in batch product sync: {str(e)}")
-        
-        # Show notification with results
-        if error_count == 0:
-            message = f'Successfully synced {success_count} products to Loopjet!'
-            notification_type = 'success'
-        else:
-            message = f'Synced {success_count} products. {error_count} failed. Check logs for details.'
-            notification_type = 'warning'
-        
+    def _loopjet_check_api_key(self, what):
+        """Raise if no Loopjet API key is available for the current company."""
+        if not self.env.company._loopjet_get_api_key():
+            raise ValueError(f'Please configure your Loopjet API key before syncing {what}.')
+    
+    def _loopjet_no_records_notification(self, title, message):
+        """Notification shown when there is nothing to sync."""
         return {
             'type': 'ir.actions.client',
             'tag': 'display_notification',
             'params': {
-                'title': 'Product Sync Complete',
+                'title': title,
                 'message': message,
-                'type': notification_type,
+                'type': 'warning',
                 'sticky': False,
             }
         }
     
-    def action_sync_all_contacts(self):
-        """Batch sync all contacts to Loopjet."""
-        self.ensure_one()
+    def _loopjet_queue_bulk_sync(self, model_name, title, what):
+        """
+        Queue a bulk sync of all records of a model and notify the user.
         
-        # Check if API key is configured
-        api_key = self.env['ir.config_parameter'].sudo().get_param('loopjet.api_key')
-        if not api_key:
-            raise ValueError('Please configure your Loopjet API key before syncing contacts.')
+        The records are selected in the background by a low-priority job that
+        pages through them by ID, so the request returns immediately and the
+        bulk sync yields to interactive syncs.
+        """
+        Model = self.env[model_name]
+        domain = Model._loopjet_sync_domain()
+        record_count = Model.search_count(domain)
         
-        # Get all partners/contacts (customers and vendors)
-        contacts = self.env['res.partner'].search([
-            '|',
-            ('customer_rank', '>', 0),  # Customers
-            ('supplier_rank', '>', 0),  # Suppliers
-        ])
-        
-        if not contacts:
-            return {
-                'type': 'ir.actions.client',
-                'tag': 'display_notification',
-                'params': {
-                    'title': 'No Contacts Found',
-                    'message': 'No contacts available to sync.',
-                    'type': 'warning',
-                    'sticky': False,
-                }
-            }
+        if not record_count:
+            return self._loopjet_no_records_notification(f'No {what.title()} Found', f'No {what} available to sync.')
         
-        # Prepare contacts for batch sync
-        import requests
-        
-        api_url = 'https://loopjet-api.fly.dev'
-        headers = {
-            'Authorization': f'Bearer {api_key}',
-            'Content-Type': 'application/json',
-        }
-        
-        contact_list = []
-        for contact in contacts:
-            contact_data = {
-                'name': contact.name,
-                'email': contact.email or None,
-                'phone': contact.phone or None,
-                'address_line1': contact.street or None,
-                'address_line2': contact.street2 or None,
-                'city': contact.city or None,
-                'state': contact.state_id.name if contact.state_id else None,
-                'postal_code': contact.zip or None,
-                'country': contact.country_id.name if contact.country_id else None,
-                'company': contact.commercial_company_name or contact.name if contact.is_company else None,
-                'tax_id': contact.vat or None,
-                'website': contact.website or None,
-                'notes': contact.comment or None,
-                'type': 'customer' if contact.customer_rank > 0 else 'vendor',
-            }
-            
-            # Remove None values
-            contact_data = {k: v for k, v in contact_data.items() if v is not None}
-            contact_list.append(contact_data)
-        
-        # Use batch import endpoint with upsert
-        try:
-            url = f"{api_url}/api/v1/batch/contacts/batch"
-            response = requests.post(url, json={'contacts': contact_list, 'upsert': True}, headers=headers, timeout=60)
-            
-            if response.status_code in [200, 201]:
-                result = response.json()
-                success_count = result.get('created', 0) + result.get('updated', 0)
-                error_count = result.get('failed', 0)
-            else:
-                success_count = 0
-                error_count = len(contact_list)
-                _logger.error(f"Batch contact sync failed: {response.text}")
-        except Exception as e:
-            success_count = 0
-            error_count = len(contact_list)
-            _logger.error(f"Error in batch contact sync: {str(e)}")
-        
-        # Show notification with results
-        if error_count == 0:
-            message = f'Successfully synced {success_count} contacts to Loopjet!'
-            notification_type = 'success'
-        else:
-            message = f'Synced {success_count} contacts. {error_count} failed. Check logs for details.'
-            notification_type = 'warning'
+        Model._loopjet_enqueue_domain_sync(domain, 'bulk', name=f'Sync all {what}')
         
         return {
             'type': 'ir.actions.client',
             'tag': 'display_notification',
             'params': {
-                'title': 'Contact Sync Complete',
-                'message': message,
-                'type': notification_type,
+                'title': title,
+                'message': f'Syncing {record_count} {what} to Loopjet in the background.',
+                'type': 'success',
                 'sticky': False,
             }
         }
     
+    def action_sync_all_products(self):
+        """Batch sync all products to Loopjet."""
+        self.ensure_one()
+        self._loopjet_check_api_key('products')
+        # Batch import endpoint with upsert prevents duplicates; batches are split per company
+        return self._loopjet_queue_bulk_sync('product.template', 'Product Sync Started', 'products')
+    
+    def action_sync_all_contacts(self):
+        """Batch sync all contacts (customers and vendors) to Loopjet."""
+        self.ensure_one()
+        self._loopjet_check_api_key('contacts')
+        return self._loopjet_queue_bulk_sync('res.partner', 'Contact Sync Started', 'contacts')
+    
     def action_sync_all_invoices(self):
-        """Batch sync all invoices to Loopjet."""
+        """Batch sync all customer invoices to Loopjet."""
         self.ensure_one()
+        self._loopjet_check_api_key('invoices')
+        return self._loopjet_queue_bulk_sync('account.move', 'Invoice Sync Started', 'invoices')
+    
+    def action_sync_all_estimates(self):
+        """Batch sync all estimates/quotations to Loopjet."""
+        self.ensure_one()
+        self._loopjet_check_api_key('estimates')
+        return self._loopjet_queue_bulk_sync('sale.order', 'Quotation Sync Started', 'quotations')
+    
+    def action_sync_changes(self):
+        """Queue a sync of the records changed since their last successful sync."""
+        self.ensure_one()
+        self._loopjet_check_api_key('records')
         
-        # Check if API key is configured
-        api_key = self.env['ir.config_parameter'].sudo().get_param('loopjet.api_key')
-        if not api_key:
-            raise ValueError('Please configure your Loopjet API key before syncing invoices.')
-        
-        # Get all invoices (account.move with type invoice)
-        invoices = self.env['account.move'].search([
-            ('move_type', 'in', ['out_invoice', 'out_refund']),
-            ('state', '!=', 'cancel'),
-        ], limit=100)  # Limit to 100 for performance
-        
-        if not invoices:
-            return {
-                'type': 'ir.actions.client',
-                'tag': 'display_notification',
-                'params': {
-                    'title': 'No Invoices Found',
-                    'message': 'No invoices available to sync.',
-                    'type': 'warning',
-                    'sticky': False,
-                }
-            }
-        
-        # Sync via batch API
-        import requests
-        
-        api_url = 'https://loopjet-api.fly.dev'
-        headers = {
-            'Authorization': f'Bearer {api_key}',
-            'Content-Type': 'application/json',
-        }
-        
-        # Prepare batch data
-        invoice_list = []
-        for invoice in invoices:
-            invoice_data = {
-                'invoice_number': invoice.name,
-                'customer_id': None,  # Will be matched by name
-                'customer_info': {
-                    'name': invoice.partner_id.name,
-                    'email': invoice.partner_id.email,
-                    'phone': invoice.partner_id.phone,
-                },
-                'issue_date': invoice.invoice_date.isoformat() if invoice.invoice_date else None,
-                'due_date': invoice.invoice_date_due.isoformat() if invoice.invoice_date_due else None,
-                'status': 'sent' if invoice.state == 'posted' else 'draft',
-                'items': [],
-                'subtotal': float(invoice.amount_untaxed),
-                'total_tax': float(invoice.amount_tax),
-                'total': float(invoice.amount_total),
-                'external_id': str(invoice.id),
-                'external_system': 'odoo',
-            }
-            
-            # Add line items
-            for line in invoice.invoice_line_ids:
-                if line.product_id:
-                    invoice_data['items'].append({
-                        'name': line.product_id.name,
-                        'description': line.name,
-                        'quantity': line.quantity,
-                        'unit_price': float(line.price_unit),
-                        'unit': line.product_uom_id.name if line.product_uom_id else 'unit',
-                    })
-            
-            invoice_list.append(invoice_data)
+        backlog_count = 0
+        for model_name in LOOPJET_SYNCED_MODELS:
+            Model = self.env[model_name]
+            model_count = Model._loopjet_backlog_count()
+            if model_count:
+                Model._loopjet_enqueue_domain_sync(Model._loopjet_dirty_domain(), 'bulk',
+                                                   name=f'Sync changed {Model._description} records')
+                backlog_count += model_count
         
-        # Use batch import endpoint
-        try:
-            url = f"{api_url}/api/v1/batch/invoices/batch"
-            response = requests.post(url, json={'invoices': invoice_list}, headers=headers, timeout=60)
-            
-            if response.status_code in [200, 201]:
-                result = response.json()
-                success_count = result.get('created', 0) + result.get('updated', 0)
-                message = f'Successfully synced {success_count} invoices to Loopjet!'
-                notification_type = 'success'
-            else:
-                message = f'Failed to sync invoices. Error: {response.text[:200]}'
-                notification_type = 'warning'
-                
-        except Exception as e:
-            message = f'Error syncing invoices: {str(e)}'
-            notification_type = 'danger'
-            _logger.error(message)
+        if not backlog_count:
+            return self._loopjet_no_records_notification('Nothing to Sync', 'All records are up to date in Loopjet.')
         
         return {
             'type': 'ir.actions.client',
             'tag': 'display_notification',
             'params': {
-                'title': 'Invoice Sync Complete',
-                'message': message,
-                'type': notification_type,
+                'title': 'Sync Started',
+                'message': f'Syncing {backlog_count} changed records to Loopjet in the background.',
+                'type': 'success',
                 'sticky': False,
             }
         }
     
-    def action_sync_all_estimates(self):
-        """Batch sync all estimates/quotations to Loopjet."""
-        self.ensure_one()
-        
-        # Check if API key is configured
-        api_key = self.env['ir.config_parameter'].sudo().get_param('loopjet.api_key')
-        if not api_key:
-            raise ValueError('Please configure your Loopjet API key before syncing estimates.')
+    def action_loopjet_reconcile(self):
+        """
+        Check Odoo and Loopjet for drift and re-sync only the records that differ.
         
-        # Get all quotations (sale orders in quotation state)
-        estimates = self.env['sale.order'].search([
-            ('state', 'in', ['draft', 'sent']),
-        ], limit=100)  # Limit to 100 for performance
-        
-        if not estimates:
-            return {
-                'type': 'ir.actions.client',
-                'tag': 'display_notification',
-                'params': {
-                    'title': 'No Estimates Found',
-                    'message': 'No quotations available to sync.',
-                    'type': 'warning',
-                    'sticky': False,
-                }
-            }
-        
-        # Sync via batch API
-        import requests
-        from datetime import date
-        
-        api_url = 'https://loopjet-api.fly.dev'
-        headers = {
-            'Authorization': f'Bearer {api_key}',
-            'Content-Type': 'application/json',
-        }
-        
-        # Prepare batch data
-        estimate_list = []
-        for estimate in estimates:
-            estimate_data = {
-                'estimate_number': estimate.name,
-                'customer_id': None,  # Will be matched by name
-                'customer_info': {
-                    'name': estimate.partner_id.name,
-                    'email': estimate.partner_id.email,
-                    'phone': estimate.partner_id.phone,
-                },
-                'issue_date': estimate.date_order.date().isoformat() if estimate.date_order else date.today().isoformat(),
-                'valid_until': estimate.validity_date.isoformat() if estimate.validity_date else None,
-                'status': 'sent' if estimate.state == 'sent' else 'draft',
-                'items': [],
-                'subtotal': float(estimate.amount_untaxed),
-                'total_tax': float(estimate.amount_tax),
-                'total': float(estimate.amount_total),
-                'external_id': str(estimate.id),
-                'external_system': 'odoo',
-            }
-            
-            # Add line items
-            for line in estimate.order_line:
-                if line.product_id:
-                    # Get UOM (unit of measure) - field name varies by Odoo version
-                    uom_name = 'unit'
-                    if hasattr(line, 'product_uom') and line.product_uom:
-                        uom_name = line.product_uom.name
-                    elif hasattr(line, 'product_uom_id') and line.product_uom_id:
-                        uom_name = line.product_uom_id.name
-                    
-                    estimate_data['items'].append({
-                        'name': line.product_id.name,
-                        'description': line.name,
-                        'quantity': line.product_uom_qty if hasattr(line, 'product_uom_qty') else line.quantity,
-                        'unit_price': float(line.price_unit),
-                        'unit': uom_name,
-                    })
-            
-            estimate_list.append(estimate_data)
+        The check hashes every synced record, so it is handed to the reconcile
+        cron instead of running in the request.
+        """
+        self.ensure_one()
+        self._loopjet_check_api_key('records')
         
-        # Use batch import endpoint
-        try:
-            url = f"{api_url}/api/v1/batch/estimates/batch"
-            response = requests.post(url, json={'estimates': estimate_list}, headers=headers, timeout=60)
-            
-            if response.status_code in [200, 201]:
-                result = response.json()
-                success_count = result.get('created', 0) + result.get('updated', 0)
-                message = f'Successfully synced {success_count} quotations to Loopjet!'
-                notification_type = 'success'
-            else:
-                message = f'Failed to sync quotations. Error: {response.text[:200]}'
-                notification_type = 'warning'
-                
-        except Exception as e:
-            message = f'Error syncing quotations: {str(e)}'
-            notification_type = 'danger'
-            _logger.error(message)
+        self.env['loopjet.sync.job']._trigger_reconcile()
         
         return {
             'type': 'ir.actions.client',
             'tag': 'display_notification',
             'params': {
-                'title': 'Quotation Sync Complete',
-                'message': message,
-                'type': notification_type,
+                'title': 'Consistency Check Started',
+                'message': 'Odoo and Loopjet are being compared in the background. Records that differ will be re-synced.',
+                'type': 'success',
                 'sticky': False,
             }
         }
-
@@ -1,14 +1,30 @@
 # -*- coding: utf-8 -*-
 
 from odoo import models, fields, api
-import requests
 import logging
 
 _logger = logging.getLogger(__name__)
 
 
 class ResPartner(models.Model):
-    _inherit = 'res.partner'
+    _name = 'res.partner'
+    _inherit = ['res.partner', 'loopjet.sync.mixin']
+
+    _loopjet_auto_sync_param = 'loopjet.auto_sync_contacts'
+    _loopjet_batch_endpoint = 'contacts'
+    _loopjet_batch_upsert = True
+    _loopjet_id_field = 'loopjet_contact_id'
+    _loopjet_payload_fields = {
+        'name', 'email', 'phone', 'street', 'street2', 'city', 'state_id', 'zip', 'country_id',
+        'is_company', 'parent_id', 'company_name', 'vat', 'website', 'comment',
+    }
+
+    # Ranks are bumped on every confirmed order or posted invoice, but only
+    # matter to Loopjet when they cross zero (contact type and eligibility)
+    _loopjet_rank_fields = {'customer_rank', 'supplier_rank'}
+
+    # Contact fields shown in the deal digest of the customer's opportunities
+    _loopjet_deal_digest_fields = {'name', 'email', 'phone'}
 
     loopjet_contact_id = fields.Char(
         string='Loopjet Contact ID',
@@ -29,94 +45,135 @@ class ResPartner(models.Model):
         help='Last time this contact was synced to Loopjet'
     )
 
+    def _loopjet_sync_domain(self):
+        """Only customers and suppliers are synced, not internal/employee contacts."""
+        return ['|', ('customer_rank', '>', 0), ('supplier_rank', '>', 0)]
+
+    def _loopjet_rank_state(self):
+        """Whether the contact is a customer and whether it is a supplier."""
+        self.ensure_one()
+        return (self.customer_rank > 0, self.supplier_rank > 0)
+
+    def _loopjet_flag_rank_changes(self, rank_states):
+        """Flag synced contacts that became, or stopped being, a customer or a supplier."""
+        changed = self.filtered(lambda c: c._loopjet_rank_state() != rank_states[c.id])
+        changed = changed.filtered_domain(self._loopjet_sync_domain())
+        if changed:
+            changed.write({'loopjet_needs_sync': True})
+
+    def _increase_rank(self, field, n=1):
+        """Catch ranks crossing zero, the accounting rank update bypasses write()."""
+        rank_states = {contact.id: contact._loopjet_rank_state() for contact in self}
+        super(ResPartner, self)._increase_rank(field, n)
+        self._loopjet_flag_rank_changes(rank_states)
+
+    def _prepare_loopjet_data(self):
+        """Prepare contact data for the Loopjet API."""
+        self.ensure_one()
+        contact_data = {
+            'name': self.name,
+            'email': self.email or None,
+            'phone': self.phone or None,
+            'address_line1': self.street or None,
+            'address_line2': self.street2 or None,
+            'city': self.city or None,
+            'state': self.state_id.name if self.state_id else None,
+            'postal_code': self.zip or None,
+            'country': self.country_id.name if self.country_id else None,
+            'company': self.commercial_company_name or self.name if self.is_company else None,
+            'tax_id': self.vat or None,
+            'website': self.website or None,
+            'notes': self.comment or None,
+            'type': 'customer' if self.customer_rank > 0 else 'vendor',
+        }
+        
+        # Remove None values
+        return {k: v for k, v in contact_data.items() if v is not None}
+
     def sync_to_loopjet(self):
-        """Sync this contact to Loopjet."""
-        for contact in self:
-            try:
-                # Get API configuration
-                api_key = self.env['ir.config_parameter'].sudo().get_param('loopjet.api_key')
-                if not api_key:
-                    _logger.warning('Loopjet API key not configured, skipping contact sync')
-                    return
+        """Sync these contacts to Loopjet, logging one summary line for the run."""
+        with self._loopjet_sync_log() as log:
+            for contact in self:
+                try:
+                    # Get API configuration for the contact's company
+                    company = contact._loopjet_get_company()
+                    if not company._loopjet_get_api_key():
+                        log.skip('no_api_key')
+                        continue
                 
-                api_url = 'https://loopjet-api.fly.dev'
-                headers = {
-                    'Authorization': f'Bearer {api_key}',
-                    'Content-Type': 'application/json',
-                }
+                    api_url = company._loopjet_get_api_url()
+                    headers = company._loopjet_get_api_headers()
+                    session = company._loopjet_get_session()
                 
-                # Prepare contact data
-                contact_data = {
-                    'name': contact.name,
-                    'email': contact.email or None,
-                    'phone': contact.phone or None,
-                    'address_line1': contact.street or None,
-                    'address_line2': contact.street2 or None,
-                    'city': contact.city or None,
-                    'state': contact.state_id.name if contact.state_id else None,
-                    'postal_code': contact.zip or None,
-                    'country': contact.country_id.name if contact.country_id else None,
-                    'company': contact.commercial_company_name or contact.name if contact.is_company else None,
-                    'tax_id': contact.vat or None,
-                    'website': contact.website or None,
-                    'notes': contact.comment or None,
-                    'type': 'customer' if contact.customer_rank > 0 else 'vendor',
-                }
+                    # Prepare contact data
+                    contact_data = contact._prepare_loopjet_data()
+                    log.payload(contact.id, contact_data)
                 
-                # Remove None values
-                contact_data = {k: v for k, v in contact_data.items() if v is not None}
+                    # If already synced, update; otherwise create
+                    if contact.loopjet_contact_id:
+                        # Update existing contact
+                        url = f"{api_url}/api/v1/contacts/{contact.loopjet_contact_id}"
+                        response = contact._loopjet_send_update(company, url, contact_data)
+                    else:
+                        # Create new contact
+                        url = f"{api_url}/api/v1/contacts/"
+                        response = session.post(url, json=contact_data, headers=headers, timeout=30)
                 
-                # If already synced, update; otherwise create
-                if contact.loopjet_contact_id:
-                    # Update existing contact
-                    url = f"{api_url}/api/v1/contacts/{contact.loopjet_contact_id}"
-                    response = requests.put(url, json=contact_data, headers=headers, timeout=30)
-                else:
-                    # Create new contact
-                    url = f"{api_url}/api/v1/contacts/"
-                    response = requests.post(url, json=contact_data, headers=headers, timeout=30)
-                
-                if response.status_code in [200, 201]:
-                    result = response.json()
-                    contact.write({
-                        'loopjet_contact_id': result.get('id'),
-                        'loopjet_synced': True,
-                        'loopjet_last_sync': fields.Datetime.now(),
-                    })
-                    _logger.info(f"Successfully synced contact {contact.name} to Loopjet")
-                else:
-                    _logger.error(f"Failed to sync contact {contact.name}: {response.text}")
+                    if response.status_code in [200, 201]:
+                        result = response.json()
+                        contact.write({
+                            'loopjet_contact_id': result.get('id') or contact.loopjet_contact_id,
+                            'loopjet_synced': True,
+                            **contact._loopjet_sync_state_vals(contact_data),
+                        })
+                        contact._loopjet_clear_failure()
+                        log.ok()
+                    else:
+                        log.fail(contact.id, f'HTTP{response.status_code}', response.text)
+                        contact._loopjet_record_failure('HTTPError', response.text, response.status_code)
                     
-            except Exception as e:
-                _logger.error(f"Error syncing contact {contact.name} to Loopjet: {str(e)}")
+                except Exception as e:
+                    log.fail(contact.id, type(e).__name__, str(e))
+                    contact._loopjet_record_failure(type(e).__name__, str(e))
 
-    @api.model
-    def create(self, vals):
-        """Auto-sync to Loopjet if enabled."""
-        contact = super(ResPartner, self).create(vals)
+    @api.model_create_multi
+    def create(self, vals_list):
+        """Schedule a post-commit sync to Loopjet if auto-sync is enabled."""
+        contacts = super(ResPartner, self).create(vals_list)
+        contacts._loopjet_flag_new()
         
-        # Only sync if it's a customer or supplier (not internal/employee contacts)
-        if contact.customer_rank > 0 or contact.supplier_rank > 0:
-            auto_sync = self.env['ir.config_parameter'].sudo().get_param('loopjet.auto_sync_contacts', False)
-            if auto_sync:
-                contact.sync_to_loopjet()
+        if contacts._loopjet_auto_sync_enabled():
+            # Only sync customers and suppliers (not internal/employee contacts)
+            business_contacts = contacts.filtered(lambda c: c.customer_rank > 0 or c.supplier_rank > 0)
+            if business_contacts:
+                business_contacts._loopjet_schedule_sync()
         
-        return contact
+        return contacts
     
     def write(self, vals):
-        """Auto-sync to Loopjet if enabled and contact is already synced."""
+        """Schedule a post-commit sync to Loopjet if auto-sync is enabled and contact is already synced."""
+        rank_states = {}
+        if self._loopjet_rank_fields.intersection(vals):
+            rank_states = {contact.id: contact._loopjet_rank_state() for contact in self}
         result = super(ResPartner, self).write(vals)
+        self._loopjet_flag_dirty(vals)
+        
+        if rank_states:
+            self._loopjet_flag_rank_changes(rank_states)
+        
+        if self._loopjet_deal_digest_fields.intersection(vals):
+            leads = self.env['crm.lead'].sudo().search([('partner_id', 'in', self.ids)])
+            self.env['crm.lead']._loopjet_mark_digest_stale(leads.ids)
         
-        # Don't trigger sync if only Loopjet metadata fields are being updated (prevents infinite loop)
-        loopjet_fields = {'loopjet_contact_id', 'loopjet_synced', 'loopjet_last_sync'}
-        if set(vals.keys()).issubset(loopjet_fields):
+        # Only changes of the fields feeding the payload are worth a sync (this also prevents
+        # the metadata written after a sync from triggering another one)
+        if not self._loopjet_payload_changed(vals):
             return result
         
-        auto_sync = self.env['ir.config_parameter'].sudo().get_param('loopjet.auto_sync_contacts', False)
-        if auto_sync:
+        if self._loopjet_auto_sync_enabled():
             synced_contacts = self.filtered(lambda c: c.loopjet_synced and (c.customer_rank > 0 or c.supplier_rank > 0))
             if synced_contacts:
-                synced_contacts.sync_to_loopjet()
+                synced_contacts._loopjet_schedule_sync()
         
         return result
 
@@ -1,38 +1,57 @@
 # -*- coding: utf-8 -*-
 
-from odoo import models, fields, api
-import requests
+from odoo import models, fields, api, SUPERUSER_ID
+from .loopjet_vector_index import get_index, word_features
 import logging
+import threading
 from datetime import date
 
 _logger = logging.getLogger(__name__)
 
 
 class SaleOrder(models.Model):
-    _inherit = 'sale.order'
+    _name = 'sale.order'
+    _inherit = ['sale.order', 'loopjet.sync.mixin']
+
+    _loopjet_auto_sync_param = 'loopjet.auto_sync_estimates'
+    _loopjet_batch_endpoint = 'estimates'
+    _loopjet_id_field = 'loopjet_estimate_id'
+    _loopjet_payload_fields = {'name', 'partner_id', 'date_order', 'validity_date', 'state', 'order_line'}
 
     loopjet_generated = fields.Boolean(
         string='Generated by Loopjet',
         default=False,
         readonly=True,
+        copy=False,
         help='This quote/estimate was generated using Loopjet AI'
     )
     
     loopjet_estimate_data = fields.Text(
         string='Loopjet Estimate Data',
+        compute='_compute_loopjet_estimate_data',
+        inverse='_inverse_loopjet_estimate_data',
         readonly=True,
-        help='Raw JSON data from Loopjet API response'
+        help='Raw JSON data from Loopjet API response, stored compressed apart from the quotation'
     )
     
     loopjet_reasoning = fields.Text(
         string='AI Reasoning',
         readonly=True,
+        copy=False,
         help='AI explanation of how this estimate was generated'
     )
     
+    loopjet_deal_context = fields.Text(
+        string='Loopjet Deal Context',
+        readonly=True,
+        copy=False,
+        help='Deal information the AI estimate was generated from, used to find similar past estimates'
+    )
+    
     loopjet_estimate_id = fields.Char(
         string='Loopjet Estimate ID',
         readonly=True,
+        copy=False,
         help='UUID of this estimate in Loopjet system'
     )
     
@@ -40,121 +59,260 @@ class SaleOrder(models.Model):
         string='Synced to Loopjet',
         default=False,
         readonly=True,
+        copy=False,
         help='Whether this quotation has been synchronized to Loopjet'
     )
     
     loopjet_last_sync = fields.Datetime(
         string='Last Loopjet Sync',
         readonly=True,
+        copy=False,
         help='Last time this quotation was synced to Loopjet'
     )
 
-    def sync_to_loopjet(self):
-        """Sync this quotation/estimate to Loopjet."""
+    def _compute_loopjet_estimate_data(self):
+        data = self.env['loopjet.estimate.payload']._load(self.filtered('loopjet_generated'))
         for order in self:
-            # Only sync quotations, not confirmed sales orders
-            if order.state not in ['draft', 'sent']:
-                continue
-                
+            order.loopjet_estimate_data = data.get(order.id, False)
+
+    def _inverse_loopjet_estimate_data(self):
+        Payload = self.env['loopjet.estimate.payload']
+        for order in self:
+            Payload._store(order, order.loopjet_estimate_data)
+
+    def _loopjet_sync_domain(self):
+        """Only quotations are synced, not confirmed sales orders."""
+        return [('state', 'in', ['draft', 'sent'])]
+
+    def _loopjet_similarity_text(self):
+        """Text describing an AI estimate for similarity search: its deal context and its lines."""
+        self.ensure_one()
+        context = self.loopjet_deal_context
+        if not context and 'opportunity_id' in self._fields:
+            context = self.opportunity_id.loopjet_deal_digest
+        return '\n'.join(filter(None, [context] + self.order_line.mapped('name')))
+
+    @api.model
+    def _loopjet_get_estimate_index(self, wait=True):
+        """
+        Get this worker's similarity index over past AI estimates, refreshed as needed.
+
+        New estimates are added incrementally; the whole index is rebuilt every
+        ``loopjet.similarity_index_ttl`` seconds (one hour by default) to pick
+        up edited estimates and refresh the IDF weights. The index is shared by
+        all users of the worker, so it is built as superuser over all estimates;
+        search results are filtered with the access rights of the caller.
+
+        Args:
+            wait: when False, never wait for a build: if the index is being built
+                or needs one, the build is started on a background thread and
+                None is returned
+
+        Returns:
+            HashingIndex: the index, or None when it is not ready and wait is False
+        """
+        index = get_index(self.env.cr.dbname, 'loopjet.estimates', word_features)
+        ttl = int(self.env['ir.config_parameter'].sudo().get_param('loopjet.similarity_index_ttl', 3600))
+        domain = [('loopjet_generated', '=', True), ('state', '!=', 'cancel')]
+
+        if not index.lock.acquire(blocking=wait):
+            return None
+        try:
+            rebuild = index.needs_build(ttl)
+            if rebuild and not wait:
+                self._loopjet_build_estimate_index_in_background()
+                return None
+            if not rebuild:
+                domain.append(('id', '>', index.watermark or 0))
+
+            items = []
+            for orders in self.sudo()._loopjet_iter_chunks(domain):
+                items += [(order.id, order._loopjet_similarity_text()) for order in orders]
+
+            if rebuild:
+                index.build(items)
+                _logger.info(f"Built the Loopjet similar estimate index with {len(items)} estimates")
+            else:
+                index.update(items)
+            if items:
+                index.watermark = max(index.watermark or 0, items[-1][0])
+        finally:
+            index.lock.release()
+        return index
+
+    @api.model
+    def _loopjet_build_estimate_index_in_background(self):
+        """Build the similar estimate index of this worker on a thread of its own, with its own cursor."""
+        registry = self.env.registry
+
+        def build():
             try:
-                # Get API configuration
-                api_key = self.env['ir.config_parameter'].sudo().get_param('loopjet.api_key')
-                if not api_key:
-                    _logger.warning('Loopjet API key not configured, skipping estimate sync')
-                    return
+                with registry.cursor() as cr:
+                    api.Environment(cr, SUPERUSER_ID, {})['sale.order']._loopjet_get_estimate_index()
+            except Exception as e:
+                _logger.warning(f"Could not build the Loopjet similar estimate index: {str(e)}")
+
+        threading.Thread(target=build, name='loopjet-estimate-index', daemon=True).start()
+
+    @api.model
+    def _loopjet_find_similar_estimates(self, text, company, limit=3, wait=True):
+        """
+        Find past AI estimates of a company generated from a deal similar to this text.
+
+        Args:
+            wait: when False, find nothing rather than wait for the index to be built
+
+        Returns:
+            list: (sale.order, similarity between 0 and 1) pairs, best first
+        """
+        index = self._loopjet_get_estimate_index(wait=wait)
+        if index is None:
+            return []
+        min_score = float(self.env['ir.config_parameter'].sudo().get_param('loopjet.similar_estimate_threshold', 0.5))
+        matches = index.search([text], limit=limit * 3, min_score=min_score)[0]
+        scores = dict(matches)
+        # Searched rather than browsed, so record rules hide estimates the user cannot read
+        orders = self.search([('id', 'in', list(scores)), ('company_id', '=', company.id), ('state', '!=', 'cancel')])
+        similar = sorted(((order, scores[order.id]) for order in orders), key=lambda pair: pair[1], reverse=True)
+        return similar[:limit]
+
+    def _prepare_loopjet_data(self):
+        """Prepare estimate data for the Loopjet API."""
+        self.ensure_one()
+        estimate_data = {
+            'estimate_number': self.name,
+            'customer_info': {
+                'name': self.partner_id.name,
+                'email': self.partner_id.email,
+                'phone': self.partner_id.phone,
+            },
+            'issue_date': self.date_order.date().isoformat() if self.date_order else date.today().isoformat(),
+            'valid_until': self.validity_date.isoformat() if self.validity_date else None,
+            'status': 'sent' if self.state == 'sent' else 'draft',
+            'items': [],
+            'subtotal': float(self.amount_untaxed),
+            'total_tax': float(self.amount_tax),
+            'total': float(self.amount_total),
+            'external_id': str(self.id),
+            'external_system': 'odoo',
+        }
+        
+        # Add line items
+        for line in self.order_line:
+            if line.product_id:
+                # Get UOM (unit of measure) - field name varies by Odoo version
+                uom_name = 'unit'
+                if hasattr(line, 'product_uom') and line.product_uom:
+                    uom_name = line.product_uom.name
+                elif hasattr(line, 'product_uom_id') and line.product_uom_id:
+                    uom_name = line.product_uom_id.name
                 
-                api_url = 'https://loopjet-api.fly.dev'
-                headers = {
-                    'Authorization': f'Bearer {api_key}',
-                    'Content-Type': 'application/json',
-                }
+                estimate_data['items'].append({
+                    'external_id': str(line.id),
+                    'name': line.product_id.name,
+                    'description': line.name,
+                    'quantity': line.product_uom_qty if hasattr(line, 'product_uom_qty') else line.quantity,
+                    'unit_price': float(line.price_unit),
+                    'unit': uom_name,
+                })
+        
+        return estimate_data
+
+    def _prepare_loopjet_batch_data(self):
+        """Prepare estimate data for the batch endpoint."""
+        estimate_data = self._prepare_loopjet_data()
+        estimate_data['customer_id'] = None  # Will be matched by name
+        return estimate_data
+
+    def _loopjet_lines_changed(self):
+        """
+        Flag quotations whose lines were created, updated or removed, and schedule their sync.
+
+        The sync is scheduled even when the quotation is already flagged; the
+        post-commit hook sends each quotation once per transaction.
+        """
+        quotations = self.filtered(lambda o: o.state in ['draft', 'sent'])
+        unflagged = quotations.filtered(lambda o: not o.loopjet_needs_sync)
+        if unflagged:
+            unflagged.write({'loopjet_needs_sync': True})
+        if quotations._loopjet_auto_sync_enabled():
+            quotations.filtered('loopjet_synced')._loopjet_schedule_sync()
+
+    def sync_to_loopjet(self):
+        """Sync these quotations/estimates to Loopjet, logging one summary line for the run."""
+        with self._loopjet_sync_log() as log:
+            for order in self:
+                # Only sync quotations, not confirmed sales orders
+                if order.state not in ['draft', 'sent']:
+                    continue
                 
-                # Prepare estimate data
-                estimate_data = {
-                    'estimate_number': order.name,
-                    'customer_info': {
-                        'name': order.partner_id.name,
-                        'email': order.partner_id.email,
-                        'phone': order.partner_id.phone,
-                    },
-                    'issue_date': order.date_order.date().isoformat() if order.date_order else date.today().isoformat(),
-                    'valid_until': order.validity_date.isoformat() if order.validity_date else None,
-                    'status': 'sent' if order.state == 'sent' else 'draft',
-                    'items': [],
-                    'subtotal': float(order.amount_untaxed),
-                    'total_tax': float(order.amount_tax),
-                    'total': float(order.amount_total),
-                    'external_id': str(order.id),
-                    'external_system': 'odoo',
-                }
+                try:
+                    # Get API configuration for the order's company
+                    company = order._loopjet_get_company()
+                    if not company._loopjet_get_api_key():
+                        log.skip('no_api_key')
+                        continue
                 
-                # Add line items
-                for line in order.order_line:
-                    if line.product_id:
-                        # Get UOM (unit of measure) - field name varies by Odoo version
-                        uom_name = 'unit'
-                        if hasattr(line, 'product_uom') and line.product_uom:
-                            uom_name = line.product_uom.name
-                        elif hasattr(line, 'product_uom_id') and line.product_uom_id:
-                            uom_name = line.product_uom_id.name
-                        
-                        estimate_data['items'].append({
-                            'name': line.product_id.name,
-                            'description': line.name,
-                            'quantity': line.product_uom_qty if hasattr(line, 'product_uom_qty') else line.quantity,
-                            'unit_price': float(line.price_unit),
-                            'unit': uom_name,
-                        })
+                    api_url = company._loopjet_get_api_url()
+                    headers = company._loopjet_get_api_headers()
+                    session = company._loopjet_get_session()
                 
-                # If already synced, update; otherwise create
-                if order.loopjet_estimate_id:
-                    url = f"{api_url}/api/v1/estimates/{order.loopjet_estimate_id}"
-                    response = requests.put(url, json=estimate_data, headers=headers, timeout=30)
-                else:
-                    url = f"{api_url}/api/v1/estimates/"
-                    response = requests.post(url, json=estimate_data, headers=headers, timeout=30)
+                    # Prepare estimate data
+                    estimate_data = order._prepare_loopjet_data()
+                    log.payload(order.id, estimate_data)
                 
-                if response.status_code in [200, 201]:
-                    result = response.json()
-                    order.write({
-                        'loopjet_estimate_id': result.get('id'),
-                        'loopjet_synced': True,
-                        'loopjet_last_sync': fields.Datetime.now(),
-                    })
-                    _logger.info(f"Successfully synced quotation {order.name} to Loopjet")
-                else:
-                    _logger.error(f"Failed to sync quotation {order.name}: {response.text}")
+                    # If already synced, update; otherwise create
+                    if order.loopjet_estimate_id:
+                        url = f"{api_url}/api/v1/estimates/{order.loopjet_estimate_id}"
+                        response = order._loopjet_send_update(company, url, estimate_data)
+                    else:
+                        url = f"{api_url}/api/v1/estimates/"
+                        response = session.post(url, json=estimate_data, headers=headers, timeout=30)
+                
+                    if response.status_code in [200, 201]:
+                        result = response.json()
+                        order.write({
+                            'loopjet_estimate_id': result.get('id') or order.loopjet_estimate_id,
+                            'loopjet_synced': True,
+                            **order._loopjet_sync_state_vals(estimate_data),
+                        })
+                        order._loopjet_clear_failure()
+                        log.ok()
+                    else:
+                        log.fail(order.id, f'HTTP{response.status_code}', response.text)
+                        order._loopjet_record_failure('HTTPError', response.text, response.status_code)
                     
-            except Exception as e:
-                _logger.error(f"Error syncing quotation {order.name} to Loopjet: {str(e)}")
+                except Exception as e:
+                    log.fail(order.id, type(e).__name__, str(e))
+                    order._loopjet_record_failure(type(e).__name__, str(e))
 
-    @api.model
+    @api.model_create_multi
     def create(self, vals_list):
-        """Auto-sync to Loopjet if enabled."""
+        """Schedule a post-commit sync to Loopjet if auto-sync is enabled."""
         orders = super(SaleOrder, self).create(vals_list)
+        orders._loopjet_flag_new()
         
-        auto_sync = self.env['ir.config_parameter'].sudo().get_param('loopjet.auto_sync_estimates', False)
-        if auto_sync:
+        if orders._loopjet_auto_sync_enabled():
             quotations = orders.filtered(lambda o: o.state in ['draft', 'sent'])
             if quotations:
-                quotations.sync_to_loopjet()
+                quotations._loopjet_schedule_sync()
         
         return orders
     
     def write(self, vals):
-        """Auto-sync to Loopjet if enabled and quotation is already synced."""
+        """Schedule a post-commit sync to Loopjet if auto-sync is enabled and quotation is already synced."""
         result = super(SaleOrder, self).write(vals)
+        self._loopjet_flag_dirty(vals)
         
-        # Don't trigger sync if only Loopjet metadata fields are being updated
-        loopjet_fields = {'loopjet_estimate_id', 'loopjet_synced', 'loopjet_last_sync', 'loopjet_generated', 'loopjet_estimate_data', 'loopjet_reasoning'}
-        if set(vals.keys()).issubset(loopjet_fields):
+        # Only changes of the fields feeding the payload are worth a sync (this also prevents
+        # the metadata written after a sync from triggering another one)
+        if not self._loopjet_payload_changed(vals):
             return result
         
-        auto_sync = self.env['ir.config_parameter'].sudo().get_param('loopjet.auto_sync_estimates', False)
-        if auto_sync:
+        if self._loopjet_auto_sync_enabled():
             synced_orders = self.filtered(lambda o: o.loopjet_synced and o.state in ['draft', 'sent'])
             if synced_orders:
-                synced_orders.sync_to_loopjet()
+                synced_orders._loopjet_schedule_sync()
         
         return result
 
@@ -162,9 +320,36 @@ class SaleOrder(models.Model):
 class SaleOrderLine(models.Model):
     _inherit = 'sale.order.line'
 
+    # Line fields whose values end up in the estimate payload (items and totals)
+    _loopjet_payload_fields = {
+        'product_id', 'name', 'product_uom_qty', 'product_uom', 'product_uom_id', 'price_unit', 'discount',
+        'tax_id', 'tax_ids',
+    }
+
     loopjet_item_id = fields.Char(
         string='Loopjet Item ID',
         readonly=True,
+        copy=False,
         help='Reference to the Loopjet estimate item'
     )
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        """Flag the quotations of new lines as changed."""
+        lines = super(SaleOrderLine, self).create(vals_list)
+        lines.order_id._loopjet_lines_changed()
+        return lines
+
+    def write(self, vals):
+        """Flag the quotations as changed when a field of the payload is updated."""
+        result = super(SaleOrderLine, self).write(vals)
+        if self._loopjet_payload_fields.intersection(vals):
+            self.order_id._loopjet_lines_changed()
+        return result
+
+    def unlink(self):
+        """Flag the quotations of removed lines as changed."""
+        orders = self.order_id
+        result = super(SaleOrderLine, self).unlink()
+        orders.exists()._loopjet_lines_changed()
+        return result
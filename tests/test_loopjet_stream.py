@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from odoo.tests import TransactionCase, tagged
+
+
+class LoopjetStubResponse:
+    """Local stand-in for a streamed generate-estimate response of Loopjet."""
+
+    def __init__(self, content_type, lines=(), body=None, status_code=200):
+        self.headers = {'content-type': content_type}
+        self.lines = list(lines)
+        self.body = body
+        self.status_code = status_code
+
+    def json(self):
+        return self.body
+
+    def iter_lines(self, decode_unicode=False):
+        yield from self.lines
+
+    def close(self):
+        pass
+
+
+ITEMS = [
+    {'name': 'Website design', 'quantity': 1, 'unit_price': 1200.0},
+    {'name': 'Hosting', 'quantity': 12, 'unit_price': 20.0},
+]
+ESTIMATE = {'items': ITEMS, 'reasoning': 'Two lines', 'notes': ''}
+
+
+@tagged('post_install', '-at_install')
+class TestLoopjetStreamEvents(TransactionCase):
+
+    def _events(self, response):
+        return list(self.env['loopjet.generate.estimate.wizard']._iter_loopjet_stream_events(response))
+
+    def test_plain_json_is_replayed_as_items(self):
+        """A server without streaming support answers with the complete estimate at once."""
+        events = self._events(LoopjetStubResponse('application/json; charset=utf-8', body=ESTIMATE))
+        self.assertEqual([event['type'] for event in events], ['item', 'item', 'done'])
+        self.assertEqual([event['item'] for event in events[:2]], ITEMS)
+        self.assertEqual(events[-1]['estimate'], ESTIMATE)
+
+    def test_ndjson(self):
+        lines = [json.dumps({'type': 'progress', 'message': 'Reading the deal'}), '']
+        lines += [json.dumps({'type': 'item', 'item': item}) for item in ITEMS]
+        lines.append(json.dumps({'type': 'done', 'estimate': ESTIMATE}))
+        events = self._events(LoopjetStubResponse('application/x-ndjson', lines=lines))
+        self.assertEqual([event['type'] for event in events], ['progress', 'item', 'item', 'done'])
+        self.assertEqual(events[-1]['estimate'], ESTIMATE)
+
+    def test_server_sent_events(self):
+        """Comments, event names, ids and the closing marker are skipped."""
+        lines = [': keep-alive', 'event: item', 'id: 1', f"data: {json.dumps({'type': 'item', 'item': ITEMS[0]})}", '',
+                 f"data: {json.dumps({'type': 'error', 'detail': 'Out of credits'})}", '', 'data: [DONE]']
+        events = self._events(LoopjetStubResponse('text/event-stream', lines=lines))
+        self.assertEqual(events, [
+            {'type': 'item', 'item': ITEMS[0]},
+            {'type': 'error', 'detail': 'Out of credits'},
+        ])
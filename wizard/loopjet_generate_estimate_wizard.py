@@ -5,10 +5,16 @@ from odoo.exceptions import UserError, ValidationError
 import requests
 import json
 import logging
+from contextlib import closing
 from datetime import date
+from ..models.loopjet_generation_timing import LoopjetTimer
+import time
 
 _logger = logging.getLogger(__name__)
 
+# Seconds between two signs of life of a streamed generation to its admission ticket
+_HEARTBEAT_INTERVAL = 30
+
 
 class LoopjetGenerateEstimateWizard(models.TransientModel):
     _name = 'loopjet.generate.estimate.wizard'
@@ -63,6 +69,47 @@ class LoopjetGenerateEstimateWizard(models.TransientModel):
         help='Preview of the AI-generated estimate'
     )
 
+    similar_order_id = fields.Many2one(
+        'sale.order',
+        string='Similar Past Estimate',
+        readonly=True,
+        help='Past AI estimate generated from the most similar deal, which can be reused instantly'
+    )
+    
+    similarity_score = fields.Float(
+        string='Similarity (%)',
+        readonly=True,
+        digits=(3, 0),
+    )
+    
+    context_duration_ms = fields.Float(
+        string='Context Extraction (ms)',
+        readonly=True,
+        help='Time spent extracting the deal information when the wizard was opened'
+    )
+    
+    timing_summary = fields.Text(
+        string='Timings',
+        readonly=True,
+        help='Duration of each stage of the last generation'
+    )
+    
+    credit_balance = fields.Float(
+        string='Available Credits',
+        compute='_compute_credit_balance',
+        help='Loopjet credits currently available (refreshed every minute)'
+    )
+
+    @api.depends('lead_id')
+    def _compute_credit_balance(self):
+        for wizard in self:
+            wizard.credit_balance = wizard._get_company()._loopjet_get_credit_balance() or 0.0
+
+    def _get_company(self):
+        """Company whose Loopjet account is used for this opportunity."""
+        self.ensure_one()
+        return self.lead_id.company_id or self.env.company
+
     @api.model
     def default_get(self, fields_list):
         """Extract deal information when wizard opens."""
@@ -71,7 +118,15 @@ class LoopjetGenerateEstimateWizard(models.TransientModel):
         if 'lead_id' in res and res['lead_id']:
             lead = self.env['crm.lead'].browse(res['lead_id'])
             if lead.exists():
-                res['extracted_info'] = lead.extract_deal_information()
+                start = time.perf_counter()
+                res['extracted_info'] = lead._loopjet_get_deal_digest()
+                res['context_duration_ms'] = (time.perf_counter() - start) * 1000
+                company = lead.company_id or self.env.company
+                # The wizard must open instantly: no suggestion while the index is being built
+                similar = self.env['sale.order']._loopjet_find_similar_estimates(res['extracted_info'], company, limit=1, wait=False)
+                if similar:
+                    res['similar_order_id'] = similar[0][0].id
+                    res['similarity_score'] = round(similar[0][1] * 100)
         
         return res
 
@@ -87,6 +142,70 @@ class LoopjetGenerateEstimateWizard(models.TransientModel):
                 'Please click Cancel, add a customer to the opportunity, and try again.'
             ))
         
+        timer = LoopjetTimer()
+        timer.add('context_extraction', self.context_duration_ms / 1000)
+        
+        # Refuse locally when the cached balance already shows too few credits
+        company = self._get_company()
+        with timer.span('credit_check'):
+            company._loopjet_check_credits()
+        
+        # Start right away if a slot is free, otherwise queue the generation or join the one running for this deal
+        with timer.span('queue_wait'):
+            ticket_id, status, position = self.env['loopjet.generation.request']._admit(self.lead_id, company, {
+                'extracted_info': self.extracted_info,
+                'additional_instructions': self.additional_instructions,
+                'allow_new_items': self.allow_new_items,
+            })
+        if status == 'joined':
+            return {
+                'type': 'ir.actions.client',
+                'tag': 'display_notification',
+                'params': {
+                    'title': 'Quotation Already in Progress',
+                    'message': f'A quotation for {self.lead_id.name} is already being generated. You will be notified when it is ready.',
+                    'type': 'info',
+                    'sticky': False,
+                    'next': {'type': 'ir.actions.act_window_close'},
+                }
+            }
+        if status == 'queued':
+            return {
+                'type': 'ir.actions.client',
+                'tag': 'display_notification',
+                'params': {
+                    'title': 'Quotation Queued',
+                    'message': f'Loopjet AI is busy, your quotation for {self.lead_id.name} is number {position} in the queue. You will be notified when it is ready.',
+                    'type': 'info',
+                    'sticky': False,
+                    'next': {'type': 'ir.actions.act_window_close'},
+                }
+            }
+        
+        return self._generate_with_ticket(company, timer, ticket_id)
+
+    def _run_queued_generation(self, ticket_id):
+        """Generate the estimate of a queued request whose ticket was started by the queue cron."""
+        self.ensure_one()
+        return self._generate_with_ticket(self._get_company(), LoopjetTimer(), ticket_id)
+
+    def _generate_with_ticket(self, company, timer, ticket_id):
+        """Generate the estimate under a running admission ticket, released whatever the outcome."""
+        sale_order_id = False
+        error = False
+        try:
+            # The ticket is kept alive by long streamed generations, see _generate_estimate_streamed
+            action = self.with_context(loopjet_generation_ticket_id=ticket_id)._generate_estimate(company, timer)
+            sale_order_id = action['res_id']
+            return action
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            raise
+        finally:
+            self.env['loopjet.generation.request']._release(ticket_id, sale_order_id=sale_order_id, error=error)
+
+    def _generate_estimate(self, company, timer):
+        """Call the Loopjet API, create the sale order and return the action opening it."""
         # Show loading notification to user immediately (appears as soon as button is clicked)
         # This provides instant feedback while the AI processes (30s-2min)
         message = {
@@ -95,20 +214,20 @@ class LoopjetGenerateEstimateWizard(models.TransientModel):
             'message': '⏱️ Loopjet AI is analyzing your deal and creating a quotation. This usually takes 30 seconds to 2 minutes. Please wait...',
             'sticky': True,  # Stays visible until completed
         }
-        self.env['bus.bus']._sendone(self.env.user.partner_id, 'notification', message)
+        self._notify_user(message)
         
         try:
             
-            # Get API configuration
-            api_key = self.env['ir.config_parameter'].sudo().get_param('loopjet.api_key')
-            if not api_key:
+            # Get API configuration for the opportunity's company
+            if not company._loopjet_get_api_key():
                 raise UserError(_('Loopjet API key not configured. Please go to Settings > Loopjet Integration and add your API key.'))
             
-            api_url = 'https://loopjet-api.fly.dev'
-            headers = {
-                'Authorization': f'Bearer {api_key}',
-                'Content-Type': 'application/json',
-            }
+            api_url = company._loopjet_get_api_url()
+            headers = company._loopjet_get_api_headers()
+            
+            # Push catalog changes made since the last sync so the AI quotes current prices
+            with timer.span('catalog_presync'):
+                self._presync_changed_products(company)
             
             # Prepare request data
             user_input = self.extracted_info
@@ -140,6 +259,14 @@ class LoopjetGenerateEstimateWizard(models.TransientModel):
                 'auto_save': False,  # We'll create the sale order in Odoo, not in Loopjet
             }
             
+            # Hint the AI with the catalog products closest to the deal
+            shortlist_size = int(self.env['ir.config_parameter'].sudo().get_param('loopjet.catalog_shortlist_size', 50))
+            if shortlist_size > 0:
+                with timer.span('catalog_shortlist'):
+                    candidate_ids = self.env['product.template']._loopjet_shortlist_catalog(user_input, company, shortlist_size)
+                if candidate_ids:
+                    request_data['candidate_product_ids'] = candidate_ids
+            
             # Get default language
             default_language = self.env['ir.config_parameter'].sudo().get_param('loopjet.default_language', 'en')
             
@@ -148,65 +275,42 @@ class LoopjetGenerateEstimateWizard(models.TransientModel):
             
             # Call Loopjet API (increased timeout for complex AI requests)
             url = f"{api_url}/api/v1/ai/generate-estimate"
-            response = requests.post(url, json=request_data, headers=headers, timeout=360)
+            stream = self.env['ir.config_parameter'].sudo().get_param('loopjet.stream_estimates', False)
+            if stream:
+                # Lines are added to a draft quotation while the AI is still working
+                with timer.span('ai_stream'):
+                    result, sale_order_id, sale_order_name = self._generate_estimate_streamed(company, url, request_data, headers, timer)
+            else:
+                with timer.span('ai_request'):
+                    response = company._loopjet_get_session().post(url, json=request_data, headers=headers, timeout=360)
+                    self._check_loopjet_response(response, company)
+                with timer.span('json_parse'):
+                    result = response.json()
             
-            if response.status_code == 402:
-                # Insufficient credits
-                error_data = response.json()
-                raise UserError(_(
-                    'Insufficient Loopjet Credits\n\n'
-                    f'{error_data.get("detail", {}).get("message", "You need more credits to generate estimates.")}\n\n'
-                    f'Current balance: {error_data.get("detail", {}).get("balance", 0)} credits\n'
-                    f'Required: {error_data.get("detail", {}).get("required", 0)} credits\n'
-                    f'Shortfall: {error_data.get("detail", {}).get("shortfall", 0)} credits\n\n'
-                    'Please purchase more credits in your Loopjet account.'
-                ))
-            
-            if response.status_code == 400:
-                # Handle validation errors (like no products available)
-                try:
-                    error_data = response.json()
-                    if isinstance(error_data.get('detail'), dict):
-                        # Structured error with helpful message
-                        error_msg = error_data['detail'].get('message', str(error_data))
-                    else:
-                        error_msg = str(error_data.get('detail', response.text))
-                except:
-                    error_msg = response.text
-                
-                raise UserError(_(f'Cannot Generate Quotation\n\n{error_msg}'))
-            
-            if response.status_code not in [200, 201]:
-                error_detail = response.json().get('detail', response.text) if response.headers.get('content-type', '').startswith('application/json') else response.text
-                raise UserError(_(
-                    f'Loopjet API Error (HTTP {response.status_code})\n\n'
-                    f'{error_detail}'
-                ))
-            
-            result = response.json()
             _logger.info(f"Received Loopjet API response with {len(result.get('items', []))} items")
             
-            # Store preview
-            preview_text = f"AI Reasoning:\n{result.get('reasoning', 'N/A')}\n\n"
-            preview_text += f"Generated {len(result.get('items', []))} estimate items:\n"
-            for idx, item in enumerate(result.get('items', []), 1):
-                preview_text += f"{idx}. {item.get('name')} - Qty: {item.get('quantity')} x {item.get('unit_price')} = {item.get('quantity') * item.get('unit_price')}\n"
-                if item.get('description'):
-                    preview_text += f"   Description: {item.get('description')}\n"
+            # Credits were spent, the cached balance is outdated
+            company._loopjet_set_credit_balance(None)
             
+            # Store preview
             self.write({
-                'estimate_preview': preview_text,
+                'estimate_preview': self._format_estimate_preview(result),
                 'state': 'done',
             })
             
-            # Create sale order
-            sale_order = self._create_sale_order_from_loopjet_response(result)
+            if not stream:
+                # Create sale order
+                with timer.span('order_creation'):
+                    sale_order = self._create_sale_order_from_loopjet_response(result, timer)
+                sale_order_id, sale_order_name = sale_order.id, sale_order.name
+            
+            self._record_timings(timer, success=True, sale_order_id=sale_order_id)
             
             # Show success notification
             success_message = {
                 'type': 'success',
                 'title': '✅ Quotation Created!',
-                'message': f'Successfully generated quotation {sale_order.name} with {len(result.get("items", []))} items.',
+                'message': f'Successfully generated quotation {sale_order_name} with {len(result.get("items", []))} items.',
                 'sticky': False,
             }
             self.env['bus.bus']._sendone(self.env.user.partner_id, 'notification', success_message)
@@ -216,7 +320,7 @@ class LoopjetGenerateEstimateWizard(models.TransientModel):
                 'name': _('AI-Generated Quotation'),
                 'type': 'ir.actions.act_window',
                 'res_model': 'sale.order',
-                'res_id': sale_order.id,
+                'res_id': sale_order_id,
                 'view_mode': 'form',
                 'target': 'current',
             }
@@ -224,6 +328,7 @@ class LoopjetGenerateEstimateWizard(models.TransientModel):
         except requests.exceptions.RequestException as e:
             error_msg = f"Failed to connect to Loopjet API: {str(e)}"
             _logger.error(error_msg)
+            self._record_timings(timer, success=False)
             self.write({
                 'state': 'error',
                 'error_message': error_msg,
@@ -233,30 +338,315 @@ class LoopjetGenerateEstimateWizard(models.TransientModel):
         except Exception as e:
             error_msg = f"Error generating estimate: {str(e)}"
             _logger.error(error_msg, exc_info=True)
+            self._record_timings(timer, success=False)
             self.write({
                 'state': 'error',
                 'error_message': error_msg,
             })
             raise UserError(_(error_msg))
 
-    def _create_sale_order_from_loopjet_response(self, loopjet_data):
+    def _record_timings(self, timer, success, sale_order_id=False):
+        """
+        Log the stage durations of a generation and store them for the timing statistics.
+        
+        Timings of a failed generation are stored on a separate cursor, since
+        the transaction of the generation is rolled back.
+        """
+        _logger.info(f"Loopjet estimate generation lead={self.lead_id.id} success={success} {timer.log_fields()}")
+        vals = {
+            'success': success,
+            'lead_id': self.lead_id.id,
+            'sale_order_id': sale_order_id,
+            'user_id': self.env.uid,
+            'company_id': self._get_company().id,
+        }
+        if success:
+            self.timing_summary = timer.summary()
+            self.env['loopjet.generation.timing']._store(timer, vals)
+            return
+        
+        try:
+            with self.env.registry.cursor() as cr:
+                self.env['loopjet.generation.timing'].with_env(self.env(cr=cr))._store(timer, vals)
+        except Exception as e:
+            _logger.warning(f"Could not store Loopjet generation timings: {str(e)}")
+
+    def _notify_user(self, message):
+        """
+        Push a notification to the current user immediately.
+        
+        Bus messages are only delivered when their transaction commits, so they
+        are sent on a dedicated cursor instead of waiting for the end of the
+        (long) generation request.
+        """
+        with self.env.registry.cursor() as cr:
+            env = self.env(cr=cr)
+            env['bus.bus']._sendone(env.user.partner_id, 'notification', message)
+
+    def _check_loopjet_response(self, response, company):
+        """
+        Turn an error response of the generate-estimate endpoint into a UserError.
+        
+        Args:
+            response: requests.Response returned by Loopjet
+            company: res.company whose account was used
+        """
+        if response.status_code == 402:
+            # Insufficient credits, remember the reported balance for the next attempts
+            error_data = response.json()
+            company._loopjet_set_credit_balance(error_data.get("detail", {}).get("balance"))
+            company._loopjet_set_required_credits(error_data.get("detail", {}).get("required"))
+            raise UserError(_(
+                'Insufficient Loopjet Credits\n\n'
+                f'{error_data.get("detail", {}).get("message", "You need more credits to generate estimates.")}\n\n'
+                f'Current balance: {error_data.get("detail", {}).get("balance", 0)} credits\n'
+                f'Required: {error_data.get("detail", {}).get("required", 0)} credits\n'
+                f'Shortfall: {error_data.get("detail", {}).get("shortfall", 0)} credits\n\n'
+                'Please purchase more credits in your Loopjet account.'
+            ))
+        
+        if response.status_code == 400:
+            # Handle validation errors (like no products available)
+            try:
+                error_data = response.json()
+                if isinstance(error_data.get('detail'), dict):
+                    # Structured error with helpful message
+                    error_msg = error_data['detail'].get('message', str(error_data))
+                else:
+                    error_msg = str(error_data.get('detail', response.text))
+            except:
+                error_msg = response.text
+            
+            raise UserError(_(f'Cannot Generate Quotation\n\n{error_msg}'))
+        
+        if response.status_code not in [200, 201]:
+            error_detail = response.json().get('detail', response.text) if response.headers.get('content-type', '').startswith('application/json') else response.text
+            raise UserError(_(
+                f'Loopjet API Error (HTTP {response.status_code})\n\n'
+                f'{error_detail}'
+            ))
+
+    def _format_estimate_preview(self, result):
+        """Build the preview text shown in the wizard from a Loopjet response."""
+        preview_text = f"AI Reasoning:\n{result.get('reasoning', 'N/A')}\n\n"
+        preview_text += f"Generated {len(result.get('items', []))} estimate items:\n"
+        for idx, item in enumerate(result.get('items', []), 1):
+            preview_text += f"{idx}. {item.get('name')} - Qty: {item.get('quantity')} x {item.get('unit_price')} = {item.get('quantity') * item.get('unit_price')}\n"
+            if item.get('description'):
+                preview_text += f"   Description: {item.get('description')}\n"
+        return preview_text
+
+    @api.model
+    def _iter_loopjet_stream_events(self, response):
+        """
+        Parse a streamed generate-estimate response into events.
+        
+        Events are dictionaries with a ``type``: ``item`` (one estimate line in
+        ``item``), ``progress`` (a ``message`` for the user), ``error`` (with a
+        ``detail``) and finally ``done`` (the complete response in ``estimate``).
+        Server-Sent Events and newline-delimited JSON are supported. A plain JSON
+        body, as returned by servers without streaming support or by a local
+        stub, is replayed as one ``item`` event per line followed by ``done``.
+        
+        Args:
+            response: requests.Response opened with stream=True
+        """
+        content_type = response.headers.get('content-type', '')
+        if content_type.startswith('application/json'):
+            result = response.json()
+            for item in result.get('items', []):
+                yield {'type': 'item', 'item': item}
+            yield {'type': 'done', 'estimate': result}
+            return
+        
+        is_sse = content_type.startswith('text/event-stream')
+        for line in response.iter_lines(decode_unicode=True):
+            if not line:
+                continue
+            if is_sse:
+                # Only data lines carry events, skip comments, ids and event names
+                if not line.startswith('data:'):
+                    continue
+                line = line[5:].strip()
+                if line == '[DONE]':
+                    continue
+            yield json.loads(line)
+
+    def _generate_estimate_streamed(self, company, url, request_data, headers, timer=None):
+        """
+        Generate the estimate in streaming mode, filling a draft quotation as items arrive.
+        
+        The draft quotation is built on a dedicated cursor committed after every
+        line, so the rep can open it while the AI is still working, and progress
+        is pushed over the bus. If generation fails midway, the partial draft is
+        removed again.
+        
+        Returns:
+            tuple: (complete Loopjet response, sale order id, sale order name)
+        """
+        stream_headers = dict(headers, Accept='application/x-ndjson, text/event-stream, application/json')
+        response = company._loopjet_get_session().post(
+            url, json=dict(request_data, stream=True), headers=stream_headers, timeout=360, stream=True)
+        
+        with closing(response), self.env.registry.cursor() as stream_cr:
+            self._check_loopjet_response(response, company)
+            
+            # The quotation is synced once complete, not after every committed line
+            wizard = self.with_env(self.env(cr=stream_cr)).with_context(loopjet_skip_sync=True)
+            sale_order = wizard.env['sale.order'].create(wizard._prepare_sale_order_vals({}))
+            sale_order_id, sale_order_name = sale_order.id, sale_order.name
+            stream_cr.commit()
+            _logger.info(f"Created draft sale order {sale_order_name} for streamed Loopjet estimate")
+            
+            try:
+                result = None
+                item_count = 0
+                ticket_id = self.env.context.get('loopjet_generation_ticket_id')
+                last_heartbeat = time.monotonic()
+                for event in self._iter_loopjet_stream_events(response):
+                    # A stream can outlast the generation timeout, tell the admission queue it is alive
+                    if ticket_id and time.monotonic() - last_heartbeat > _HEARTBEAT_INTERVAL:
+                        self.env['loopjet.generation.request']._heartbeat(ticket_id)
+                        last_heartbeat = time.monotonic()
+                    event_type = event.get('type')
+                    if event_type == 'item':
+                        wizard._create_sale_order_line(sale_order, event['item'], timer=timer)
+                        item_count += 1
+                        wizard.env['bus.bus']._sendone(wizard.env.user.partner_id, 'notification', {
+                            'type': 'info',
+                            'title': f'Quotation {sale_order_name}',
+                            'message': f'Added item {item_count}: {event["item"].get("name")}',
+                            'sticky': False,
+                        })
+                        stream_cr.commit()
+                    elif event_type == 'progress' and event.get('message'):
+                        wizard.env['bus.bus']._sendone(wizard.env.user.partner_id, 'notification', {
+                            'type': 'info',
+                            'title': f'Quotation {sale_order_name}',
+                            'message': event['message'],
+                            'sticky': False,
+                        })
+                        stream_cr.commit()
+                    elif event_type == 'error':
+                        raise UserError(_(f'Cannot Generate Quotation\n\n{event.get("detail", "Unknown error")}'))
+                    elif event_type == 'done':
+                        result = event.get('estimate') or {}
+                
+                if result is None:
+                    raise UserError(_('Loopjet closed the estimate stream before it was complete. Please try again.'))
+                
+                sale_order.write({
+                    'loopjet_estimate_data': json.dumps(result),
+                    'loopjet_reasoning': result.get('reasoning', ''),
+                    'note': result.get('notes', ''),
+                })
+                wizard._link_sale_order_to_lead(sale_order)
+                wizard._sync_generated_sale_order(sale_order)
+                stream_cr.commit()
+            except Exception:
+                stream_cr.rollback()
+                # The cleanup must not hide the error of the generation
+                try:
+                    sale_order.unlink()
+                    stream_cr.commit()
+                except Exception as cleanup_error:
+                    stream_cr.rollback()
+                    _logger.error(f"Could not remove the partial draft {sale_order_name} of a failed streamed Loopjet estimate: {cleanup_error}")
+                raise
+        
+        return result, sale_order_id, sale_order_name
+
+    def _presync_changed_products(self, company):
+        """
+        Push products changed since their last sync to Loopjet in one batch.
+        
+        Only the saleable products whose write date is newer than their last sync
+        are sent, so the AI sees current prices without a full catalog sync.
+        The pre-sync runs as interactive work on its own cursor, so it takes
+        precedence over bulk syncs and does not hold a sync slot for the whole
+        generation. Failures are logged and do not block estimate generation.
+        
+        Args:
+            company: res.company whose catalog is used for the estimate
+        """
+        with self.env.registry.cursor() as cr:
+            env = self.env(cr=cr)
+            stale_products = env['product.template']._loopjet_search_stale(company)
+            if not stale_products:
+                return
+            
+            if not env['loopjet.sync.job']._acquire_slot('interactive', timeout=5.0):
+                _logger.warning(f"No free Loopjet sync slot, skipping pre-sync of {len(stale_products)} changed products")
+                return
+            
+            _logger.info(f"Pre-syncing {len(stale_products)} products changed since their last Loopjet sync")
+            success_count, error_count = stale_products.with_company(company.with_env(env))._loopjet_batch_sync()
+            if error_count:
+                _logger.warning(f"Catalog pre-sync: {error_count} of {len(stale_products)} products failed, estimate may use outdated prices")
+
+    def _create_sale_order_from_loopjet_response(self, loopjet_data, timer=None):
         """
         Create Odoo sale order from Loopjet API response.
         
         Args:
             loopjet_data: Dictionary containing Loopjet API response
+            timer: optional LoopjetTimer collecting the duration of each step
             
         Returns:
             sale.order: Created sale order
         """
         self.ensure_one()
         
+        timer = timer or LoopjetTimer()
+        
+        # Build the whole quotation before anything is sent to Loopjet
+        wizard = self.with_context(loopjet_skip_sync=True)
+        
+        # Create sale order
+        with timer.span('order_header'):
+            sale_order = wizard.env['sale.order'].create(wizard._prepare_sale_order_vals(loopjet_data))
+        _logger.info(f"Created sale order {sale_order.name} from Loopjet estimate")
+        
+        # Create order lines from Loopjet items, matching all items to the catalog at once
+        items = loopjet_data.get('items', [])
+        with timer.span('product_matching'):
+            matches = wizard.env['product.product']._loopjet_match_items(items, sale_order.company_id) if items else []
+        for item_data, matched_product in zip(items, matches):
+            wizard._create_sale_order_line(sale_order, item_data, matched_product, timer)
+        
+        wizard._link_sale_order_to_lead(sale_order)
+        wizard._sync_generated_sale_order(sale_order)
+        
+        return sale_order.with_context(loopjet_skip_sync=False)
+
+    def _sync_generated_sale_order(self, sale_order):
+        """
+        Schedule the single sync of a completed AI quotation.
+        
+        Products created for the quotation are scheduled too, since their own
+        auto-sync was suppressed while the quotation was being built.
+        """
+        sale_order = sale_order.with_context(loopjet_skip_sync=False)
+        new_products = sale_order.order_line.product_id.product_tmpl_id.filtered(
+            lambda p: p.loopjet_needs_sync and not p.loopjet_synced and p.sale_ok)
+        for records in (new_products, sale_order):
+            if records and records._loopjet_auto_sync_enabled():
+                records._loopjet_schedule_sync()
+
+    def _prepare_sale_order_vals(self, loopjet_data):
+        """
+        Prepare the values of the sale order created from a Loopjet response.
+        
+        Args:
+            loopjet_data: Dictionary containing Loopjet API response
+        """
         # Prepare sale order values (customer already validated in action_generate_estimate)
         sale_order_vals = {
             'partner_id': self.customer_id.id,
             'loopjet_generated': True,
-            'loopjet_estimate_data': json.dumps(loopjet_data, indent=2),
+            'loopjet_estimate_data': json.dumps(loopjet_data),
             'loopjet_reasoning': loopjet_data.get('reasoning', ''),
+            'loopjet_deal_context': self.extracted_info,
             'note': loopjet_data.get('notes', ''),
             'date_order': fields.Datetime.now(),
         }
@@ -268,43 +658,41 @@ class LoopjetGenerateEstimateWizard(models.TransientModel):
         elif 'crm_lead_id' in SaleOrder._fields:
             sale_order_vals['crm_lead_id'] = self.lead_id.id
         
-        # Create sale order
-        sale_order = self.env['sale.order'].create(sale_order_vals)
-        _logger.info(f"Created sale order {sale_order.name} from Loopjet estimate")
-        
-        # Create order lines from Loopjet items
-        items = loopjet_data.get('items', [])
-        for item_data in items:
-            self._create_sale_order_line(sale_order, item_data)
-        
-        # Link sale order to lead (if the relationship field exists)
+        return sale_order_vals
+
+    def _link_sale_order_to_lead(self, sale_order):
+        """Link sale order to lead (if the relationship field exists)."""
         if hasattr(self.lead_id, 'order_ids'):
             self.lead_id.order_ids = [(4, sale_order.id)]
-        
-        return sale_order
 
-    def _create_sale_order_line(self, sale_order, item_data):
+    def _create_sale_order_line(self, sale_order, item_data, matched_product=False, timer=None):
         """
         Create sale order line from Loopjet item data.
         
         Args:
             sale_order: sale.order record
             item_data: Dictionary containing item information from Loopjet
+            matched_product: product.product found by fuzzy matching, None if no
+                product is close enough, False to match this item now
+            timer: optional LoopjetTimer collecting the duration of each step
         """
+        timer = timer or LoopjetTimer()
+        
         # Try to find matching product in Odoo
         product = None
         
         # First, try to match by Loopjet product_id
-        if item_data.get('product_id'):
-            product = self.env['product.product'].search([
-                ('product_tmpl_id.loopjet_product_id', '=', item_data['product_id'])
-            ], limit=1)
-        
-        # If not found, try to match by name
-        if not product and item_data.get('name'):
-            product = self.env['product.product'].search([
-                ('name', '=ilike', item_data['name'])
-            ], limit=1)
+        with timer.span('product_lookup'):
+            if item_data.get('product_id'):
+                product = self.env['product.product'].search([
+                    ('product_tmpl_id.loopjet_product_id', '=', item_data['product_id'])
+                ], limit=1)
+            
+            # If not found, use the product with the same name, or the closest one by name and description
+            if not product and item_data.get('name'):
+                if matched_product is False:
+                    matched_product = self.env['product.product']._loopjet_match_items([item_data], sale_order.company_id)[0]
+                product = matched_product
         
         # If still not found, create a new product
         if not product:
@@ -315,7 +703,8 @@ class LoopjetGenerateEstimateWizard(models.TransientModel):
                 'type': 'service',  # Default to service
                 'loopjet_product_id': item_data.get('product_id'),
             }
-            product = self.env['product.product'].create(product_vals)
+            with timer.span('product_creation'):
+                product = self.env['product.product'].create(product_vals)
             _logger.info(f"Created new product: {product.name}")
         
         # Calculate discount
@@ -326,11 +715,12 @@ class LoopjetGenerateEstimateWizard(models.TransientModel):
         tax_ids = []
         if tax_rate > 0:
             # Try to find matching tax
-            tax = self.env['account.tax'].search([
-                ('amount', '=', tax_rate),
-                ('type_tax_use', '=', 'sale'),
-                ('company_id', '=', sale_order.company_id.id),
-            ], limit=1)
+            with timer.span('tax_lookup'):
+                tax = self.env['account.tax'].search([
+                    ('amount', '=', tax_rate),
+                    ('type_tax_use', '=', 'sale'),
+                    ('company_id', '=', sale_order.company_id.id),
+                ], limit=1)
             if tax:
                 tax_ids = [(6, 0, [tax.id])]
         
@@ -352,9 +742,45 @@ class LoopjetGenerateEstimateWizard(models.TransientModel):
         elif 'tax_id' in self.env['sale.order.line']._fields:
             line_vals['tax_id'] = tax_ids
         
-        self.env['sale.order.line'].create(line_vals)
+        with timer.span('line_creation'):
+            self.env['sale.order.line'].create(line_vals)
         _logger.info(f"Created order line: {item_data['name']}")
 
+    def action_use_similar_estimate(self):
+        """
+        Create the quotation as a copy of the most similar past estimate, without calling the AI.
+        
+        The copy is not an AI estimate itself (the AI fields are not copied),
+        so it stays out of the similar estimate index.
+        """
+        self.ensure_one()
+        if not self.customer_id:
+            raise UserError(_('Customer Required\n\nPlease add a customer to the opportunity first.'))
+        
+        default = {
+            'partner_id': self.customer_id.id,
+            'date_order': fields.Datetime.now(),
+            'origin': self.similar_order_id.name,
+        }
+        SaleOrder = self.env['sale.order']
+        if 'opportunity_id' in SaleOrder._fields:
+            default['opportunity_id'] = self.lead_id.id
+        elif 'crm_lead_id' in SaleOrder._fields:
+            default['crm_lead_id'] = self.lead_id.id
+        
+        sale_order = self.similar_order_id.copy(default)
+        self._link_sale_order_to_lead(sale_order)
+        _logger.info(f"Created sale order {sale_order.name} from similar estimate {self.similar_order_id.name} ({self.similarity_score:.0f}% match)")
+        
+        return {
+            'name': _('Quotation from Similar Estimate'),
+            'type': 'ir.actions.act_window',
+            'res_model': 'sale.order',
+            'res_id': sale_order.id,
+            'view_mode': 'form',
+            'target': 'current',
+        }
+
     def action_retry(self):
         """Reset wizard to retry estimate generation."""
         self.write({